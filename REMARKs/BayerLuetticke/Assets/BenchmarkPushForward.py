@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+'''
+Timings of the histogram push-forward used by Fsys and JDiteration:
+dense transition matrix (former implementation), sparse CSR and the lottery
+kernel, on random policies for the grid sizes of the two-asset model, and
+of JDiteration and Fsys on the stored two-asset steady state EX3SS_20.
+
+Fsys pushes the histogram forward once per call with new policies, so H
+would have to be built in every call: there the lottery kernel, which never
+builds H, is compared with building H and one CSR product. JDiteration
+iterates with the same policies, so it builds H once and the comparison is
+per CSR product.
+
+Run from the BayerLuetticke folder:  python -m Assets.BenchmarkPushForward
+'''
+from __future__ import print_function
+
+import copy
+import os
+import pickle
+import numpy as np
+from scipy import sparse as sp
+import time
+
+from .SharedKernels import LotteryPushForward
+
+# dense matrices above this number of states are not built (8*N^2 bytes)
+MAX_DENSE = 6000
+
+
+def RandomLottery(nm, nk, nh, seed=0):
+    '''
+    Random lottery weights and destinations on an (nm, nk, nh) grid,
+    together with a productivity transition matrix.
+    '''
+    rng = np.random.RandomState(seed)
+    idm = rng.randint(0, nm-1, size=(nm, nk, nh))
+    idk = rng.randint(0, nk-1, size=(nm, nk, nh))
+    Dist_m = rng.rand(nm, nk, nh)
+    Dist_k = rng.rand(nm, nk, nh)
+    P = rng.rand(nh, nh)
+    P = P/np.sum(P, axis=1)[:, np.newaxis]
+
+    index11 = idm + nm*idk
+    index = [index11, index11+1, index11+nm, index11+nm+1]
+    weight = [(1.-Dist_m)*(1.-Dist_k), Dist_m*(1.-Dist_k), (1.-Dist_m)*Dist_k, Dist_m*Dist_k]
+
+    return index, weight, P
+
+
+def TransitionMatrix(index, weight, P):
+    '''
+    Builds the sparse transition matrix H (rows: today, columns: tomorrow)
+    corresponding to a lottery.
+    '''
+    nh = P.shape[0]
+    na = index[0].size // nh
+    N = na*nh
+
+    rows, cols, vals = [], [], []
+    origin = np.arange(N)
+    hh = origin // na
+    for idx, w in zip(index, weight):
+        idx = idx.flatten(order='F')
+        w = w.flatten(order='F')
+        for hnext in range(nh):
+            rows.append(origin)
+            cols.append(idx + na*hnext)
+            vals.append(w*P[hh, hnext])
+
+    return sp.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))), shape=(N, N))
+
+
+def PowerIteration(HT, JD, steps):
+    for it in range(steps):
+        JD = HT.dot(JD)
+        JD = JD/JD.sum()
+    return JD
+
+
+def Timeit(fun, repeat=20):
+    start_time = time.perf_counter()
+    for rr in range(repeat):
+        out = fun()
+    return (time.perf_counter()-start_time)/repeat, out
+
+
+def BenchmarkPushForward(sizes=((30, 30, 4), (50, 50, 8), (80, 80, 6)), repeat=20):
+    '''
+    Prints the time per push-forward and per steady-state iteration loop
+    for each grid size (nm, nk, nh).
+    '''
+    for nm, nk, nh in sizes:
+        index, weight, P = RandomLottery(nm, nk, nh)
+        N = nm*nk*nh
+        JD = np.ones((nm, nk, nh))/N
+
+        H = TransitionMatrix(index, weight, P)
+        HT = H.transpose().tocsr()
+
+        print('Grid (nm, nk, nh) = ', (nm, nk, nh), ', number of states: ', N)
+
+        t_lottery, JD_lottery = Timeit(lambda: LotteryPushForward(JD, index, weight, P), repeat)
+        t_csr, JD_csr = Timeit(lambda: HT.dot(JD.flatten(order='F')), repeat)
+        t_build, __ = Timeit(lambda: TransitionMatrix(index, weight, P).transpose().tocsr().dot(JD.flatten(order='F')), repeat)
+        print('  lottery kernel   : ', t_lottery, ' seconds per step')
+        print('  sparse CSR       : ', t_csr, ' seconds per step, H given')
+        print('  build H + CSR    : ', t_build, ' seconds per step, as Fsys would need')
+        print('  max difference   : ', np.max(np.abs(JD_lottery.flatten(order='F')-JD_csr)))
+
+        if N <= MAX_DENSE:
+            t_dense, __ = Timeit(lambda: JD.flatten(order='F').dot(H.todense()), max(repeat//10, 1))
+            print('  dense (former)   : ', t_dense, ' seconds per step')
+        else:
+            print('  dense (former)   :  skipped, needs ', 8.*N**2/1e9, ' GB')
+
+        # steady state: 1000 power iterations as in JDiteration
+        t_ss, __ = Timeit(lambda: PowerIteration(HT, JD.flatten(order='F'), 1000), 1)
+        print('  1000 JDiteration steps (CSR): ', t_ss, ' seconds')
+
+
+def BenchmarkTwoAsset(repeat=5):
+    '''
+    Prints the time of JDiteration and of one Fsys call at the steady state
+    EX3SS_20 (nm, nk, nh = 30, 30, 4), with a monetary policy shock and the
+    DCT accuracy 0.99999 of the two-asset notebook.
+    '''
+    two = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Two')
+    from .Two.SteadyStateTwoAsset import SteadyStateTwoAsset
+    from .Two.FluctuationsTwoAsset import FluctuationsTwoAsset, Fsys
+
+    with open(os.path.join(two, 'EX3SS_20.p'), 'rb') as f:
+        EX3SS = pickle.load(f)
+    EX3SS['par']['aggrshock'] = 'MP'
+    EX3SS['par']['rhoS'] = 0.0
+    EX3SS['par']['sigmaS'] = 0.001
+    EX3SS['par']['accuracy'] = 0.99999
+
+    SS = SteadyStateTwoAsset(copy.deepcopy(EX3SS['par']), copy.deepcopy(EX3SS['mpar']), copy.deepcopy(EX3SS['grid']))
+    t_jd, __ = Timeit(lambda: SS.JDiteration(EX3SS['joint_distr'], EX3SS['m_n_star'], EX3SS['m_a_star'],
+                                             EX3SS['cap_a_star'], EX3SS['P_H'], SS.par, SS.mpar, SS.grid), 1)
+
+    SR = FluctuationsTwoAsset(**copy.deepcopy(EX3SS)).StateReduc()
+    mpar = SR['mpar']
+    zeros = lambda n: np.zeros((n, 1))
+    FsysArgs = (SR['Xss'], SR['Yss'], SR['Gamma_state'], SR['indexMUdct'], SR['indexVKdct'], SR['par'], mpar,
+                SR['grid'], SR['targets'], SR['Copula'], SR['P_H'], SR['aggrshock'])
+    F = lambda: Fsys(zeros(mpar['numstates']), zeros(mpar['numstates']), zeros(mpar['numcontrols']),
+                     zeros(mpar['numcontrols']), *FsysArgs)
+    F()  # builds the cached DCT bases
+    t_fsys, __ = Timeit(F, repeat)
+
+    print('Steady state EX3SS_20, (nm, nk, nh) = ', (mpar['nm'], mpar['nk'], mpar['nh']))
+    print('  JDiteration      : ', t_jd, ' seconds')
+    print('  Fsys             : ', t_fsys, ' seconds per call')
+
+
+if __name__ == '__main__':
+
+    BenchmarkPushForward()
+    BenchmarkTwoAsset()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+'''
+Solution of the linearized rational expectations model
+
+    F1 X' + F2 Y' + F3 X + F4 Y = 0
+
+by one ordered generalized Schur (QZ) decomposition, as in Schmitt-Grohe
+and Uribe (2004): Y = gx X and X' = hx X.
+'''
+from __future__ import print_function
+
+import numpy as np
+from scipy import linalg
+from scipy.linalg import lapack
+import time
+
+
+def SolveLinearRE(F1, F2, F3, F4, numstates, overrideEigen=True):
+    '''
+    Computes the policy (gx) and transition (hx) matrices from the Jacobians
+    of the equilibrium conditions.
+
+    The QZ decomposition of the pencil (F1 F2, -(F3 F4)) is computed once;
+    its generalized eigenvalues give the number of explosive roots, and the
+    decomposition is then reordered in place (LAPACK tgsen) so that the
+    selected roots come first. gx and hx are obtained from LU and triangular
+    solves instead of explicit inverses.
+
+    Parameters
+    ----------
+    F1, F2, F3, F4 : np.array
+        Jacobians with respect to X', Y', X and Y
+    numstates : int
+        number of states (columns of F1 and F3)
+    overrideEigen : bool
+        if the number of roots outside the unit circle differs from numstates,
+        shift the critical eigenvalue so that exactly numstates roots are
+        selected (with a warning); otherwise only report it
+
+    Returns
+    -------
+    dict with
+    hx : np.array (numstates x numstates)
+    gx : np.array (numcontrols x numstates)
+    nk : int
+        number of selected (explosive) roots
+    eigenvalues : np.array
+        moduli of the generalized eigenvalues, sorted
+    rcond_z11, rcond_s11 : float
+        reciprocal condition numbers (1-norm estimates) of the matrices
+        that are solved for
+    time : dict
+        wall time in seconds of the 'qz', 'reorder' and 'solve' steps
+    '''
+    timing = {}
+
+    start_time = time.perf_counter()
+    s, t, Q, Z = linalg.qz(np.hstack((F1, F2)), -np.hstack((F3, F4)), output='complex')
+    timing['qz'] = time.perf_counter() - start_time
+
+    abst = abs(np.diag(t))*(abs(np.diag(t)) != 0.) + (abs(np.diag(t)) == 0.)*10**(-11)
+    relev = np.divide(abs(np.diag(s)), abst)
+
+    ll = np.sort(relev)
+    slt = relev >= 1
+    nk = int(np.sum(slt))
+
+    if nk > numstates:
+        if overrideEigen:
+            print('Warning: The Equilibrium is Locally Indeterminate, critical eigenvalue shifted to: ', str(ll[-1 - numstates]))
+            slt = relev > ll[-1 - numstates]
+            nk = int(np.sum(slt))
+        else:
+            print('No Local Equilibrium Exists, last eigenvalue: ', str(ll[-1 - numstates]))
+
+    elif nk < numstates:
+        if overrideEigen:
+            print('Warning: No Local Equilibrium Exists, critical eigenvalue shifted to: ', str(ll[-1 - numstates]))
+            slt = relev > ll[-1 - numstates]
+            nk = int(np.sum(slt))
+        else:
+            print('No Local Equilibrium Exists, last eigenvalue: ', str(ll[-1 - numstates]))
+
+    # move the selected roots to the top left of the existing decomposition
+    start_time = time.perf_counter()
+    tgsen, = lapack.get_lapack_funcs(('tgsen',), (s, t))
+    s_ord, t_ord, __, __, __, Z_ord, __, __, __, __, info = tgsen(slt.astype(np.int32), s, t, Q, Z,
+                                                                 ijob=0, wantq=0, wantz=1,
+                                                                 overwrite_a=1, overwrite_b=1, overwrite_z=1)
+    if info != 0:
+        raise linalg.LinAlgError('Reordering of the QZ decomposition failed (tgsen info=' + str(info) + ')')
+    timing['reorder'] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    z21 = Z_ord[nk:, 0:nk]
+    z11 = Z_ord[0:nk, 0:nk]
+    s11 = s_ord[0:nk, 0:nk]
+    t11 = t_ord[0:nk, 0:nk]
+
+    lu_z11 = linalg.lu_factor(z11)
+    gecon, = lapack.get_lapack_funcs(('gecon',), (lu_z11[0],))
+    rcond_z11, __ = gecon(lu_z11[0], np.linalg.norm(z11, 1))
+    trcon, = lapack.get_lapack_funcs(('trcon',), (s11,))
+    rcond_s11, __ = trcon(s11)
+
+    if rcond_z11 < np.finfo(float).eps*nk:
+        print('Warning: invertibility condition violated')
+
+    # gx = z21 inv(z11),  hx = z11 inv(s11) t11 inv(z11); M inv(z11) solves z11' X' = M'
+    gx = np.real(linalg.lu_solve(lu_z11, z21.T, trans=1).T)
+    hx = np.dot(z11, linalg.solve_triangular(s11, t11))
+    hx = np.real(linalg.lu_solve(lu_z11, hx.T, trans=1).T)
+    timing['solve'] = time.perf_counter() - start_time
+
+    print('QZ: ', timing['qz'], ' s, reordering: ', timing['reorder'], ' s, solve: ', timing['solve'],
+          ' s, rcond(z11): ', rcond_z11, ', rcond(s11): ', rcond_s11)
+
+    return {'hx': hx, 'gx': gx, 'nk': nk, 'eigenvalues': ll,
+            'rcond_z11': rcond_z11, 'rcond_s11': rcond_s11, 'time': timing}
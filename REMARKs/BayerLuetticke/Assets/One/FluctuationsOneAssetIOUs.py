@@ -3,8 +3,6 @@
 State Reduction, SGU_solver, Plot
 '''
 from __future__ import print_function
-import sys 
-sys.path.insert(0,'../')
 
 import numpy as np
 from numpy.linalg import matrix_rank
@@ -19,7 +17,11 @@ from scipy import sparse as sp
 from scipy import linalg
 from math import log, cos, pi
 import time
-from SharedFunc import Transition, ExTransitions, GenWeight, MakeGrid, Tauchen
+from ..LinearRE import SolveLinearRE
+from ..ParallelJacobian import FsysJacobian
+from ..StateSpace import ImpulseResponses
+from ..SharedKernels import AsSplineCopula, LotteryPushForward, MarginalPerturbation, Transition, ExTransitions, ExTransitionsDerivative, GenWeight, GenWeightJVP, MakeGrid, Tauchen
+from ..OneAssetHousehold import EGM_policyupdate, EGM_policyupdateJVP
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 
@@ -34,7 +36,7 @@ class FluctuationsOneAssetIOUs:
         self.targets = targets
         self.Vm = Vm
         self.joint_distr = joint_distr
-        self.Copula = Copula
+        self.Copula = AsSplineCopula(Copula)
         self.c_policy = c_policy
         self.m_policy = m_policy
         self.mutil_c = mutil_c
@@ -46,9 +48,8 @@ class FluctuationsOneAssetIOUs:
         invmutil = lambda x : (1./x)**(1./self.par['xi'])
 
         Xss=np.vstack((np.sum(self.joint_distr.copy(),axis=1), np.transpose(np.sum(self.joint_distr.copy(),axis=0)),log(self.par['RB']),0))
-        Yss=np.vstack((invmutil(np.reshape(self.mutil_c.copy(),(np.product(self.mutil_c.shape),1),order='F')),log(self.par['PI']),log(self.Output),log(self.par['W']),log(self.par['PROFITS']),log(self.par['N']),self.targets['B']))
+        Yss=np.vstack((invmutil(np.reshape(self.mutil_c.copy(),(np.prod(self.mutil_c.shape),1),order='F')),log(self.par['PI']),log(self.Output),log(self.par['W']),log(self.par['PROFITS']),log(self.par['N']),self.targets['B']))
         ## Construct Chebyshev Polynomials to describe deviations of policy from SS
-        Poly=[]
         maxlevel=max(self.mpar['nm'],self.mpar['nh'])
         
         Tm=np.cos(pi*np.arange(0,maxlevel,1)[np.newaxis].T * (np.linspace(0.5/self.mpar['nm']/2, 1-0.5/self.mpar['nm']*2, self.mpar['nm'])[np.newaxis])).T
@@ -56,56 +57,41 @@ class FluctuationsOneAssetIOUs:
 
         self.mpar['maxdim']=10
         
-        for j1 in range(0, max(np.shape(self.grid['h']))-1):
-          for j3 in range(0, max(np.shape(self.grid['m']))):
-            if j1 + j3 < self.mpar['maxdim']-2:
-                TT1,TT3=np.meshgrid(Tm[:,j3], np.vstack((Th[:,j1][np.newaxis].T,0.)), indexing='ij')
-                Poly.append((TT1.flatten(order='F')*TT3.flatten(order='F'))[np.newaxis].T)
-
-        for j2 in range(0,max(np.shape(self.grid['m']))):
-            if j2 < self.mpar['maxdim']- 2:
-               TT1,TT3=np.meshgrid(Tm[:,j2], np.vstack((np.zeros(max(np.shape(self.grid['h']))-1)[np.newaxis].T,1)), indexing='ij')
-               Poly.append((TT1.flatten(order='F')*TT3.flatten(order='F'))[np.newaxis].T)
-
-        Poly=np.squeeze(np.asarray(Poly)).T
-        InvCheb=linalg.solve(np.dot(Poly.T,Poly),Poly.T)
+        # products of Chebyshev polynomials in m and h of total degree below maxdim-2,
+        # and polynomials in m for the entrepreneur state (flattened in Fortran order)
+        nm = max(np.shape(self.grid['m']))
+        nh = max(np.shape(self.grid['h']))
+        j1, j3 = np.nonzero(np.add.outer(np.arange(nh-1), np.arange(nm)) < self.mpar['maxdim']-2)
+        Th_ext = np.vstack((Th[:,j1], np.zeros((1,len(j1)))))
+        Poly_mh = (Th_ext[:,np.newaxis,:]*Tm[:,j3][np.newaxis,:,:]).reshape(nh*nm, len(j1))
         
-        ## Construct function such that perturbed marginal distributions still integrate to 1
-        Gamma=np.zeros((self.mpar['nm'] + self.mpar['nh'], self.mpar['nm'] + self.mpar['nh'] - 3))
-
-        for j in range(0,self.mpar['nm'] - 1):
-              Gamma[0:self.mpar['nm'],j]= -np.squeeze(Xss[0:self.mpar['nm']])
-              Gamma[j,j]= 1. - Xss[j]
-              Gamma[j,j]=Gamma[j,j] - sum(Gamma[0:self.mpar['nm'],j])
+        j2 = np.arange(min(nm, self.mpar['maxdim']-2))
+        E_h = np.zeros(nh)
+        E_h[-1] = 1.
+        Poly_m = (E_h[:,np.newaxis,np.newaxis]*Tm[:,j2][np.newaxis,:,:]).reshape(nh*nm, len(j2))
         
-        bb=self.mpar['nm']
+        Poly = np.hstack((Poly_mh, Poly_m))
+        InvCheb=linalg.solve(np.dot(Poly.T,Poly),Poly.T)
         
-        for j in range(0,self.mpar['nh'] - 2):
-              Gamma[bb + np.asarray(range(0,self.mpar['nh'] - 1)), bb + j-1]= -np.squeeze(Xss[bb + np.asarray(range(0,self.mpar['nh'] - 1))])
-              Gamma[bb + j,bb - 1 + j]= 1 - Xss[bb + j]
-              Gamma[bb + j,bb - 1 + j]= Gamma[bb + j,bb - 1 + j] - sum(Gamma[bb + np.asarray(range(0,self.mpar['nh'] - 1)), bb - 1 + j])
+        ## Construct function such that perturbed marginal distributions still integrate to 1
+        # (the entrepreneur state, last point of h, is not perturbed)
+        Gamma_state = MarginalPerturbation(Xss, [(0, self.mpar['nm']), (self.mpar['nm'], self.mpar['nh']-1)],
+                                           self.mpar['nm'] + self.mpar['nh'])
   
             ## Collect all functions used for perturbation
         n1=np.array(np.shape(Poly))
-        n2=np.array(np.shape(Gamma))
+        n2=np.array(Gamma_state.shape)
 
         # Produce matrices to reduce state-space
         oc=len(Yss) - n1[0]
         os=len(Xss) - (self.mpar['nm'] + self.mpar['nh'])
 
-        InvGamma = np.zeros((1*n1[0] + n2[1] + 2 + oc, 1*n1[1] + n2[1] + 2 + oc))
-        Gamma_state = sp.coo_matrix((Gamma))
-        InvGamma[0:n2[0]+2, 0:n2[0]+2] = np.eye(n2[0] + 2)
-
         Gamma_control=np.zeros((1*n1[0] + oc, 1*n1[1] + oc))
         Gamma_control[0:n1[0],0:n1[1]]=Poly
-        InvGamma[(n2[1]+2+0):(n2[1]+2+n1[0]), (n2[1]+2+0):(n2[1]+2+n1[1])] = InvCheb.T
-
         Gamma_control[(1*n1[0]+0):(1*n1[0]+oc), (1*n1[1]+0):(1*n1[1]+oc)] = np.eye(oc)
-        InvGamma[(n2[1]+1*n1[0]+2+0):(n2[1]+1*n1[0]+2+oc), (n2[1]+1*n1[1]+2+0):(n2[1]+1*n1[1]+2+oc)] = np.eye(oc)
 
-        InvGamma=InvGamma.T
-        InvGamma=sp.coo_matrix((InvGamma))
+        # states, Chebyshev coefficients and aggregate controls are projected separately
+        InvGamma = sp.block_diag((sp.identity(n2[1] + 2), InvCheb, sp.identity(oc)), format='csr')
 
         self.mpar['numstates'] = n2[1] + 2
         self.mpar['numcontrols'] = n1[1] + oc
@@ -126,29 +112,106 @@ class FluctuationsOneAssetIOUs:
         
 
 
-def SGU_solver(Xss,Yss,Gamma_state,Gamma_control,InvGamma,Copula,par,mpar,grid,targets,P_H,aggrshock,oc): #
+def FsysStructure(mpar, Gamma_state, aggrshock, oc):
+    '''
+    Structure of the Jacobians of Fsys that is known without evaluating it.
+
+    Fsys is linear in the histogram states of t+1 and in S(t+1), which only
+    enter the left-hand side, so these columns of F1 are given by Gamma_state.
+    The other columns come with the residuals they can affect: controls of
+    t+1 only enter through the policies (liquid-asset histogram and policy
+    coefficients) and a few aggregate equations; productivity marginals are
+    not affected by policies, as the lottery preserves mass per productivity.
+
+    Parameters
+    ----------
+    mpar : dict
+        mpar['nm'], mpar['nh'], mpar['numstates'], mpar['numcontrols']
+    Gamma_state : MarginalPerturbation
+        mapping of the reduced histogram states to the marginals
+    aggrshock : str
+        'MP', 'TFP' or 'Uncertainty'
+    oc : int
+        number of aggregate controls
+
+    Returns
+    -------
+    dict with
+    F1_known_cols : np.array
+        columns of F1 known analytically
+    F1_known : np.array
+        these columns of F1
+    rows : dict
+        name ('F1'-'F4') -> dict column -> residual indices the column can
+        affect; columns not listed can affect all residuals
+    '''
+    nx = mpar['numstates']
+    NxNx = nx - 2
+    npoly = mpar['numcontrols'] - oc
+    RBind = NxNx
+    Sind = NxNx + 1
+
+    # aggregate controls, in the order of Fsys
+    AGG = {'PI': 0, 'Y': 1, 'W': 2, 'Profit': 3, 'N': 4, 'B': 5}
+    agg = lambda *names: [nx + npoly + AGG[name] for name in names]
+
+    policy_rows = np.concatenate((np.arange(mpar['nm']-1), nx + np.arange(npoly)))
+    empty = np.zeros(0, dtype=int)
+
+    # LHS marginals: Distribution[:nm-1] and Distribution[nm:nm+nh-2]
+    dist_rows = np.concatenate((np.arange(mpar['nm']-1), mpar['nm'] + np.arange(mpar['nh']-2)))
+    F1_known = np.zeros((nx + mpar['numcontrols'], NxNx + 1))
+    F1_known[:NxNx, :NxNx] = np.asarray(Gamma_state.dot(np.eye(NxNx)))[dist_rows, :]
+    F1_known[Sind, NxNx] = 1.
+
+    rows = {'F1': {RBind: np.concatenate(([RBind], policy_rows))},
+            'F2': {}, 'F3': {}, 'F4': {}}
+    for col in range(npoly):
+        rows['F2'][col] = policy_rows
+    # inflation and output of t+1 enter marginal costs, inflation also the real return;
+    # wages, profits and hours of t+1 do not enter Fsys
+    rows['F2'][npoly + AGG['PI']] = np.concatenate((policy_rows, agg('N', 'W', 'Profit')))
+    rows['F2'][npoly + AGG['Y']] = np.array(agg('N', 'W', 'Profit'))
+    for name in ('W', 'Profit', 'N'):
+        rows['F2'][npoly + AGG[name]] = empty
+    rows['F2'][npoly + AGG['B']] = np.array(agg('PI'))
+    if aggrshock == 'MP':
+        # S(t) only enters the Taylor rule and its own law of motion
+        rows['F3'][Sind] = np.array([RBind, Sind])
+
+    return {'F1_known_cols': np.append(np.arange(NxNx), Sind), 'F1_known': F1_known, 'rows': rows}
+
+
+def SGU_solver(Xss,Yss,Gamma_state,Gamma_control,InvGamma,Copula,par,mpar,grid,targets,P_H,aggrshock,oc,workers=None,structured=True,derivative='forward'): #
+    '''
+    workers : int
+        number of processes used for the Jacobian, None uses cpu_count()/2-1
+        and 1 computes all columns in the calling process
+    structured : bool
+        use the known structure of Fsys (FsysStructure) to skip and group
+        columns of the Jacobian; False perturbs every column separately
+    derivative : str or function
+        'forward' or 'central' differences, or a Jacobian-vector product of
+        Fsys such as FsysJVP, see ParallelJacobian.FsysJacobian. The step
+        1e-4 of the forward differences in RB, S and the controls crosses
+        kinks of the EGM step near the borrowing constraint, which the exact
+        derivative of FsysJVP does not see, so the two give different hx, gx
+    '''
 
     State       = np.zeros((mpar['numstates'],1))
     State_m     = State.copy()
     Contr       = np.zeros((mpar['numcontrols'],1))
     Contr_m     = Contr.copy()
         
-#        F = lambda S, S_m, C, C_m : Fsys(S, S_m, C, C_m,
-#                                         Xss,Yss,Gamma_state,Gamma_control,InvGamma,
-#                                         self.Copula,self.par,self.mpar,self.grid,self.targets,self.P_H,aggrshock,oc)
-    F = lambda S, S_m, C, C_m : Fsys(S, S_m, C, C_m,
-                                         Xss,Yss,Gamma_state,Gamma_control,InvGamma,
-                                         Copula,par,mpar,grid,targets,P_H,aggrshock,oc)
-        
+    FsysArgs = (Xss,Yss,Gamma_state,Gamma_control,InvGamma,
+                Copula,par,mpar,grid,targets,P_H,aggrshock,oc)
       
-    start_time = time.clock() 
-    result_F = F(State,State_m,Contr,Contr_m)
-    end_time   = time.clock()
+    start_time = time.perf_counter() 
+    result_F = Fsys(State,State_m,Contr,Contr_m,*FsysArgs)
+    end_time   = time.perf_counter()
     print('Elapsed time is ', (end_time-start_time), ' seconds.')
     Fb=result_F['Difference']
         
-    pool=cpu_count()/2-1
-
     F1=np.zeros((mpar['numstates'] + mpar['numcontrols'], mpar['numstates']))
     F2=np.zeros((mpar['numstates'] + mpar['numcontrols'], mpar['numcontrols']))
     F3=np.zeros((mpar['numstates'] + mpar['numcontrols'], mpar['numstates']))
@@ -158,160 +221,39 @@ def SGU_solver(Xss,Yss,Gamma_state,Gamma_control,InvGamma,Copula,par,mpar,grid,t
     print(' A *E[xprime uprime] =B*[x u]')
     print(' A = (dF/dxprimek dF/duprime), B =-(dF/dx dF/du)')
         
-    numscale=1
-    pnum=pool
-    packagesize=int(ceil(mpar['numstates'] / float(3*pnum)))
-    blocks=int(ceil(mpar['numstates'] / float(packagesize) ))
-
     par['scaleval1'] = 1e-9
     par['scaleval2'] = 1e-4
-        
-    start_time = time.clock()
-    print('Computing Jacobian F1=DF/DXprime F3 =DF/DX')
-    print('Total number of parallel blocks: ', str(blocks), '.')
-        
-    FF1=[]
-    FF3=[]
-        
-    for bl in range(0,blocks):
-        range_= range(bl*packagesize, min(packagesize*(bl+1),mpar['numstates']))
-        DF1=np.asmatrix( np.zeros((len(Fb),len(range_))) )
-        DF3=np.asmatrix( np.zeros((len(Fb),len(range_))) )
-        cc=np.zeros((mpar['numcontrols'],1))
-        ss=np.zeros((mpar['numstates'],1))
-        for Xct in range_:
-            X=np.zeros((mpar['numstates'],1))
-            h=par['scaleval1']
-            X[Xct]=h
-            Fx=F(ss,X,cc,cc)
-            DF3[:, Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-            Fx=F(X,ss,cc,cc)
-            DF1[:, Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-        if sum(range_ == mpar['numstates'] - 2) == 1:
-            Xct=mpar['numstates'] - 2
-            X=np.zeros((mpar['numstates'],1))
-            h=par['scaleval2']
-            X[Xct]=h
-            Fx=F(ss,X,cc,cc)
-            DF3[:,Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-            Fx=F(X,ss,cc,cc)
-            DF1[:,Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-        if sum(range_ == mpar['numstates'] - 1) == 1:
-            Xct=mpar['numstates'] - 1
-            X=np.zeros((mpar['numstates'],1))
-            h=par['scaleval2']
-            X[Xct]=h
-            Fx=F(ss,X,cc,cc)
-            DF3[:,Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-            Fx=F(X,ss,cc,cc)
-            DF1[:,Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-        FF1.append(DF1.copy())
-        FF3.append(DF3.copy())
-        print('Block number: ', str(bl),' done.')
-
-    for i in range(0,int(ceil(mpar['numstates'] / float(packagesize)) )):
-        range_= range(i*packagesize, min(packagesize*(i+1),mpar['numstates']))
-        F1[:,range_]=FF1[i]
-        F3[:,range_]=FF3[i]
-
-    end_time   = time.clock()
-    print('Elapsed time is ', (end_time-start_time), ' seconds.')
 
-    # jacobian wrt Y'
-    packagesize=int(ceil(mpar['numcontrols'] / (3.0*pnum)))
-    blocks=int(ceil(mpar['numcontrols'] / float(packagesize)))
-    print('Computing Jacobian F2 - DF/DYprime')
-    print('Total number of parallel blocks: ', str(blocks),'.')
+    # the two aggregate states (RB and S) use the larger step
+    state_cols  = np.arange(mpar['numstates'])
+    state_steps = np.where(state_cols >= mpar['numstates'] - 2, par['scaleval2'], par['scaleval1'])
+    contr_cols  = np.arange(mpar['numcontrols'])
+    contr_steps = np.full(mpar['numcontrols'], par['scaleval2'])
+    # only the last oc columns of F4 differ from the identity
+    oc_cols     = np.arange(mpar['numcontrols'] - oc, mpar['numcontrols'])
+
+    perturb = [('F1', state_cols, state_steps), ('F3', state_cols, state_steps),
+               ('F2', contr_cols, contr_steps), ('F4', oc_cols, np.full(oc, par['scaleval2']))]
+    
+    if structured:
+        structure = FsysStructure(mpar, Gamma_state, aggrshock, oc)
+        F1[:, structure['F1_known_cols']] = structure['F1_known']
+        perturb[0] = ('F1', np.setdiff1d(state_cols, structure['F1_known_cols']),
+                      state_steps[np.setdiff1d(state_cols, structure['F1_known_cols'])])
+        perturb = [(name, cols, steps, [structure['rows'][name].get(col) for col in cols])
+                   for name, cols, steps in perturb]
+
+    print('Computing Jacobian F1=DF/DXprime F3 =DF/DX F2=DF/DYprime F4=DF/DY')
+    FsysJacobian(Fsys, FsysArgs, Fb, mpar['numstates'], mpar['numcontrols'], perturb,
+                 {'F1': F1, 'F2': F2, 'F3': F3, 'F4': F4}, workers=workers, derivative=derivative)
+      
+    mpar.setdefault('overrideEigen', 1)
 
-    FF=[]
-        
-    start_time = time.clock()
-        
-    for bl in range(0,blocks):
-        range_= range(bl*packagesize,min(packagesize*(bl+1),mpar['numcontrols']))
-        DF2=np.asmatrix(np.zeros((len(Fb),len(range_))))
-        cc=np.zeros((mpar['numcontrols'],1))
-        ss=np.zeros((mpar['numstates'],1))
-        for Yct in range_:
-            Y=np.zeros((mpar['numcontrols'],1))
-            h=par['scaleval2']
-            Y[Yct]=h
-            Fx=F(ss,ss,Y,cc)
-            DF2[:,Yct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-        FF.append(DF2.copy())
-        print('Block number: ',str(bl),' done.')
+    resultRE = SolveLinearRE(F1, F2, F3, F4, mpar['numstates'], mpar['overrideEigen'])
+    hx = resultRE['hx']
+    gx = resultRE['gx']
 
-        
-    for i in range(0,int(ceil(mpar['numcontrols'] / float(packagesize) ))):
-        range_=range(i*packagesize, min(packagesize*(i+1),mpar['numcontrols']))
-        F2[:,range_]=FF[i]
-        
-    end_time = time.clock()
-    print('Elapsed time is ', (end_time-start_time), ' seconds.')
-        
-        
-    FF=[]
-    FF1=[]
-    FF3=[]
-        
-    cc=np.zeros((mpar['numcontrols'],1))
-    ss=np.zeros((mpar['numstates'],1))
-    
-    for Yct in range(0, oc):
-        Y=np.zeros((mpar['numcontrols'],1))
-        h=par['scaleval2']
-        Y[-1-Yct]=h
-        Fx=F(ss,ss,cc,Y)
-        F4[:,-1 - Yct]=(Fx['Difference'] - Fb) / h
-      
-    s,t,Q,Z=linalg.qz(np.hstack((F1,F2)), -np.hstack((F3,F4)), output='complex')
-        
-    relev=np.divide(abs(np.diag(s)), abs(np.diag(t)))
-    ll=sorted(relev)
-    slt=relev >= 1
-    nk=sum(slt)
-    slt=1*slt
-    mpar['overrideEigen']=1
-        
-    if nk > mpar['numstates']:
-       if mpar['overrideEigen']:
-          print('Warning: The Equilibrium is Locally Indeterminate, critical eigenvalue shifted to: ', str(ll[-1 - mpar['numstates']]))
-          slt=relev > ll[-1 - mpar['numstates']]
-          nk=sum(slt)
-       else:
-          print('No Local Equilibrium Exists, last eigenvalue: ', str(ll[-1 - mpar['numstates']]))
-        
-    elif nk < mpar['numstates']:
-       if mpar.overrideEigen:
-          print('Warning: No Local Equilibrium Exists, critical eigenvalue shifted to: ', str(ll[-1 - mpar['numstates']]))
-          slt=relev > ll[-1 - mpar['numstates']]
-          nk=sum(slt)
-       else:
-          print('No Local Equilibrium Exists, last eigenvalue: ', str(ll[-1 - mpar['numstates']]))
-
-    s_ord,t_ord,__,__,__,Z_ord=linalg.ordqz(np.hstack((F1,F2)), -np.hstack((F3,F4)), sort='ouc', output='complex')
-        
-        
-    z21=Z_ord[nk:,0:nk]
-    z11=Z_ord[0:nk,0:nk]
-    s11=s_ord[0:nk,0:nk]
-    t11=t_ord[0:nk,0:nk]
-    
-    if matrix_rank(z11) < nk:
-       print('Warning: invertibility condition violated')
-              
-#    z11i=linalg.solve(z11,np.eye(nk)) # A\B, Ax=B
-#    gx_= np.dot(z21,z11i)
-#    gx=gx_.real
-#    hx_=np.dot(z11,np.dot(linalg.solve(s11,t11),z11i))
-#    hx=hx_.real           
-
-    z11i  = np.dot(np.linalg.inv(z11), np.eye(nk)) # compute the solution
-
-    gx = np.real(np.dot(z21,z11i))
-    hx = np.real(np.dot(z11,np.dot(np.dot(np.linalg.inv(s11),t11),z11i)))
-         
-    return{'hx': hx, 'gx': gx, 'F1': F1, 'F2': F2, 'F3': F3, 'F4': F4, 'par': par }
+    return{'hx': hx, 'gx': gx, 'F1': F1, 'F2': F2, 'F3': F3, 'F4': F4, 'par': par, 'LinearRE': resultRE }
 
         
 def plot_IRF(mpar,par,gx,hx,joint_distr,Gamma_state,grid,targets,os,oc,Output):
@@ -319,23 +261,16 @@ def plot_IRF(mpar,par,gx,hx,joint_distr,Gamma_state,grid,targets,os,oc,Output):
     x0 = np.zeros((mpar['numstates'],1))
     x0[-1] = par['sigmaS']
         
-    MX = np.vstack((np.eye(len(x0)), gx))
-    IRF_state_sparse=[]
-    x=x0.copy()
     mpar['maxlag']=16
         
-    for t in range(0,mpar['maxlag']):
-        IRF_state_sparse.append(np.dot(MX,x))
-        x=np.dot(hx,x)
-        
-    IRF_state_sparse = np.asmatrix(np.squeeze(np.asarray(IRF_state_sparse))).T
+    IRF_state_sparse = np.asmatrix(ImpulseResponses(hx, gx, x0, mpar['maxlag'])[:, :, 0])
         
     aux = np.sum(np.sum(joint_distr,1),0)
         
     scale={}
     scale['h'] = np.tile(np.vstack((1,aux[-1])),(1,mpar['maxlag']))
         
-    IRF_distr = Gamma_state*IRF_state_sparse[:mpar['numstates']-2,:mpar['maxlag']]
+    IRF_distr = np.asmatrix(Gamma_state.dot(np.asarray(IRF_state_sparse[:mpar['numstates']-2,:mpar['maxlag']])))
         
     # preparation
         
@@ -516,8 +451,8 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
             
     ## State variables
     # read out marginal histogram in t+1, t
-    Distribution = StateSS[:-2].copy() + Gamma_state.copy().dot(State[:NxNx].copy())
-    Distributionminus = StateSS[:-2].copy() + Gamma_state.copy().dot(Stateminus[:NxNx].copy())
+    Distribution = StateSS[:-2].copy() + Gamma_state.dot(State[:NxNx].copy())
+    Distributionminus = StateSS[:-2].copy() + Gamma_state.dot(Stateminus[:NxNx].copy())
 
     # Aggregate Endogenous States
     RB = StateSS[-2] + State[-2]
@@ -598,6 +533,7 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     
     # Calculate joint distributions
     cumdist = np.zeros((mpar['nm']+1,mpar['nh']+1))
+    Copula = AsSplineCopula(Copula)
     cumdist[1:,1:] = Copula(np.squeeze(np.asarray(np.cumsum(marginal_mminus))),np.squeeze(np.asarray(np.cumsum(marginal_hminus)))).T
     JDminus = np.diff(np.diff(cumdist,axis=0),axis=1)
     
@@ -637,52 +573,21 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     
     ## Differences for distriutions
     # find next smallest on-grid value for money choices
-    weightl1 = np.zeros((mpar['nm'],mpar['nh'],mpar['nh']))
-    weightl2 = np.zeros((mpar['nm'],mpar['nh'],mpar['nh']))
-    
-    # Adjustment case
     result_genweight = GenWeight(m_star,grid['m'])
     Dist_m = result_genweight['weight'].copy()
     idm = result_genweight['index'].copy()
     
-    idm = np.tile(np.asmatrix(idm.copy().flatten('F')).T,(1,mpar['nh']))
-    idh = np.kron(range(mpar['nh']),np.ones((1,mpar['nm']*mpar['nh']))).astype(np.int64)
-    
-    indexl1 = np.ravel_multi_index([idm.flatten(order='F'),idh.flatten(order='F')],
-                                       (mpar['nm'],mpar['nh']),order='F')
-    indexl2 = np.ravel_multi_index([idm.flatten(order='F')+1,idh.flatten(order='F')],
-                                       (mpar['nm'],mpar['nh']),order='F')
-    
-    for hh in range(mpar['nh']):
-        
-        # corresponding weights
-        weightl1_aux = (1-Dist_m[:,hh])   ## dimension of Dist_m :1
-        weightl2_aux = Dist_m[:,hh]   ## dimension of Dist_m :1
-        
-        # dimensions (m*k,h',h)
-        weightl1[:,:,hh] = np.outer(weightl1_aux,P[hh,:])
-        weightl2[:,:,hh] = np.outer(weightl2_aux,P[hh,:])
-        
-    weightl1= np.ndarray.transpose(weightl1.copy(),(0,2,1))       
-    weightl2= np.ndarray.transpose(weightl2.copy(),(0,2,1))       
-    
-    rowindex = np.tile(range(mpar['nm']*mpar['nh']),(1,2*mpar['nh']))
-    
-    H = sp.coo_matrix((np.hstack((weightl1.flatten(order='F'),weightl2.flatten(order='F'))), 
-                   (np.squeeze(rowindex), np.hstack((np.squeeze(np.asarray(indexl1)),np.squeeze(np.asarray(indexl2)))) ))  , shape=(mpar['nm']*mpar['nh'],mpar['nm']*mpar['nh']) )
-
-        
-    JD_new = JDminus.flatten(order='F').copy().dot(H.todense())
-    JD_new = np.reshape(JD_new.copy(),(mpar['nm'],mpar['nh']),order='F')
+    # lottery over the two neighbouring grid points, then productivity transitions
+    JD_new = LotteryPushForward(JDminus, [idm, idm+1], [1.-Dist_m, Dist_m], P)
     
     # Next period marginal histograms
     # liquid assets
     aux_m = np.sum(JD_new.copy(),1)
-    RHS[marginal_mind] = aux_m[:-1].copy()
+    RHS[marginal_mind] = np.asmatrix(aux_m[:-1].copy()).T
     
     # human capital
     aux_h = np.sum(JD_new.copy(),0)
-    RHS[marginal_hind] = aux_h[:,:-2].copy().T
+    RHS[marginal_hind] = np.asmatrix(aux_h[:-2].copy()).T
     
     ## Third Set: Government Budget constraint
     # Return on bonds (Taylor Rule)
@@ -701,57 +606,243 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     return {'Difference':Difference, 'LHS':LHS, 'RHS':RHS, 'JD_new': JD_new, 'c_star':c_star,'m_star':m_star,'P':P}
 
 
-def EGM_policyupdate(EVm,PIminus,RBminus,inc,meshes,grid,par,mpar):
-    
-    ## EGM step 1
-    EMU = par['beta']*np.reshape(EVm.copy(),(mpar['nm'],mpar['nh']),order = 'F')
-    c_new = 1./np.power(EMU,(1./par['xi']))
-    # Calculate assets consistent with choices being (m')
-    # Calculate initial money position from the budget constraint,
-    # that leads to the optimal consumption choice
-    m_n_aux = (c_new.copy() + meshes['m'].copy()-inc['labor'].copy())
-    m_n_aux = m_n_aux.copy()/(RBminus/PIminus+(m_n_aux.copy()<0)*par['borrwedge']/PIminus)
-    
-    # Identify binding constraints
-    binding_constraints = meshes['m'].copy() < np.tile(m_n_aux[0,:].copy(),(mpar['nm'],1))
-    
-    # Consumption when drawing assets m' to zero: Eat all resources
-    Resource = inc['labor'].copy() + inc['money'].copy()
-    
-    m_n_aux = np.reshape(m_n_aux.copy(),(mpar['nm'],mpar['nh']),order='F')
-    c_n_aux = np.reshape(c_new.copy(),(mpar['nm'],mpar['nh']),order='F')
-    
-    # Interpolate grid['m'] and c_n_aux defined on m_n_aux over grid['m']
-    # Check monotonicity of m_n_aux
-    if np.sum(np.abs(np.diff(np.sign(np.diff(m_n_aux.copy(),axis=0)),axis=0)),axis=1).max() != 0:
-       print(' Warning: non monotone future liquid asset choice encountered ')
-       
-    c_star = np.zeros((mpar['nm'],mpar['nh']))
-    m_star = np.zeros((mpar['nm'],mpar['nh']))
-    
-    for hh in range(mpar['nh']):
-         
-        Savings = interp1d(np.squeeze(np.asarray(m_n_aux[:,hh].copy())), grid['m'].copy(), fill_value='extrapolate')
-        m_star[:,hh] = Savings(grid['m'].copy())
-        Consumption = interp1d(np.squeeze(np.asarray(m_n_aux[:,hh].copy())), np.squeeze(np.asarray(c_n_aux[:,hh].copy())), fill_value='extrapolate')
-        c_star[:,hh] = Consumption(grid['m'].copy())
-    
-    c_star[binding_constraints] = np.squeeze(np.asarray(Resource[binding_constraints].copy() - grid['m'][0]))
-    m_star[binding_constraints] = grid['m'].min()
-    
-    m_star[m_star>grid['m'][-1]] = grid['m'][-1]
-    
-    return {'c_star': c_star, 'm_star': m_star}
-        
+def FsysJVP(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, ControlSS,
+            Gamma_state, Gamma_control, InvGamma, Copula, par, mpar, grid, targets, P, aggrshock, oc):
+    '''
+    Derivative of Fsys at the steady state (all deviations zero) along the
+    direction (State, Stateminus, Control_sparse, Controlminus_sparse), by
+    forward-mode differentiation of each step of Fsys. This is the exact
+    Jacobian-vector product for FsysJacobian(..., derivative=FsysJVP) or
+    SGU_solver(..., derivative=FsysJVP).
+
+    The kinks of Fsys are kept where they are at the steady state: binding
+    borrowing constraints, interpolation segments of the EGM step and the
+    grid intervals of the lottery. Where the marginal CDFs lie on the
+    boundary of the copula grid, the derivative is one-sided in the
+    direction given (see SplineCopula.JVP), as forward differences are.
+
+    Parameters
+    ----------
+    State, Stateminus : np.array (column vector)
+        direction of the states in t+1 and t
+    Control_sparse, Controlminus_sparse : np.array (column vector)
+        direction of the controls in t+1 and t
+    StateSS, ControlSS, Gamma_state, Gamma_control, InvGamma, Copula, par,
+    mpar, grid, targets, P, aggrshock, oc :
+        see Fsys
+
+    Returns
+    -------
+    dDifference : np.array (column vector)
+        derivative of Fsys(...)['Difference'] along the direction
+    '''
+    mutil = lambda x : 1./np.power(x,par['xi'])
+
+    meshesm, meshesh = np.meshgrid(grid['m'],grid['h'],indexing='ij')
+    meshes ={'m':meshesm, 'h':meshesh}
+
+    nx = mpar['numstates'] # number of states
+    NxNx= nx -2 # number of states w/o aggregates
+    NN = mpar['nm']*mpar['nh'] # number of points in the full grid
+    nm = mpar['nm']
+    nh = mpar['nh']
+
+    ## Indexes for LHS/RHS, as in Fsys
+    mutil_cind = np.array(range(NN))
+    PIind = 1*NN
+    Yind = 1*NN+1
+    Wind = 1*NN+2
+    Profitind = 1*NN+3
+    Nind = 1*NN+4
+    Bind = 1*NN+5
+
+    marginal_mind = range(nm-1)
+    marginal_hind = range(nm-1,nm+nh-3)
+
+    RBind = NxNx
+    Sind = NxNx+1
+
+    # derivatives of both sides
+    LHS = np.zeros((nx+Bind+1,1))
+    RHS = np.zeros((nx+Bind+1,1))
+
+    State, Stateminus, Control_sparse, Controlminus_sparse = [np.asarray(v, dtype=float).ravel()
+        for v in (State, Stateminus, Control_sparse, Controlminus_sparse)]
+    StateSS = np.asarray(StateSS, dtype=float).ravel()
+    Control = np.asarray(ControlSS, dtype=float).ravel()
+
+    ## Control variables: steady state and derivatives
+    dControl = Control*Gamma_control.dot(Control_sparse)
+    dControlminus = Control*Gamma_control.dot(Controlminus_sparse)
+    dControl[-oc:] = Gamma_control[-oc:,:].dot(Control_sparse)
+    dControlminus[-oc:] = Gamma_control[-oc:,:].dot(Controlminus_sparse)
+
+    ## State variables
+    dDistribution = np.ravel(Gamma_state.dot(State[:NxNx]))
+    dDistributionminus = np.ravel(Gamma_state.dot(Stateminus[:NxNx]))
+
+    mutil_c = mutil(Control[mutil_cind])
+    dmutil_c = -par['xi']*mutil_c/Control[mutil_cind]*dControl[mutil_cind]
+
+    PI = np.exp(Control[PIind])
+    dPI = PI*dControl[PIind]
+    Y = np.exp(Control[Yind])
+    dY = Y*dControl[Yind]
+
+    PIminus = PI
+    dPIminus = PIminus*dControlminus[PIind]
+    Yminus = Y
+    dYminus = Yminus*dControlminus[Yind]
+    Wminus = np.exp(Control[Wind])
+    dWminus = Wminus*dControlminus[Wind]
+    Profitminus = np.exp(Control[Profitind])
+    dProfitminus = Profitminus*dControlminus[Profitind]
+    Nminus = np.exp(Control[Nind])
+    dNminus = Nminus*dControlminus[Nind]
+
+    ## Write LHS values
+    LHS[nx+mutil_cind,0] = dControlminus[mutil_cind] # invmutil(mutil(c)) = c
+    LHS[nx+Yind,0] = dYminus
+    LHS[nx+Wind,0] = dWminus
+    LHS[nx+Profitind,0] = dProfitminus
+    LHS[nx+Nind,0] = dNminus
+    LHS[nx+Bind,0] = dControlminus[Bind]
+
+    LHS[marginal_mind,0] = dDistribution[:nm-1]
+    LHS[marginal_hind,0] = dDistribution[nm:nm+nh-2]
+
+    LHS[RBind,0] = State[-2]
+    LHS[Sind,0] = State[-1]
+
+    # RB is in logs
+    RB = np.exp(StateSS[-2])
+    dRB = RB*State[-2]
+    RBminus = RB
+    dRBminus = RBminus*Stateminus[-2]
+
+    ## Exogenous process
+    RHS[Sind,0] = par['rhoS']*Stateminus[-1]
+
+    Sminus = StateSS[-1]
+    dSminus = Stateminus[-1]
+    P = np.asarray(P)
+    dP = np.zeros(np.shape(P))
+    dEPS_TAYLOR = 0.
+    dTFP = 0.
+    if aggrshock == 'MP':
+        TFP = 1.0
+        dEPS_TAYLOR = dSminus
+    elif aggrshock == 'TFP':
+        TFP = np.exp(Sminus)
+        dTFP = TFP*dSminus
+    elif aggrshock == 'Uncertainty':
+        TFP = 1.0
+        P = ExTransitions(np.exp(Sminus), grid, mpar, par)['P_H']
+        dP = ExTransitionsDerivative(np.exp(Sminus), grid, mpar, par)*np.exp(Sminus)*dSminus
+
+    marginal_mminus = StateSS[:nm]
+    dmarginal_mminus = dDistributionminus[:nm]
+    marginal_hminus = StateSS[nm:nm+nh]
+    dmarginal_hminus = dDistributionminus[nm:nm+nh]
+
+    Hminus = np.sum(grid['h'][:-1]*marginal_hminus[:-1])
+    dHminus = np.sum(grid['h'][:-1]*dmarginal_hminus[:-1])
+
+    RHS[nx+Bind,0] = np.sum(grid['m']*dmarginal_mminus)
+
+    ## Joint distribution from the copula
+    cumdist = np.zeros((nm+1,nh+1))
+    dcumdist = np.zeros((nm+1,nh+1))
+    Copula_aux, dCopula_aux = AsSplineCopula(Copula).JVP(np.cumsum(marginal_mminus), np.cumsum(marginal_hminus),
+                                                         np.cumsum(dmarginal_mminus), np.cumsum(dmarginal_hminus))
+    cumdist[1:,1:] = Copula_aux.T
+    dcumdist[1:,1:] = dCopula_aux.T
+    JDminus = np.diff(np.diff(cumdist,axis=0),axis=1)
+    dJDminus = np.diff(np.diff(dcumdist,axis=0),axis=1)
+
+    ## Aggregate Output
+    mc = par['mu'] - (par['beta']* np.log(PI)*Y/Yminus - np.log(PIminus))/par['kappa']
+    dmc = -(par['beta']*(dPI/PI*Y/Yminus + np.log(PI)*(dY/Yminus - Y*dYminus/Yminus**2)) - dPIminus/PIminus)/par['kappa']
+
+    Kshare = grid['K']**(1-par['alpha'])
+    exponent = 1/(1-par['alpha']+par['gamma'])
+    Nbase = par['tau']*TFP*par['alpha']*Kshare*mc
+    dNbase = par['tau']*par['alpha']*Kshare*(dTFP*mc + TFP*dmc)
+    RHS[nx+Nind,0] = exponent*Nbase**(exponent-1)*dNbase
+    RHS[nx+Yind,0] = 0.25*Kshare*(dTFP*Nminus**par['alpha'] + TFP*par['alpha']*Nminus**(par['alpha']-1)*dNminus)
+
+    # Wage Rate
+    RHS[nx+Wind,0] = 0.25*par['alpha']*Kshare*((dTFP*mc + TFP*dmc)*Nminus**(par['alpha']-1) +
+                                               TFP*mc*(par['alpha']-1)*Nminus**(par['alpha']-2)*dNminus)
+
+    # Profits for Enterpreneurs
+    adjustment = (1/(1-par['mu']))/par['kappa']/2
+    RHS[nx+Profitind,0] = (-dmc*Yminus + (1-mc)*dYminus -
+                           adjustment*(dYminus*np.log(PIminus)**2 + Yminus*2*np.log(PIminus)*dPIminus/PIminus))
+
+    ## Wages net of leisure services
+    WW = par['gamma']/(1+par['gamma'])*(Nminus/Hminus)*Wminus*np.ones((nm,nh))
+    WW[:,-1] = Profitminus*par['profitshare']
+    dWW = par['gamma']/(1+par['gamma'])*(dNminus/Hminus*Wminus - Nminus*dHminus/Hminus**2*Wminus +
+                                         Nminus/Hminus*dWminus)*np.ones((nm,nh))
+    dWW[:,-1] = dProfitminus*par['profitshare']
+
+    ## Incomes (grids)
+    wedge = (meshes['m']<0)*par['borrwedge']
+    inc = {'labor': par['tau']*WW*meshes['h'],
+           'money': meshes['m']*(RBminus/PIminus+wedge/PIminus)}
+    dinc = {'labor': par['tau']*dWW*meshes['h'],
+            'money': meshes['m']*(dRBminus/PIminus - (RBminus+wedge)*dPIminus/PIminus**2)}
+
+    ## Update policies
+    RBaux = (RB+wedge)/PI
+    dRBaux = dRB/PI - (RB+wedge)*dPI/PI**2
+    # as in Fsys, RBaux is flattened in C order
+    EVm_aux = np.reshape(RBaux.flatten()*mutil_c,(nm,nh),order='F')
+    dEVm_aux = np.reshape(dRBaux.flatten()*mutil_c + RBaux.flatten()*dmutil_c,(nm,nh),order='F')
+    EVm = EVm_aux.dot(P.T)
+    dEVm = dEVm_aux.dot(P.T) + EVm_aux.dot(dP.T)
+
+    result_EGM_policyupdate = EGM_policyupdateJVP(EVm,dEVm,PIminus,dPIminus,RBminus,dRBminus,inc,dinc,meshes,grid,par,mpar)
+
+    ## Update Marginal Value Bonds
+    RHS[nx+mutil_cind,0] = result_EGM_policyupdate['dc_star'].flatten(order='F') # invmutil(mutil(c)) = c
+
+    ## Differences for distributions
+    result_genweight = GenWeightJVP(result_EGM_policyupdate['m_star'],result_EGM_policyupdate['dm_star'],grid['m'])
+    Dist_m = result_genweight['weight']
+    dDist_m = result_genweight['dweight']
+    index = [result_genweight['index'], result_genweight['index']+1]
+
+    # the lottery is linear in the histogram, in the weights and in P
+    dJD_new = (LotteryPushForward(dJDminus, index, [1.-Dist_m, Dist_m], P) +
+               LotteryPushForward(JDminus, index, [-dDist_m, dDist_m], P) +
+               LotteryPushForward(JDminus, index, [1.-Dist_m, Dist_m], dP))
+
+    RHS[marginal_mind,0] = np.sum(dJD_new,1)[:-1]
+    RHS[marginal_hind,0] = np.sum(dJD_new,0)[:-2]
+
+    ## Taylor rule
+    RHS[RBind,0] = par['rho_R']*Stateminus[-2] + (1.-par['rho_R'])*par['theta_pi']*dPIminus/PIminus + dEPS_TAYLOR
+
+    # real bond supply
+    LHS[nx+PIind,0] = dControl[Bind]
+
+    return InvGamma.dot( (LHS-RHS)/np.vstack(( np.ones((nx,1)),np.asarray(ControlSS[:-oc]),np.ones((oc,1)) )) )
+
+
 ###############################################################################
 
 if __name__ == '__main__':
     
+    import os
     from copy import copy
-    from time import clock
-    import pickle
+    from . import defineSSParameters as Params
+    from .SteadyStateOneAssetIOUs import SteadyStateOneAssetIOU
+    from ..SteadyStateStore import CachedSteadyState
     
-    EX1SS=pickle.load(open("EX1SS_nm50.p", "rb"))
+    EX1SS = CachedSteadyState(SteadyStateOneAssetIOU, seed=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'EX1SS.p'),
+                              **copy(Params.parm_one_asset_IOU))
 
     EX1SR=FluctuationsOneAssetIOUs(**EX1SS)
 
@@ -46,6 +46,7 @@ gridK = 3.2701 # keep fixed at SS of economy with bonds and capital
 
 ## Numerical Parameters
 mparcrit    = 10**(-11)
+mparJDsolver = 'direct' # Ergodic distribution: 'eigs', 'direct' or 'power' (warm start)
 
 # Make a dictionary to specify a HANK model with one asset IOUs
 par_one_asset_IOU = { 'beta': parbeta, 'xi': parxi, 'gamma': pargamma,
@@ -54,7 +55,8 @@ par_one_asset_IOU = { 'beta': parbeta, 'xi': parxi, 'gamma': pargamma,
                      'theta_pi': partheta_pi, 'rho_R': parrho_R, 'tau': partau, 'PI': parPI,
                      'RB': parRB, 'borrwedge': parborrwedge }
 mpar_one_asset_IOU = { 'in': mparin, 'out': mparout, 'nm': mparnm, 'nh': mparnh,
-                      'tauchen': mpartauchen, 'crit': mparcrit }
+                      'tauchen': mpartauchen, 'crit': mparcrit,
+                      'JDsolver': mparJDsolver }
 grid_one_asset_IOU = { 'K': gridK }
 
 parm_one_asset_IOU = {'par': par_one_asset_IOU, 'mpar': mpar_one_asset_IOU, 'grid': grid_one_asset_IOU}
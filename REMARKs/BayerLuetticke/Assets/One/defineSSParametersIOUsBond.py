@@ -57,6 +57,7 @@ gridm_max_art = 2000
 
 ## Numerical Parameters
 mparcrit    = 10**(-11)
+mparJDsolver = 'direct' # Ergodic distribution: 'eigs', 'direct' or 'power' (warm start)
 
 # Make a dictionary to specify a HANK model with one asset IOUs
 par_one_asset_IOUsBond = { 'beta': parbeta, 'xi': parxi, 'gamma': pargamma,
@@ -65,7 +66,8 @@ par_one_asset_IOUsBond = { 'beta': parbeta, 'xi': parxi, 'gamma': pargamma,
                      'theta_pi': partheta_pi, 'rho_R': parrho_R, 'tau': partau, 'PI': parPI,
                      'RB': parRB, 'borrwedge': parborrwedge, 'gamma_b': pargamma_b, 'gamma_pi': pargamma_pi, 'BtoY': parBtoY }
 mpar_one_asset_IOUsBond = { 'in': mparin, 'out': mparout, 'nm': mparnm, 'nh': mparnh,
-                      'tauchen': mpartauchen, 'crit': mparcrit }
+                      'tauchen': mpartauchen, 'crit': mparcrit,
+                      'JDsolver': mparJDsolver }
 grid_one_asset_IOUsBond = { 'K': gridK, 'm_min': gridm_min_art, 'm_max': gridm_max_art}
 
 parm_one_asset_IOUsBond = {'par': par_one_asset_IOUsBond, 'mpar': mpar_one_asset_IOUsBond, 'grid': grid_one_asset_IOUsBond}
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+'''
+Household block shared by the one-asset models (IOUs and IOUs with a
+government bond): steady-state EGM and histogram, productivity process and
+the EGM step of the equilibrium conditions Fsys
+'''
+from __future__ import print_function
+
+import numpy as np
+from scipy import sparse as sp
+from .SharedKernels import ErgodicDistribution, BatchInterp1d, BatchInterp1dJVP, Transition, GenWeight, Tauchen
+
+
+class OneAssetHousehold(object):
+    '''
+    Steady-state household methods of the one-asset models, inherited by
+    SteadyStateOneAssetIOU and SteadyStateOneAssetIOUsBond
+    '''
+
+    def JDiteration(self, m_star, P_H, mpar, grid, joint_distr=None):
+        '''
+        Iterates the joint distribution over m,k,h using a transition matrix
+        obtained from the house distributing the households optimal choices. 
+        It distributes off-grid policies to the nearest on grid values.
+        
+        parameters
+        ------------
+        m_star :np.array
+            optimal m func
+        P_H : np.array
+            transition probability    
+        mpar : dict
+             parameters    
+        grid : dict
+             grids
+        joint_distr : np.array
+             starting guess, e.g. from the previous interest rate
+             
+        returns
+        ------------
+        joint_distr : np.array
+            joint distribution of m and h
+        
+        '''
+        ## find next smallest on-grid value for money and capital choices
+        weight11  = np.zeros((mpar['nm'], mpar['nh'],mpar['nh']))
+        weight12  = np.zeros((mpar['nm'], mpar['nh'],mpar['nh']))
+    
+        # Adjustment case
+        resultGW = GenWeight(m_star, grid['m'])
+        Dist_m = resultGW['weight'].copy()
+        idm = resultGW['index'].copy()
+        
+        idm = np.transpose(np.tile(idm.flatten(order='F'),(mpar['nh'],1)))
+        idh = np.kron(range(mpar['nh']),np.ones((1,mpar['nm']*mpar['nh'])))
+        idm = idm.copy().astype(int)
+        idh = idh.copy().astype(int)
+        
+        
+        index11 = np.ravel_multi_index([idm.flatten(order='F'), idh.flatten(order='F')],(mpar['nm'],mpar['nh']),order='F')
+        index12 = np.ravel_multi_index([idm.flatten(order='F')+1, idh.flatten(order='F')],(mpar['nm'],mpar['nh']),order='F')
+        
+        
+        for hh in range(mpar['nh']):
+        
+            # Corresponding weights
+            weight11_aux = (1.-Dist_m[:,hh].copy())
+            weight12_aux =  (Dist_m[:,hh].copy())
+    
+            # Dimensions (mxk,h',h)   
+            weight11[:,:,hh]=np.outer(weight11_aux.flatten(order='F'),P_H[hh,:].copy())
+            weight12[:,:,hh]=np.outer(weight12_aux.flatten(order='F'),P_H[hh,:].copy())
+        
+            
+        
+        weight11 = np.ndarray.transpose(weight11.copy(),(0,2,1))
+        weight12 = np.ndarray.transpose(weight12.copy(),(0,2,1))
+        
+        rowindex = np.tile(range(mpar['nm']*mpar['nh']),(1,2*mpar['nh']))
+        
+        
+        H = sp.coo_matrix((np.concatenate((weight11.flatten(order='F'),weight12.flatten(order='F'))), 
+                       (rowindex.flatten(), np.concatenate((index11.flatten(order='F'),index12.flatten(order='F'))))),shape=(mpar['nm']*mpar['nh'], mpar['nm']*mpar['nh']))
+        
+        ## Joint transition matrix and transitions
+        
+        resultED = ErgodicDistribution(H, mpar.get('JDsolver','eigs'), joint_distr)
+        print('Joint distribution (', mpar.get('JDsolver','eigs'), '): iterations ', resultED['iterations'],
+              ', residual ', resultED['residual'], ', elapsed time ', resultED['time'], ' seconds.')
+            
+        return resultED['joint_distr']
+           
+        
+    def PoliciesSS(self,c_guess, grid, inc, RBRB, P, mpar, par):
+        '''
+        solves for the household policies for consumption and bonds by EGM
+        
+        parameters
+        -----------
+        c_guess : np.array
+               guess for c
+        grid : dict
+             grids
+        inc : dict
+            guess for incomes      
+        RBRB : float    
+            interest rate   
+        P : np.array
+            transition probability    
+        par : dict
+             parameters
+        mpar : dict
+             parameters    
+             
+        returns
+        ----------
+        c_new : np.array
+            optimal c func
+        m_star :np.array
+            optimal m func
+        distPOL : float
+            distance of convergence in functions
+        '''
+    
+        ## Apply EGM to slove for optimal policies and marginal utilities
+        money_expense = np.transpose(np.tile(grid['m'],(mpar['nh'],1)))
+        distC = 99999.
+    
+        count = 0
+    
+        while np.max((distC)) > mpar['crit']:
+        
+            count = count+1
+        
+            ## update policies
+            mutil_c = 1./(c_guess.copy()**par['xi'])
+        
+            aux = np.reshape(np.ndarray.transpose(mutil_c.copy(),(1,0)),(mpar['nh'],mpar['nm']) )
+        
+            # form expectations
+            EMU_aux = par['beta']*RBRB*np.ndarray.transpose(np.reshape(P.copy().dot(aux.copy()),(mpar['nh'],mpar['nm'])),(1,0))
+        
+            c_aux = 1./(EMU_aux.copy()**(1/par['xi']))
+        
+            # Take budget constraint into account
+            resultEGM = self.EGM(grid, inc, money_expense, c_aux, mpar, par)
+            c_new = resultEGM['c_update'].copy()
+            m_star = resultEGM['m_update'].copy()
+        
+            m_star[m_star>grid['m'][-1]] = grid['m'][-1] # no extrapolation
+        
+            ## check convergence of policies
+            distC = np.max((np.abs(c_guess.copy()-c_new.copy())))
+        
+            # update c policy guesses
+            c_guess = c_new.copy()
+        
+        distPOL = distC
+
+        return {'c_new':c_new, 'm_star':m_star, 'distPOL':distPOL}      
+
+
+    def EGM(self, grid, inc, money_expense, c_aux, mpar, par):
+        '''
+        computes the optimal consumption and corresponding optimal
+        bond holdings by taking the budget constraint into account.
+        
+        parameters
+        -----------
+        grid : dict
+             grids
+        inc : dict
+            guess for incomes
+        par : dict
+             parameters
+        mpar : dict
+             parameters
+        money_expense : np.array
+             guess for optimal m holding 
+        c_aux : np.array
+             guess for optimal consumption
+        
+        
+        return
+        -----------
+        c_update(m,h) : np.array
+                  Update for consumption policy 
+        m_update(m,h) : np.array
+                  Update for bond policy 
+        '''    
+    
+        ## EGM: Calculate assets consistent with choices being (m')
+        # Calculate initial money position from the budget constraint,
+        # that leads to the optimal consumption choice
+        m_star = c_aux + money_expense - inc['labor'] -inc['profits']
+        RR = (par['RB']+(m_star.copy()<0.)*par['borrwedge'])/par['PI']
+        m_star = m_star.copy()/RR
+    
+        # Identify binding constraints
+        binding_constraints = (money_expense < np.tile(m_star[0,:],(mpar['nm'], 1)))
+
+        # Consumption when drawing assets m' to zero: Eat all Resources
+        Resource = inc['labor']  + inc['money'] + inc['profits']
+    
+        ## Next step : interpolate on grid
+        # all income states at once: savings m'(m,h) and consumption c(m,h)
+        m_update, c_update = BatchInterp1d(m_star, (grid['m'][:,np.newaxis], c_aux), grid['m'])
+        
+        c_update[binding_constraints] = Resource[binding_constraints]-grid['m'][0]
+        m_update[binding_constraints] = np.min((grid['m']))    
+    
+    
+        return {'c_update': c_update, 'm_update': m_update}
+
+    def StochasticsVariance(self, par, mpar, grid):
+        '''
+        generates transition probabilities for h: P_H
+        
+        parameters
+        -------------
+        par : dict
+             parameters
+        mpar : dict
+             parameters
+        grid : dict
+             grids
+             
+        return
+        -----------
+        P_H : np.array
+            transition probability
+        grid : dict
+            grid
+        par : dict
+            parameters
+        '''
+    
+        # First for human capital
+        TauchenResult = Tauchen(par['rhoH'], mpar['nh']-1, 1., 0., mpar['tauchen'])
+        hgrid = TauchenResult['grid'].copy()
+        P_H = TauchenResult['P'].copy()
+        boundsH = TauchenResult['bounds'].copy()
+    
+        # correct long run variance for human capital
+        hgrid = hgrid.copy()*par['sigmaH']/np.sqrt(1-par['rhoH']**2)
+        hgrid = np.exp(hgrid.copy()) # levels instead of logs
+    
+        grid['h'] = np.concatenate((hgrid,[1]), axis=0)
+        
+        P_H = Transition(mpar['nh']-1, par['rhoH'], np.sqrt(1-par['rhoH']**2), boundsH)
+    
+        # Transitions to enterpreneur state
+        P_H = np.concatenate((P_H.copy(),np.tile(mpar['in'],(mpar['nh']-1,1))), axis=1)
+        lastrow = np.concatenate((np.tile(0.,(1,mpar['nh']-1)),[[1-mpar['out']]]), axis=1)
+        lastrow[0,int(np.ceil(mpar['nh']/2))-1] = mpar['out'] 
+        P_H = np.concatenate((P_H.copy(),lastrow), axis=0)
+        P_H = P_H.copy()/np.transpose(np.tile(np.sum(P_H.copy(),1),(mpar['nh'],1)))
+    
+        Paux = np.linalg.matrix_power(P_H.copy(),1000)
+        hh = Paux[0,:mpar['nh']-1].copy().dot(grid['h'][:mpar['nh']-1].copy())
+    
+        par['H'] = hh # Total employment
+        par['profitshare'] = Paux[-1,-1]**(-1) # Profit per household
+        grid['boundsH'] = boundsH
+     
+    
+        return {'P_H': P_H, 'grid':grid, 'par':par}
+
+
+def EGM_policyupdate(EVm,PIminus,RBminus,inc,meshes,grid,par,mpar):
+    
+    ## EGM step 1
+    EMU = par['beta']*np.reshape(EVm.copy(),(mpar['nm'],mpar['nh']),order = 'F')
+    c_new = 1./np.power(EMU,(1./par['xi']))
+    # Calculate assets consistent with choices being (m')
+    # Calculate initial money position from the budget constraint,
+    # that leads to the optimal consumption choice
+    m_n_aux = (c_new.copy() + meshes['m'].copy()-inc['labor'].copy())
+    m_n_aux = m_n_aux.copy()/(RBminus/PIminus+(m_n_aux.copy()<0)*par['borrwedge']/PIminus)
+    
+    # Identify binding constraints
+    binding_constraints = meshes['m'].copy() < np.tile(m_n_aux[0,:].copy(),(mpar['nm'],1))
+    
+    # Consumption when drawing assets m' to zero: Eat all resources
+    Resource = inc['labor'].copy() + inc['money'].copy()
+    
+    m_n_aux = np.reshape(m_n_aux.copy(),(mpar['nm'],mpar['nh']),order='F')
+    c_n_aux = np.reshape(c_new.copy(),(mpar['nm'],mpar['nh']),order='F')
+    
+    # Interpolate grid['m'] and c_n_aux defined on m_n_aux over grid['m']
+    # Check monotonicity of m_n_aux
+    if np.sum(np.abs(np.diff(np.sign(np.diff(m_n_aux.copy(),axis=0)),axis=0)),axis=1).max() != 0:
+       print(' Warning: non monotone future liquid asset choice encountered ')
+       
+    # all income states at once: savings m'(m,h) and consumption c(m,h)
+    m_star, c_star = BatchInterp1d(np.asarray(m_n_aux), (grid['m'][:,np.newaxis], np.asarray(c_n_aux)), grid['m'])
+    
+    c_star[binding_constraints] = np.squeeze(np.asarray(Resource[binding_constraints].copy() - grid['m'][0]))
+    m_star[binding_constraints] = grid['m'].min()
+    
+    m_star[m_star>grid['m'][-1]] = grid['m'][-1]
+    
+    return {'c_star': c_star, 'm_star': m_star}
+
+
+def EGM_policyupdateJVP(EVm,dEVm,PIminus,dPIminus,RBminus,dRBminus,inc,dinc,meshes,grid,par,mpar):
+    '''
+    EGM_policyupdate and its derivative along (dEVm, dPIminus, dRBminus,
+    dinc), for given binding constraints and interpolation segments.
+
+    Parameters
+    ----------
+    EVm, PIminus, RBminus, inc, meshes, grid, par, mpar :
+        see EGM_policyupdate
+    dEVm : np.array (nm x nh)
+    dPIminus, dRBminus : float
+    dinc : dict
+        dinc['labor'], dinc['money'] : np.array (nm x nh)
+
+    Returns
+    -------
+    dict with c_star, m_star as EGM_policyupdate, and their derivatives
+    dc_star, dm_star
+    '''
+    PIminus, dPIminus, RBminus, dRBminus = [np.asarray(v, dtype=float).item()
+                                            for v in (PIminus, dPIminus, RBminus, dRBminus)]
+
+    ## EGM step 1
+    EMU = par['beta']*np.reshape(np.asarray(EVm),(mpar['nm'],mpar['nh']),order = 'F')
+    dEMU = par['beta']*np.reshape(np.asarray(dEVm),(mpar['nm'],mpar['nh']),order = 'F')
+    c_new = 1./np.power(EMU,(1./par['xi']))
+    dc_new = -c_new/EMU*dEMU/par['xi']
+
+    # money position from the budget constraint, the borrowing wedge applies where it is negative
+    m_n_num = c_new + meshes['m'] - np.asarray(inc['labor'])
+    dm_n_num = dc_new - np.asarray(dinc['labor'])
+    wedge = (m_n_num<0)*par['borrwedge']
+    R = RBminus/PIminus + wedge/PIminus
+    dR = dRBminus/PIminus - (RBminus + wedge)*dPIminus/PIminus**2
+    m_n_aux = m_n_num/R
+    dm_n_aux = dm_n_num/R - m_n_num*dR/R**2
+
+    binding_constraints = meshes['m'] < np.tile(m_n_aux[0,:],(mpar['nm'],1))
+
+    Resource = np.asarray(inc['labor']) + np.asarray(inc['money'])
+    dResource = np.asarray(dinc['labor']) + np.asarray(dinc['money'])
+
+    (m_star, c_star), (dm_star, dc_star) = BatchInterp1dJVP(m_n_aux, (grid['m'][:,np.newaxis], c_new), grid['m'],
+                                                            dm_n_aux, (0., dc_new))
+
+    c_star[binding_constraints] = Resource[binding_constraints] - grid['m'][0]
+    dc_star[binding_constraints] = dResource[binding_constraints]
+    m_star[binding_constraints] = grid['m'].min()
+    dm_star[binding_constraints] = 0.
+
+    dm_star[m_star>grid['m'][-1]] = 0.
+    m_star[m_star>grid['m'][-1]] = grid['m'][-1]
+
+    return {'c_star': c_star, 'm_star': m_star, 'dc_star': dc_star, 'dm_star': dm_star}
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+'''
+Monte Carlo simulation of a panel of households in the steady state of the
+one-asset model, for all households at once.
+
+The consumption policies of all income states are tabulated on one common
+grid, so that a period costs one search on that grid, a gather and a linear
+interpolation for all households; income transitions are drawn from alias
+tables with one uniform number per household. Histories can be written to
+.npy files on disk in chunks of periods instead of being kept in memory.
+'''
+from __future__ import print_function
+
+import os
+import numpy as np
+import time
+
+# Variables that can be recorded, in the order they are computed in a period
+PANEL_VARS = ('incStateNow', 'cNow', 'mNow', 'bNow')
+
+
+def PolicyTable(x_nodes, c_nodes):
+    '''
+    Tabulates the piecewise linear functions c_j(x) through
+    (x_nodes[:, j], c_nodes[:, j]) on the union of all nodes.
+
+    As every node of every function is a grid point, linear interpolation
+    on the common grid reproduces each function exactly, including its
+    linear extrapolation beyond the first and last node (as interp1d with
+    fill_value='extrapolate').
+
+    Parameters
+    ----------
+    x_nodes, c_nodes : np.array (n x nstates)
+        nodes of the function of each state, e.g. m_policy and c_policy
+
+    Returns
+    -------
+    dict with
+    grid : np.array (ngrid,)
+        common grid, increasing
+    values : np.array (ngrid x nstates)
+        function values on the common grid
+    slopes : np.array (ngrid-1 x nstates)
+        slope of each segment
+    '''
+    x_nodes = np.asarray(x_nodes, dtype=float)
+    c_nodes = np.asarray(c_nodes, dtype=float)
+    grid = np.unique(x_nodes)
+
+    values = np.empty((len(grid), x_nodes.shape[1]))
+    for j in range(x_nodes.shape[1]):
+        order = np.argsort(x_nodes[:, j], kind='stable')
+        x, c = x_nodes[order, j], c_nodes[order, j]
+        values[:, j] = np.interp(grid, x, c)
+        # np.interp is constant outside the nodes, extend the end segments
+        below, above = grid < x[0], grid > x[-1]
+        values[below, j] = c[0] + (grid[below] - x[0])*(c[1] - c[0])/(x[1] - x[0])
+        values[above, j] = c[-1] + (grid[above] - x[-1])*(c[-1] - c[-2])/(x[-1] - x[-2])
+
+    slopes = np.diff(values, axis=0)/np.diff(grid)[:, np.newaxis]
+    return {'grid': grid, 'values': values, 'slopes': slopes}
+
+
+def EvaluatePolicy(table, x, states, out=None):
+    '''
+    Evaluates the tabulated functions at x for households in the given
+    states: one search on the common grid, then a gather and a linear
+    interpolation, linear extrapolation outside the grid.
+
+    Parameters
+    ----------
+    table : dict
+        as returned by PolicyTable
+    x : np.array (nagents,)
+    states : np.array of int (nagents,)
+    out : np.array (nagents,)
+        array to write the result to, a new one (dtype of x) if None
+
+    Returns
+    -------
+    np.array (nagents,)
+    '''
+    grid = table['grid']
+    seg = np.searchsorted(grid, x, side='right') - 1
+    np.clip(seg, 0, len(grid) - 2, out=seg)
+
+    c = np.subtract(x, grid[seg], out=out, casting='unsafe')
+    c *= table['slopes'][seg, states]
+    c += table['values'][seg, states]
+    return c
+
+
+def AliasTables(P):
+    '''
+    Alias tables (Walker, Vose) of each row of a transition matrix.
+
+    Parameters
+    ----------
+    P : np.array (nstates x nstates)
+        transition probabilities, rows sum to one
+
+    Returns
+    -------
+    prob : np.array (nstates x nstates)
+        probability of keeping column k when column k is drawn
+    alias : np.array of int (nstates x nstates)
+        column taken instead of k otherwise
+    '''
+    P = np.asarray(P, dtype=float)
+    nstates, n = P.shape
+    prob = np.ones((nstates, n))
+    alias = np.tile(np.arange(n), (nstates, 1))
+
+    for i in range(nstates):
+        scaled = P[i]/np.sum(P[i])*n
+        small = [k for k in range(n) if scaled[k] < 1.]
+        large = [k for k in range(n) if scaled[k] >= 1.]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[i, s] = scaled[s]
+            alias[i, s] = l
+            scaled[l] -= 1. - scaled[s]
+            (small if scaled[l] < 1. else large).append(l)
+        # leftovers are one up to rounding
+        for k in small + large:
+            prob[i, k] = 1.
+
+    return prob, alias
+
+
+def DrawAlias(prob, alias, states, u):
+    '''
+    Next state of each household from the alias tables of its current state.
+
+    Parameters
+    ----------
+    prob, alias : np.array
+        as returned by AliasTables
+    states : np.array of int (nagents,)
+        current states
+    u : np.array (nagents,)
+        uniform draws on [0, 1), one per household; the integer part of
+        n*u selects the column, the fractional part accepts it or its alias
+
+    Returns
+    -------
+    np.array of int (nagents,)
+    '''
+    n = prob.shape[1]
+    scaled = u*n
+    col = np.minimum(scaled.astype(np.intp), n - 1)
+    keep = (scaled - col) < prob[states, col]
+    return np.where(keep, col, alias[states, col])
+
+
+def SimulatePanel(table, P, income, R, b0, s0, T, seed=0, dtype=np.float64,
+                  track_vars=PANEL_VARS, chunk=100, directory=None):
+    '''
+    Simulates T periods of a panel of households.
+
+    In each period the income state is drawn given last period's state,
+    consumption is evaluated at last period's bonds b in the new state,
+    cash at hand is m = R b + income and the new bonds are b = m - c, where
+    the gross real rate R is higher for borrowers (borrowing wedge).
+
+    Parameters
+    ----------
+    table : dict
+        consumption policies, as returned by PolicyTable
+    P : np.array (nstates x nstates)
+        transition matrix of the income states
+    income : np.array (nstates,)
+        income in each state
+    R : tuple
+        (gross real rate for savers, gross real rate for borrowers)
+    b0 : np.array (nagents,)
+        initial bonds
+    s0 : np.array of int (nagents,)
+        initial income states
+    T : int
+        number of periods
+    seed : int
+        seed of the random number generator
+    dtype : np.dtype
+        floating type of the bonds, cash at hand and consumption, e.g.
+        np.float32 to halve memory and disk use of large panels
+    track_vars : sequence of str
+        variables to record, out of PANEL_VARS
+    chunk : int
+        number of periods kept in memory before they are written to disk
+    directory : str
+        if given, histories are written to directory/<name>.npy (opened as
+        memory maps) instead of being kept in memory
+
+    Returns
+    -------
+    dict with the histories name -> np.array (T x nagents) of track_vars,
+    and the final states 'bNow_final' and 'incStateNow_final'
+    '''
+    for name in track_vars:
+        if name not in PANEL_VARS:
+            raise ValueError('Unknown panel variable: ' + str(name))
+    dtype = np.dtype(dtype)
+    nagents = len(b0)
+    chunk = max(min(int(chunk), T), 1)
+
+    prob, alias = AliasTables(P)
+    income = np.asarray(income, dtype=dtype)
+    R_save, R_borrow = dtype.type(R[0]), dtype.type(R[1])
+
+    if directory is not None and not os.path.exists(directory):
+        os.makedirs(directory)
+    hist = {}
+    for name in track_vars:
+        kind = np.int32 if name == 'incStateNow' else dtype
+        if directory is None:
+            hist[name] = np.empty((T, nagents), dtype=kind)
+        else:
+            hist[name] = np.lib.format.open_memmap(os.path.join(directory, name + '.npy'),
+                                                   mode='w+', dtype=kind, shape=(T, nagents))
+    buffers = {name: np.empty((chunk, nagents), dtype=hist[name].dtype) for name in track_vars}
+
+    rng = np.random.RandomState(seed)
+    state = np.asarray(s0, dtype=np.intp).copy()
+    b = np.asarray(b0, dtype=dtype).copy()
+    c = np.empty(nagents, dtype=dtype)
+    m = np.empty(nagents, dtype=dtype)
+
+    start_time = time.perf_counter()
+    for t in range(T):
+        state = DrawAlias(prob, alias, state, rng.uniform(size=nagents))
+        EvaluatePolicy(table, b, state, out=c)
+        np.multiply(b, np.where(b < 0., R_borrow, R_save), out=m)
+        m += income[state]
+        np.subtract(m, c, out=b)
+
+        row = t % chunk
+        current = {'incStateNow': state, 'cNow': c, 'mNow': m, 'bNow': b}
+        for name in track_vars:
+            buffers[name][row] = current[name]
+        if row == chunk - 1 or t == T - 1:
+            for name in track_vars:
+                hist[name][t - row:t + 1] = buffers[name][:row + 1]
+                if directory is not None:
+                    hist[name].flush()
+
+    print('Simulated ', str(nagents), ' households for ', str(T), ' periods in ',
+          (time.perf_counter() - start_time), ' seconds.')
+
+    hist['bNow_final'] = b
+    hist['incStateNow_final'] = state.astype(int)
+    return hist
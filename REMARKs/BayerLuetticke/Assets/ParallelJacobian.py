@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+'''
+Jacobians of the equilibrium conditions Fsys, computed column block by
+column block in a pool of worker processes, by forward or central
+differences or by a user-supplied Jacobian-vector product, optionally
+checkpointed to disk as blocks complete
+'''
+from __future__ import print_function
+
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from math import ceil
+import hashlib
+import os
+import time
+import zipfile
+
+# Position of each perturbed argument in the call Fsys(State, Stateminus, Control, Controlminus, ...)
+SLOTS = {'F1': 0, 'F3': 1, 'F2': 2, 'F4': 3}
+
+# Per-process copy of the read-only inputs, filled once by _InitWorker
+_WORKER = {}
+
+
+# Ways to obtain a column, besides a Jacobian-vector product function
+DERIVATIVES = ('forward', 'central')
+
+
+def _InitWorker(Fsys, FsysArgs, Fb, numstates, numcontrols, derivative='forward'):
+    '''
+    Stores the steady-state inputs of Fsys in the worker, so that the tasks
+    sent to the pool only carry column indices and step sizes.
+    '''
+    _WORKER['Fsys'] = Fsys
+    _WORKER['FsysArgs'] = FsysArgs
+    _WORKER['Fb'] = Fb
+    _WORKER['numstates'] = numstates
+    _WORKER['numcontrols'] = numcontrols
+    _WORKER['derivative'] = derivative
+
+
+def _Directional(args):
+    '''
+    Change of the residual along the direction args (State, Stateminus,
+    Control, Controlminus), divided by the step sizes afterwards.
+    '''
+    Fsys = _WORKER['Fsys']
+    derivative = _WORKER['derivative']
+
+    if derivative == 'forward':
+        Fx = Fsys(*(args + list(_WORKER['FsysArgs'])))
+        return np.ravel(Fx['Difference'] - _WORKER['Fb'])
+    if derivative == 'central':
+        Fplus = Fsys(*(args + list(_WORKER['FsysArgs'])))
+        Fminus = Fsys(*([-arg for arg in args] + list(_WORKER['FsysArgs'])))
+        return np.ravel(Fplus['Difference'] - Fminus['Difference']) / 2.
+
+    # Jacobian-vector product, exact and linear in the direction
+    return np.ravel(derivative(*(args + list(_WORKER['FsysArgs']))))
+
+
+def _JacobianBlock(task):
+    '''
+    Computes one block of columns of F1-F4, one directional derivative of
+    Fsys per group of structurally independent columns.
+
+    Parameters
+    ----------
+    task : tuple
+        (block number, list of groups); a group is a list of
+        (name, column, step size, rows), where rows are the residuals the
+        column can affect (None: all)
+
+    Returns
+    -------
+    block number and a list of (name, column, dF column)
+    '''
+    bl, groups = task
+    sizes = (_WORKER['numstates'], _WORKER['numstates'],
+             _WORKER['numcontrols'], _WORKER['numcontrols'])
+
+    columns = []
+    for group in groups:
+        args = [np.zeros((n, 1)) for n in sizes]
+        for name, col, h, rows in group:
+            args[SLOTS[name]][col] = h
+        diff = _Directional(args)
+        for name, col, h, rows in group:
+            if rows is None:
+                DF = diff / h
+            else:
+                # rows outside the pattern belong to other columns of the group
+                DF = np.zeros(len(diff))
+                DF[rows] = diff[rows] / h
+            columns.append((name, col, DF))
+
+    return bl, columns
+
+
+class JacobianCheckpoint(object):
+    '''
+    On-disk store of Jacobian columns, written as blocks complete, so that
+    an interrupted computation resumes with the missing columns only and
+    later runs with the same inputs reuse the stored ones.
+
+    A column is identified by the key of the inputs it depends on, its
+    name ('F1'-'F4') and position, step size, derivative and sparsity
+    pattern. Columns are stored in one folder per key, one .npz file per
+    completed block.
+
+    Parameters
+    ----------
+    directory : str
+        folder of the store
+    key : str
+        hash of the inputs of Fsys the columns depend on, e.g. from
+        SteadyStateStore.InputsKey
+    column_keys : dict
+        (name, column) -> key for columns that depend on further inputs,
+        e.g. the columns of S(t), which depend on the shock process
+    '''
+
+    def __init__(self, directory, key, column_keys=None):
+        self.directory = directory
+        self.key = key
+        self.column_keys = {} if column_keys is None else column_keys
+
+    def ColumnId(self, name, col, h, rows, derivative):
+        '''
+        Returns (key, identifier) of a column.
+        '''
+        key = self.column_keys.get((name, int(col)), self.key)
+        if callable(derivative):
+            derivative = getattr(derivative, '__module__', '') + '.' + getattr(derivative, '__name__', repr(derivative))
+
+        sha = hashlib.sha1()
+        sha.update(repr((key, name, int(col), float(h).hex(), derivative)).encode('utf-8'))
+        if rows is not None:
+            sha.update(np.asarray(rows, dtype=np.int64).tobytes())
+        return key, sha.hexdigest()
+
+    def Folder(self, key):
+        '''
+        Folder of the columns with the given key.
+        '''
+        return os.path.join(self.directory, key[:20])
+
+    def Load(self, ids):
+        '''
+        Stored columns among ids, a list of (key, identifier).
+
+        Returns
+        -------
+        dict identifier -> column
+        '''
+        wanted = set(cid for __, cid in ids)
+        found = {}
+        for key in set(key for key, __ in ids):
+            folder = self.Folder(key)
+            if not os.path.isdir(folder):
+                continue
+            for fname in sorted(os.listdir(folder)):
+                if not fname.endswith('.npz'):
+                    continue
+                try:
+                    with np.load(os.path.join(folder, fname), allow_pickle=False) as data:
+                        for cid, column in zip(data['ids'], data['columns']):
+                            if str(cid) in wanted:
+                                found[str(cid)] = column
+                except (IOError, ValueError, KeyError, zipfile.BadZipFile):
+                    print('Warning: skipping unreadable Jacobian checkpoint ', fname)
+        return found
+
+    def Save(self, entries):
+        '''
+        Stores columns, entries is a list of (key, identifier, column).
+        '''
+        bykey = {}
+        for key, cid, column in entries:
+            bykey.setdefault(key, []).append((cid, column))
+
+        for key, items in bykey.items():
+            folder = self.Folder(key)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            ids = np.array([cid for cid, __ in items])
+            name = hashlib.sha1(''.join(ids).encode('utf-8')).hexdigest()
+            # write under a temporary name first, so that an interrupted save
+            # does not leave a truncated file
+            path = os.path.join(folder, 'block_' + name + '.npz')
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, ids=ids, columns=np.array([column for __, column in items]))
+            os.replace(path + '.tmp', path)
+
+
+def ColourColumns(columns, nrows):
+    '''
+    Groups columns such that no two columns of a group can affect the same
+    residual (greedy colouring of the column intersection graph), so that
+    each group is obtained from one evaluation of Fsys.
+
+    Parameters
+    ----------
+    columns : list of tuples
+        (name, column, step size, rows); rows is an array of residual
+        indices or None if the column can affect all residuals
+    nrows : int
+        number of residuals
+
+    Returns
+    -------
+    groups : list of lists of columns
+    '''
+    groups = []
+    used = []  # residuals covered by each sparse group, None for a dense column
+
+    # widest patterns first, they are the hardest to place
+    order = sorted(range(len(columns)),
+                   key=lambda ii: -nrows if columns[ii][3] is None else -len(columns[ii][3]))
+    for ii in order:
+        rows = columns[ii][3]
+        if rows is None:
+            groups.append([columns[ii]])
+            used.append(None)
+            continue
+        for gg in range(len(groups)):
+            if used[gg] is not None and not np.any(used[gg][rows]):
+                groups[gg].append(columns[ii])
+                used[gg][rows] = True
+                break
+        else:
+            mask = np.zeros(nrows, dtype=bool)
+            mask[rows] = True
+            groups.append([columns[ii]])
+            used.append(mask)
+
+    return groups
+
+
+def FsysJacobian(Fsys, FsysArgs, Fb, numstates, numcontrols, perturb, out, workers=None,
+                 derivative='forward', checkpoint=None):
+    '''
+    Fills columns of F1-F4 by differentiating Fsys around the steady state.
+
+    Columns may come with the residuals they can affect (sparsity pattern
+    of Fsys). Columns that cannot affect any residual are left untouched,
+    and columns whose patterns do not overlap are perturbed together in one
+    Fsys call. Every column is computed by the same arithmetic whether one
+    or many processes are used, so the result does not depend on the number
+    of workers.
+
+    Parameters
+    ----------
+    Fsys : function
+        Fsys(State, Stateminus, Control, Controlminus, *FsysArgs), returning
+        a dict with the residual under 'Difference'; must be importable
+        at module level so that it can be sent to the workers
+    FsysArgs : tuple
+        remaining (steady-state) arguments of Fsys, sent once per worker
+    Fb : np.array
+        residual at the steady state
+    numstates, numcontrols : int
+    perturb : list of tuples
+        (name, cols, steps) or (name, cols, steps, rows) with name in
+        'F1','F2','F3','F4', the columns to compute, the step size used for
+        each of them and, optionally, for each column the array of residual
+        indices it can affect (None: all residuals)
+    out : dict
+        name -> np.array (numstates+numcontrols x ncols) filled in place
+    workers : int
+        number of processes; None uses cpu_count()/2-1, 1 runs in-process
+    derivative : str or function
+        'forward' : one-sided differences, one Fsys call per group
+        'central' : central differences, two Fsys calls per group and an
+                    error of second order in the step size
+        function  : Jacobian-vector product with the signature of Fsys,
+                    returning the derivative of 'Difference' along the
+                    direction (State, Stateminus, Control, Controlminus);
+                    it must be linear in the direction (e.g. forward-mode
+                    automatic differentiation of Fsys) and is called with
+                    the step sizes as direction
+    checkpoint : JacobianCheckpoint
+        if given, columns found in the store are not recomputed, and the
+        computed ones are stored as each block completes
+
+    Returns
+    -------
+    out : dict
+    '''
+    if not callable(derivative) and derivative not in DERIVATIVES:
+        raise ValueError('Unknown derivative for the Jacobian: ' + str(derivative))
+    if workers is None:
+        workers = max(cpu_count()//2 - 1, 1)
+    workers = max(int(workers), 1)
+    nrows = len(np.ravel(Fb))
+
+    columns = []
+    nzero = 0
+    for entry in perturb:
+        name, cols, steps = entry[:3]
+        rows = entry[3] if len(entry) > 3 else [None]*len(cols)
+        for col, h, rr in zip(np.asarray(cols, dtype=int), np.asarray(steps, dtype=float), rows):
+            if rr is not None:
+                rr = np.asarray(rr, dtype=int)
+                if len(rr) == 0:
+                    nzero += 1  # structurally zero column
+                    continue
+            columns.append((name, col, h, rr))
+
+    ids = {}
+    if checkpoint is not None:
+        for name, col, h, rr in columns:
+            ids[(name, col)] = checkpoint.ColumnId(name, col, h, rr, derivative)
+        stored = checkpoint.Load(list(ids.values()))
+        remaining = []
+        for name, col, h, rr in columns:
+            if ids[(name, col)][1] in stored:
+                out[name][:, [col]] = np.reshape(stored[ids[(name, col)][1]], (-1, 1))
+            else:
+                remaining.append((name, col, h, rr))
+        print('Jacobian checkpoint: ', str(len(columns) - len(remaining)), ' columns loaded from ',
+              checkpoint.directory, '.')
+        columns = remaining
+
+    def Store(result):
+        for name, col, DF in result:
+            out[name][:, [col]] = DF[:, np.newaxis]
+        if checkpoint is not None:
+            checkpoint.Save([ids[(name, col)] + (DF,) for name, col, DF in result])
+
+    groups = ColourColumns(columns, nrows)
+    if callable(derivative):
+        evaluations = str(len(groups)) + ' Jacobian-vector products'
+    else:
+        evaluations = str(len(groups)*(2 if derivative == 'central' else 1)) + ' evaluations of Fsys'
+    print('Computing Jacobian: ', str(len(columns)), ' columns in ', evaluations, ', ',
+          str(nzero), ' columns structurally zero.')
+
+    tasks = []
+    if len(groups) > 0:
+        packagesize = int(ceil(len(groups) / float(3*workers)))
+        blocks = int(ceil(len(groups) / float(packagesize)))
+        print('Total number of parallel blocks: ', str(blocks), '.')
+        for bl in range(blocks):
+            tasks.append((bl, groups[bl*packagesize:min(packagesize*(bl+1), len(groups))]))
+
+    start_time = time.perf_counter()
+
+    if workers == 1:
+        _InitWorker(Fsys, FsysArgs, Fb, numstates, numcontrols, derivative)
+        for bl, result in map(_JacobianBlock, tasks):
+            Store(result)
+            print('Block number: ', str(bl), ' done.')
+    else:
+        pool = Pool(processes=workers, initializer=_InitWorker,
+                    initargs=(Fsys, FsysArgs, Fb, numstates, numcontrols, derivative))
+        try:
+            for bl, result in pool.imap_unordered(_JacobianBlock, tasks):
+                Store(result)
+                print('Block number: ', str(bl), ' done.')
+        finally:
+            pool.close()
+            pool.join()
+
+    end_time = time.perf_counter()
+    print('Elapsed time is ', (end_time-start_time), ' seconds.')
+
+    return out
+
+
+def CompareJacobians(Fsys, FsysArgs, Fb, numstates, numcontrols, jacobians, perturb,
+                     derivative='central', workers=1):
+    '''
+    Recomputes columns of the Jacobians with another derivative and reports
+    the largest differences, e.g. to check forward differences against
+    central differences or against a Jacobian-vector product.
+
+    Parameters
+    ----------
+    Fsys, FsysArgs, Fb, numstates, numcontrols, workers :
+        see FsysJacobian
+    jacobians : dict
+        name ('F1'-'F4') -> Jacobian to check, e.g. as returned by SGU_solver
+    perturb : list of tuples
+        columns to recompute, see FsysJacobian
+    derivative : str or function
+        derivative used for the comparison, see FsysJacobian
+
+    Returns
+    -------
+    dict name -> dict with
+    max_abs : float
+        largest absolute difference over the recomputed columns
+    max_rel : float
+        max_abs relative to the largest entry of these columns
+    '''
+    out = {}
+    for name in jacobians:
+        out[name] = np.zeros(np.shape(jacobians[name]))
+    FsysJacobian(Fsys, FsysArgs, Fb, numstates, numcontrols, perturb, out,
+                 workers=workers, derivative=derivative)
+
+    report = {}
+    for entry in perturb:
+        name, cols = entry[0], np.asarray(entry[1], dtype=int)
+        reference = np.asarray(jacobians[name])[:, cols]
+        max_abs = np.max(np.abs(reference - out[name][:, cols])) if len(cols) > 0 else 0.
+        scale = np.max(np.abs(reference)) if len(cols) > 0 else 0.
+        report[name] = {'max_abs': max_abs, 'max_rel': max_abs/scale if scale > 0 else max_abs}
+        print(name, ': largest difference ', max_abs, ', relative ', report[name]['max_rel'])
+
+    return report
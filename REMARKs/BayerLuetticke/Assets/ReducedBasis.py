@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+'''
+Reduced DCT basis of the policy functions (marginal values on the nm x nk x nh grid).
+
+The retained coefficients are the largest ones of the orthonormal discrete
+cosine transform (type II) that together carry a share 'accuracy' of its
+norm. Because the transform is orthonormal, the retained basis functions
+form a matrix B (grid points x coefficients) with orthonormal columns:
+mapping coefficients to the grid is B c and projecting a function on the
+grid back to the coefficients is B' f.
+'''
+from __future__ import print_function
+
+import numpy as np
+import scipy.fftpack as sf
+from collections import OrderedDict
+
+# Bases built by DCTBasis, keyed by grid shape and retained coefficients, least
+# recently used first, and the largest number of bytes they may take together in
+# one process
+_BASES = OrderedDict()
+_MAX_BASES_BYTES = 2**30
+
+
+def DCTCoefficients(obj, shape):
+    '''
+    Orthonormal multidimensional DCT of a function on the grid.
+
+    Parameters
+    ----------
+    obj : np.array
+        function values, flattened in Fortran order or with shape 'shape'
+    shape : tuple
+        grid shape, e.g. (nm, nk, nh)
+
+    Returns
+    -------
+    np.array
+        coefficients, flattened in Fortran order
+    '''
+    X = np.reshape(np.asarray(obj, dtype=float), shape, order='F')
+    for axis in range(len(shape)):
+        X = sf.dct(X, norm='ortho', axis=axis)
+    return X.flatten(order='F')
+
+
+def SelectCoefficients(coefficients, accuracy):
+    '''
+    Smallest set of largest coefficients whose norm is at least a share
+    accuracy of the norm of all coefficients, found by one cumulative scan.
+
+    Parameters
+    ----------
+    coefficients : np.array
+        flat DCT coefficients
+    accuracy : float or sequence of floats
+        required share(s) of the norm; a sequence returns one index set per
+        level from the same transform
+
+    Returns
+    -------
+    np.array of int (sorted), or a list of them if accuracy is a sequence
+    '''
+    coefficients = np.ravel(coefficients)
+    ind = np.argsort(abs(coefficients))[::-1]
+    share = np.sqrt(np.cumsum(coefficients[ind]**2)) / np.linalg.norm(coefficients)
+
+    def select(level):
+        # at least one coefficient is kept
+        needed = min(int(np.searchsorted(share, level, side='left')) + 1, len(ind))
+        return np.sort(ind[:needed])
+
+    if np.ndim(accuracy) == 0:
+        return select(accuracy)
+    return [select(level) for level in accuracy]
+
+
+def AccuracySweep(obj, shape, levels):
+    '''
+    Retained coefficients and approximation error for several accuracy
+    levels, from a single transform.
+
+    Parameters
+    ----------
+    obj : np.array
+        function values on the grid
+    shape : tuple
+        grid shape
+    levels : sequence of floats
+        accuracy levels
+
+    Returns
+    -------
+    list of dicts with
+    accuracy : float
+    index : np.array of int
+        retained coefficients
+    needed : int
+        number of retained coefficients
+    max_error : float
+        largest absolute error of the reduced approximation on the grid
+    '''
+    coefficients = DCTCoefficients(obj, shape)
+    f = np.ravel(np.reshape(np.asarray(obj, dtype=float), shape, order='F'), order='F')
+
+    sweep = []
+    for level, index in zip(levels, SelectCoefficients(coefficients, list(levels))):
+        approx = DCTBasis(index, shape).dot(coefficients[index])
+        sweep.append({'accuracy': level, 'index': index, 'needed': len(index),
+                      'max_error': np.max(np.abs(approx - f))})
+    return sweep
+
+
+def DCTBasis(index, shape):
+    '''
+    Synthesis matrix of the retained DCT coefficients.
+
+    Column j is the basis function of coefficient index[j] on the grid
+    (flattened in Fortran order), i.e. the inverse transform of the unit
+    vector; the analysis (projection) operator is its transpose.
+
+    The matrix is dense and takes 8*prod(shape)*len(index) bytes, e.g.
+    320 MB for 40000 grid points and 1000 coefficients. Bases are kept in
+    memory, so calls with the same index set, e.g. in every evaluation of
+    Fsys, build it once per process, up to _MAX_BASES_BYTES per process
+    (least recently used bases are dropped first; a basis larger than the
+    limit is built on every call). SGU_solver evaluates Fsys before it
+    starts the Jacobian workers, so where processes are forked (Linux) the
+    workers share the bases of the parent instead of building their own;
+    with spawned processes each worker holds its own copy.
+
+    Parameters
+    ----------
+    index : np.array of int
+        retained coefficients (flat, Fortran order)
+    shape : tuple
+        grid shape, e.g. (nm, nk, nh)
+
+    Returns
+    -------
+    B : np.array (prod(shape) x len(index))
+    '''
+    index = np.asarray(index, dtype=np.int64).ravel()
+    key = (tuple(shape), index.tobytes())
+    if key in _BASES:
+        _BASES.move_to_end(key)
+        return _BASES[key]
+
+    # basis function of coefficient (i1, i2, ...) is the product of the 1D ones
+    subs = np.unravel_index(index, shape, order='F')
+    B = np.ones((1, len(index)))
+    for n, sub in zip(shape, subs):
+        D = sf.idct(np.eye(n), norm='ortho', axis=0)[:, sub]
+        # grid points of earlier axes vary fastest (Fortran order)
+        B = (D[:, np.newaxis, :] * B[np.newaxis, :, :]).reshape(-1, len(index))
+
+    if B.nbytes <= _MAX_BASES_BYTES:
+        while sum(basis.nbytes for basis in _BASES.values()) + B.nbytes > _MAX_BASES_BYTES:
+            _BASES.popitem(last=False)
+        _BASES[key] = B
+    return B
@@ -0,0 +1,1199 @@
+# -*- coding: utf-8 -*-
+'''
+Numerical kernels shared by the one-asset and two-asset models
+'''
+from __future__ import print_function
+
+import numpy as np
+import scipy as sc
+import scipy.integrate
+from scipy import sparse as sp
+from scipy.sparse.linalg import eigs, spsolve, LinearOperator
+from scipy.stats import norm
+from functools import lru_cache
+import time
+
+# beyond this many standard deviations the normal density is neglected (< 1e-31)
+NORMAL_CUTOFF = 12.
+
+
+class RegularGridCopula(dict):
+    '''
+    Non-parametric copula stored on the tensor grid of marginal CDFs.
+
+    The steady-state copula is known at the points (Fm_i, Fk_j, Fh_l) of the
+    marginal CDFs, so it is evaluated by multilinear interpolation on that
+    rectilinear grid instead of a triangulation of the scattered points.
+    Queries outside the grid are clamped to its boundary.
+
+    The keys 'grid' (points x 3) and 'value' of the former dict copula are
+    kept, so code reading Copula['grid'] or Copula['value'] is unaffected.
+
+    Parameters
+    ----------
+    axes : tuple of np.array
+        non-decreasing marginal CDFs, one per dimension
+    value : np.array
+        cumulative joint distribution with shape (len(axes[0]), len(axes[1]), ...)
+    '''
+
+    def __init__(self, axes, value):
+        self.axes = tuple(np.asarray(ax, dtype=float).ravel() for ax in axes)
+        self.shape = tuple(len(ax) for ax in self.axes)
+        self.values = np.reshape(np.asarray(value, dtype=float), self.shape, order='F')
+
+        meshes = np.meshgrid(*self.axes, indexing='ij')
+        dict.__init__(self,
+                      grid=np.concatenate([[mesh.flatten(order='F')] for mesh in meshes], axis=0).T,
+                      value=self.values.flatten(order='F'))
+
+    def __call__(self, points):
+        '''
+        Evaluates the copula.
+
+        Parameters
+        ----------
+        points : tuple of np.array
+            coordinates of the query points, one array per dimension
+
+        Returns
+        -------
+        np.array
+            copula values, same shape as points[0]
+        '''
+        shape = np.shape(points[0])
+        lower = []
+        weight = []
+        for ax, q in zip(self.axes, points):
+            q = np.clip(np.ravel(q), ax[0], ax[-1])
+            idx = np.clip(np.searchsorted(ax, q, side='right') - 1, 0, len(ax) - 2)
+            dx = ax[idx + 1] - ax[idx]
+            w = np.where(dx > 0, (q - ax[idx]) / np.where(dx > 0, dx, 1.), 1.)
+            lower.append(idx)
+            weight.append(w)
+
+        out = np.zeros(len(lower[0]))
+        ndim = len(self.axes)
+        for corner in range(2**ndim):
+            index = []
+            w = np.ones(len(lower[0]))
+            for d in range(ndim):
+                up = (corner >> d) & 1
+                index.append(lower[d] + up)
+                w = w * (weight[d] if up else 1. - weight[d])
+            out += w * self.values[tuple(index)]
+
+        return np.reshape(out, shape)
+
+
+def CopulaInterpolator(Copula, shape):
+    '''
+    Returns Copula as a RegularGridCopula.
+
+    Copulas stored as a dict with 'grid' and 'value' (older steady states)
+    are converted using the tensor structure of their grid.
+
+    Parameters
+    ----------
+    Copula : RegularGridCopula or dict
+    shape : tuple
+        number of grid points per dimension, e.g. (nm, nk, nh)
+    '''
+    if isinstance(Copula, RegularGridCopula):
+        return Copula
+
+    grid = np.asarray(Copula['grid'])
+    axes = []
+    for d in range(len(shape)):
+        index = [0] * len(shape)
+        index[d] = slice(None)
+        axes.append(np.reshape(grid[:, d], shape, order='F')[tuple(index)])
+
+    return RegularGridCopula(axes, Copula['value'])
+
+
+class SplineCopula(object):
+    '''
+    Interpolating bicubic spline copula of the one-asset model, on the grid
+    of the marginal CDFs of money and productivity.
+
+    Same spline and calling convention as the former
+    interp2d(x, y, values.T, kind='cubic'), which SciPy 1.14 removed:
+    Copula(x, y) returns an array of shape (len(y), len(x)).
+
+    Parameters
+    ----------
+    x, y : np.array
+        strictly increasing marginal CDFs
+    values : np.array
+        cumulative joint distribution with shape (len(x), len(y))
+    degree : int
+        degree of the spline in both dimensions
+    '''
+
+    def __init__(self, x, y, values, degree=3):
+        from scipy.interpolate import RectBivariateSpline
+
+        self.x = np.asarray(x, dtype=float).ravel()
+        self.y = np.asarray(y, dtype=float).ravel()
+        self.values = np.reshape(np.asarray(values, dtype=float), (len(self.x), len(self.y)))
+        self.degree = int(degree)
+        self.spline = RectBivariateSpline(self.x, self.y, self.values, kx=self.degree, ky=self.degree, s=0)
+
+    def __call__(self, x, y, dx=0, dy=0):
+        '''
+        Evaluates the copula, or its partial derivatives, on the grid x times y.
+
+        Parameters
+        ----------
+        x, y : np.array
+            query points, sorted as in interp2d; points outside the grid
+            take the value at its boundary
+        dx, dy : int
+            order of the partial derivatives
+
+        Returns
+        -------
+        np.array
+            values with shape (len(y), len(x))
+        '''
+        x = np.sort(np.atleast_1d(np.asarray(x, dtype=float)).ravel())
+        y = np.sort(np.atleast_1d(np.asarray(y, dtype=float)).ravel())
+        return self.spline(x, y, dx=dx, dy=dy).T
+
+    def JVP(self, x, y, dx, dy):
+        '''
+        Evaluates the copula on the grid x times y and its derivative along
+        a perturbation (dx, dy) of the query points.
+
+        Queries are clamped to the grid, so a query on its boundary that
+        moves outwards, or one outside, does not change the value: the
+        derivative is the one-sided one in the direction given. Queries
+        within rounding (1e-12 of the grid width) of the boundary, e.g.
+        marginal CDFs of the steady state, count as on it.
+
+        Parameters
+        ----------
+        x, y : np.array
+            sorted query points
+        dx, dy : np.array
+            perturbation of each query point
+
+        Returns
+        -------
+        values, derivatives : np.array
+            both with shape (len(y), len(x))
+        '''
+        def Inward(q, dq, axis):
+            q = np.atleast_1d(np.asarray(q, dtype=float)).ravel()
+            dq = np.atleast_1d(np.asarray(dq, dtype=float)).ravel()
+            tol = 1e-12*(axis[-1] - axis[0])
+            outward = (((q <= axis[0] + tol) & (dq < 0)) | ((q >= axis[-1] - tol) & (dq > 0)) |
+                       (q < axis[0] - tol) | (q > axis[-1] + tol))
+            return q, np.where(outward, 0., dq)
+
+        x, dx = Inward(x, dx, self.x)
+        y, dy = Inward(y, dy, self.y)
+        derivative = (self.spline(x, y, dx=1)*dx[:, np.newaxis] +
+                      self.spline(x, y, dy=1)*dy[np.newaxis, :])
+        return self.spline(x, y).T, derivative.T
+
+
+def AsSplineCopula(Copula):
+    '''
+    Returns Copula as a SplineCopula.
+
+    Copulas stored as scipy interp2d objects (older steady states, e.g. the
+    pickles shipped in Assets/One) are rebuilt from their data points; the
+    spline is the same.
+
+    Parameters
+    ----------
+    Copula : SplineCopula or interp2d
+    '''
+    if isinstance(Copula, SplineCopula):
+        return Copula
+
+    # interp2d keeps its data as x, y and z = ravel(values), values of shape (len(x), len(y))
+    return SplineCopula(Copula.x, Copula.y, np.reshape(Copula.z, (len(Copula.x), len(Copula.y))),
+                        degree=Copula.tck[3])
+
+
+def LotteryPushForward(JD, index, weight, P):
+    '''
+    Pushes a histogram one period forward with the lottery (Young) method,
+    without building the transition matrix.
+
+    The mass at asset point i and productivity h moves to the asset points
+    index[n][i,h] with probabilities weight[n][i,h], and productivity then
+    moves according to P. Memory and work scale with the number of states.
+
+    Parameters
+    ----------
+    JD : np.array
+        histogram with the asset dimensions first and productivity last,
+        e.g. (nm, nh) or (nm, nk, nh)
+    index : list of np.array
+        destination of each lottery outcome as a flat index (Fortran order)
+        over the asset dimensions, same shape as JD
+    weight : list of np.array
+        probability of each lottery outcome, same shape as JD
+    P : np.array
+        productivity transition matrix (nh x nh)
+
+    Returns
+    -------
+    JD_new : np.array
+        next period histogram, same shape as JD
+    '''
+    shape = np.shape(JD)
+    nh = shape[-1]
+    na = int(np.size(JD) // nh)
+
+    JD = np.reshape(np.asarray(JD), (na, nh), order='F')
+    offset = na*np.arange(nh)
+
+    JD_mid = np.zeros(na*nh)
+    for idx, w in zip(index, weight):
+        dest = np.reshape(np.asarray(idx), (na, nh), order='F').astype(np.int64) + offset
+        mass = JD*np.reshape(np.asarray(w), (na, nh), order='F')
+        JD_mid += np.bincount(dest.ravel(), weights=mass.ravel(), minlength=na*nh)
+
+    JD_new = np.reshape(JD_mid, (na, nh), order='F').dot(np.asarray(P))
+
+    return np.reshape(JD_new, shape, order='F')
+
+
+def GridLottery(vals, grid):
+    '''
+    Lottery on a one-dimensional grid that keeps the mean of each value:
+    a value between two grid points is split between them in proportion to
+    its distance, values outside the grid go to the first or last point.
+
+    Parameters
+    ----------
+    vals : np.array
+        values, any shape
+    grid : np.array
+        increasing grid
+
+    Returns
+    -------
+    lower : np.array of int
+        index of the lower grid point, same shape as vals
+    upper_weight : np.array
+        probability of the upper grid point lower+1
+    '''
+    grid = np.asarray(grid, dtype=float)
+    vals = np.asarray(vals, dtype=float)
+    lower = np.searchsorted(grid, vals, side='right') - 1
+    np.clip(lower, 0, len(grid) - 2, out=lower)
+    upper_weight = (vals - grid[lower])/(grid[lower + 1] - grid[lower])
+    return lower, np.clip(upper_weight, 0., 1.)
+
+
+def ErgodicDistribution(H, method='eigs', guess=None, tol=1e-14, maxiter=10000):
+    '''
+    Stationary distribution mu = mu H of the histogram transition matrix.
+
+    Parameters
+    ----------
+    H : scipy.sparse matrix
+        transition matrix, rows: states today, columns: states tomorrow
+    method : str
+        'eigs'   : sparse eigensolver (skipped if guess is already stationary
+                   up to 1e-9), polished by at least 50 power iterations
+        'direct' : sparse LU solve of (H'-I) mu = 0 with sum(mu) = 1
+        'power'  : power iteration started from guess
+    guess : np.array
+        starting distribution for 'power', e.g. the distribution of the
+        previous market-clearing iteration; uniform if None
+    tol : float
+        tolerance on the largest change of mu between two iterations
+    maxiter : int
+        maximum number of power iterations
+
+    Returns
+    -------
+    dict with
+    joint_distr : np.array
+        stationary distribution (flat, Fortran order of the states)
+    distJD : float
+        largest change in the last power iteration (0 for 'direct')
+    iterations : int
+        number of power iterations
+    residual : float
+        max |mu H - mu|
+    time : float
+        wall time in seconds
+    '''
+    start_time = time.perf_counter()
+
+    HT = sp.csr_matrix(H).transpose().tocsr()
+    N = HT.shape[0]
+
+    if method == 'direct':
+        # replace the last (redundant) equation by the normalisation
+        A = (HT - sp.identity(N, format='csr')).tolil()
+        A[N-1, :] = np.ones(N)
+        b = np.zeros(N)
+        b[N-1] = 1.
+        joint_distr = spsolve(A.tocsc(), b)
+        joint_distr = np.maximum(joint_distr, 0.)
+        joint_distr = joint_distr/joint_distr.sum()
+        distJD = 0.
+        countJD = 0
+    else:
+        if method == 'eigs':
+            joint_distr = None
+            if guess is not None:
+                # keep a guess that is already (nearly) stationary
+                joint_distr = np.asarray(guess, dtype=float).flatten(order='F')
+                joint_distr_next = HT.dot(joint_distr)
+                if np.max(np.abs(joint_distr_next/joint_distr_next.sum() - joint_distr)) > 1e-9:
+                    joint_distr = None
+            if joint_distr is None:
+                eigen, joint_distr = eigs(HT, k=1, which='LM')
+                joint_distr = joint_distr.real.flatten()
+            miniter = 50
+        elif method == 'power':
+            if guess is None:
+                joint_distr = np.ones(N)/N
+            else:
+                joint_distr = np.asarray(guess, dtype=float).flatten(order='F')
+            miniter = 1
+        else:
+            raise ValueError('Unknown method for the ergodic distribution: ' + str(method))
+        joint_distr = joint_distr/joint_distr.sum()
+
+        distJD = 9999.
+        countJD = 0
+        while (distJD > tol or countJD < miniter) and countJD < maxiter:
+            joint_distr_next = HT.dot(joint_distr)
+            joint_distr_next /= joint_distr_next.sum()
+            distJD = np.max(np.abs(joint_distr_next - joint_distr))
+            joint_distr = joint_distr_next
+            countJD += 1
+
+    residual = np.max(np.abs(HT.dot(joint_distr) - joint_distr))
+
+    return {'joint_distr': joint_distr, 'distJD': distJD, 'iterations': countJD,
+            'residual': residual, 'time': time.perf_counter() - start_time}
+
+
+def WeightedPercentiles(values, weights, percentiles):
+    '''
+    Percentiles of a discrete distribution (e.g. a histogram): the smallest
+    value below or at which a share percentile of the mass lies.
+
+    Parameters
+    ----------
+    values : np.array
+        values at the points of the distribution, any shape
+    weights : np.array
+        mass at the points, same size as values
+    percentiles : float or sequence of floats
+        shares in [0, 1]
+
+    Returns
+    -------
+    np.array, one value per percentile
+    '''
+    values = np.ravel(values)
+    order = np.argsort(values, kind='mergesort')
+    cum = np.cumsum(np.ravel(weights)[order])
+    index = np.searchsorted(cum, np.atleast_1d(percentiles)*cum[-1], side='left')
+    return values[order][np.minimum(index, len(values) - 1)]
+
+
+def LorenzShares(values, weights, percentiles):
+    '''
+    Points of the Lorenz curve of a discrete distribution: the share of the
+    total of values held by the lowest share percentile of the mass, mass
+    at a point being divisible.
+
+    Parameters
+    ----------
+    values : np.array
+        values at the points of the distribution, e.g. wealth, any shape
+    weights : np.array
+        mass at the points, same size as values
+    percentiles : float or sequence of floats
+        shares of the mass in [0, 1]
+
+    Returns
+    -------
+    np.array, one share per percentile
+    '''
+    values = np.ravel(values)
+    order = np.argsort(values, kind='mergesort')
+    weights = np.ravel(weights)[order]
+    cum_mass = np.concatenate(([0.], np.cumsum(weights)))
+    cum_value = np.concatenate(([0.], np.cumsum(weights*values[order])))
+    # cumulative holdings are piecewise linear in the cumulative mass
+    return np.interp(np.atleast_1d(percentiles)*cum_mass[-1], cum_mass, cum_value)/cum_value[-1]
+
+
+def BatchInterp1d(x, y, xq, length=None):
+    '''
+    Linear interpolation of many columns at once, with the semantics of
+    scipy's interp1d(x[:,j], y[:,j], fill_value='extrapolate') applied to
+    every column j: the knots are sorted, and points outside the knots are
+    extrapolated linearly from the first or last segment.
+
+    The position of each query among the knots is found for all columns
+    with one stable sort of knots and queries, instead of building one
+    interp1d object per column.
+
+    Parameters
+    ----------
+    x : np.array (n, c)
+        knots, one column per function
+    y : np.array (n, c) or tuple of such arrays
+        values at the knots, arrays broadcastable to (n, c) are accepted
+    xq : np.array (q,) or (q, c)
+        query points, common to all columns or one column each
+    length : np.array (c,)
+        number of valid knots per column (the first length[j] rows of
+        column j), all rows are used if None
+
+    Returns
+    -------
+    np.array (q, c), or a tuple of them if y is a tuple
+    '''
+    multiple = isinstance(y, tuple)
+    ys = y if multiple else (y,)
+
+    x, order, xq, index = _InterpolationIndex(x, xq, length)
+    n, c = x.shape
+    ys = [np.take_along_axis(np.broadcast_to(np.asarray(yy, dtype=float), (n, c)), order, axis=0) for yy in ys]
+
+    x_lo = np.take_along_axis(x, index - 1, axis=0)
+    x_hi = np.take_along_axis(x, index, axis=0)
+
+    out = []
+    for yy in ys:
+        y_lo = np.take_along_axis(yy, index - 1, axis=0)
+        y_hi = np.take_along_axis(yy, index, axis=0)
+        slope = (y_hi - y_lo) / (x_hi - x_lo)
+        out.append(slope*(xq - x_lo) + y_lo)
+
+    return tuple(out) if multiple else out[0]
+
+
+def _InterpolationIndex(x, xq, length=None):
+    '''
+    Sorts the knots of BatchInterp1d column by column and finds the segment
+    of each query.
+
+    Returns
+    -------
+    x : np.array (n, c)
+        sorted knots, rows beyond length set to inf
+    order : np.array (n, c)
+        sorting permutation of each column
+    xq : np.array (q, c)
+        query points, one column each
+    index : np.array (q, c)
+        upper knot of the segment used for each query, in 1..length-1
+    '''
+    x = np.array(x, dtype=float)
+    n, c = x.shape
+
+    if length is None:
+        length = np.full(c, n)
+    else:
+        length = np.asarray(length, dtype=np.int64)
+        x[np.arange(n)[:, np.newaxis] >= length[np.newaxis, :]] = np.inf
+
+    order = np.argsort(x, axis=0, kind='mergesort')
+    x = np.take_along_axis(x, order, axis=0)
+
+    xq = np.asarray(xq, dtype=float)
+    if xq.ndim == 1:
+        xq = np.tile(xq[:, np.newaxis], (1, c))
+    q = xq.shape[0]
+
+    # number of knots strictly smaller than each query (searchsorted, side='left'):
+    # queries come first, so that the stable sort puts them before equal knots
+    merged = np.argsort(np.vstack((xq, x)), axis=0, kind='mergesort')
+    is_knot = merged >= q
+    knots_before = np.cumsum(is_knot, axis=0) - is_knot
+    cols = np.broadcast_to(np.arange(c), merged.shape)
+    is_query = ~is_knot
+    index = np.empty((q, c), dtype=np.int64)
+    index[merged[is_query], cols[is_query]] = knots_before[is_query]
+
+    return x, order, xq, np.clip(index, 1, length[np.newaxis, :] - 1)
+
+
+def BatchInterp1dJVP(x, y, xq, dx, dy):
+    '''
+    BatchInterp1d and its derivative along a perturbation (dx, dy) of the
+    knots and values, for fixed query points. Each query stays on the
+    segment it has in BatchInterp1d, so this is the derivative away from
+    the knots.
+
+    Parameters
+    ----------
+    x, y, xq : see BatchInterp1d (all rows of x are knots)
+    dx : np.array (n, c)
+        perturbation of the knots
+    dy : np.array (n, c) or tuple of such arrays
+        perturbation of the values, one per array of y
+
+    Returns
+    -------
+    (values, derivatives), each np.array (q, c) or a tuple of them if y is
+    a tuple
+    '''
+    multiple = isinstance(y, tuple)
+    ys = y if multiple else (y,)
+    dys = dy if multiple else (dy,)
+
+    x, order, xq, index = _InterpolationIndex(x, xq)
+    n, c = x.shape
+
+    def Sorted(a):
+        return np.take_along_axis(np.broadcast_to(np.asarray(a, dtype=float), (n, c)), order, axis=0)
+
+    def Segment(a):
+        return np.take_along_axis(a, index - 1, axis=0), np.take_along_axis(a, index, axis=0)
+
+    x_lo, x_hi = Segment(x)
+    dx_lo, dx_hi = Segment(Sorted(dx))
+    t = (xq - x_lo) / (x_hi - x_lo)
+
+    out = []
+    dout = []
+    for yy, dyy in zip(ys, dys):
+        y_lo, y_hi = Segment(Sorted(yy))
+        dy_lo, dy_hi = Segment(Sorted(dyy))
+        slope = (y_hi - y_lo) / (x_hi - x_lo)
+        out.append(slope*(xq - x_lo) + y_lo)
+        dout.append((1. - t)*dy_lo + t*dy_hi - slope*((1. - t)*dx_lo + t*dx_hi))
+
+    if multiple:
+        return tuple(out), tuple(dout)
+    return out[0], dout[0]
+
+
+def NormalTransition(N, rho, sigma_e, bounds, nodes=16, pieces=16):
+    '''
+    Transition matrix of the bins of x' = rho x + sigma_e e, with x and e
+    standard normal: P[i,j] is the probability that x' is in
+    [bounds[j], bounds[j+1]] given that x is in [bounds[i], bounds[i+1]].
+
+    The integral over x in each bin is computed for all cells at once by
+    composite Gauss-Legendre quadrature (pieces sub-intervals with nodes
+    points each), instead of one adaptive quadrature per cell.
+
+    Parameters
+    ----------
+    N : int
+        number of bins
+    rho : float
+    sigma_e : float
+    bounds : np.array (N+1,)
+        bin bounds, may be infinite
+    nodes, pieces : int
+        quadrature points per sub-interval and sub-intervals per bin
+
+    Returns
+    -------
+    P : np.array (N x N)
+        rows normalised to one
+    '''
+    wx, z = _NormalQuadrature(N, rho, sigma_e, bounds, nodes, pieces)
+    P = np.einsum('ipn,ipnj->ij', wx, np.diff(norm.cdf(z), axis=-1))
+
+    return P/np.sum(P, axis=1)[:, np.newaxis]
+
+
+def _NormalQuadrature(N, rho, sigma_e, bounds, nodes, pieces):
+    '''
+    Quadrature weights (times the density of x) and standardised bounds
+    z = (bounds - rho x)/sigma_e at the quadrature points of NormalTransition.
+
+    Returns
+    -------
+    wx : np.array (N x pieces x nodes)
+    z : np.array (N x pieces x nodes x N+1)
+    '''
+    bounds = np.asarray(bounds, dtype=float).ravel()[:N+1]
+    lo = np.clip(bounds[:-1], -NORMAL_CUTOFF, NORMAL_CUTOFF)
+    hi = np.clip(bounds[1:], -NORMAL_CUTOFF, NORMAL_CUTOFF)
+
+    t, w = np.polynomial.legendre.leggauss(nodes)
+    edges = lo[:, np.newaxis] + (hi - lo)[:, np.newaxis]*np.linspace(0., 1., pieces+1)[np.newaxis, :]
+    half = (edges[:, 1:] - edges[:, :-1])[:, :, np.newaxis]/2.
+    x = (edges[:, 1:] + edges[:, :-1])[:, :, np.newaxis]/2. + half*t        # N x pieces x nodes
+    wx = half*w*norm.pdf(x)
+
+    return wx, (bounds[np.newaxis, np.newaxis, np.newaxis, :] - rho*x[:, :, :, np.newaxis])/sigma_e
+
+
+def NormalTransitionDerivative(N, rho, sigma_e, bounds, nodes=16, pieces=16):
+    '''
+    Derivative of NormalTransition with respect to sigma_e, by the same
+    quadrature.
+
+    Returns
+    -------
+    dP : np.array (N x N)
+        rows sum to zero
+    '''
+    wx, z = _NormalQuadrature(N, rho, sigma_e, bounds, nodes, pieces)
+    # d/dsigma_e of cdf(z) is -pdf(z) z/sigma_e, zero at infinite bounds
+    dcdf = -norm.pdf(z)*np.where(np.isfinite(z), z, 0.)/sigma_e
+    P = np.einsum('ipn,ipnj->ij', wx, np.diff(norm.cdf(z), axis=-1))
+    dP = np.einsum('ipn,ipnj->ij', wx, np.diff(dcdf, axis=-1))
+
+    total = np.sum(P, axis=1)[:, np.newaxis]
+    return dP/total - P*np.sum(dP, axis=1)[:, np.newaxis]/total**2
+
+
+@lru_cache(maxsize=32)
+def _CachedNormalTransition(N, rho, sigma_e, bounds):
+    P = NormalTransition(N, rho, sigma_e, np.array(bounds))
+    P.setflags(write=False)
+    return P
+
+
+def CachedNormalTransition(N, rho, sigma_e, bounds, decimals=12):
+    '''
+    NormalTransition, kept for the 32 most recent inputs (rounded to
+    decimals), so that evaluations of Fsys at the same aggregate state,
+    e.g. Jacobian columns that do not perturb S, do not rebuild it.
+
+    Returns
+    -------
+    P : np.array (N x N)
+        a copy, can be modified
+    '''
+    # rho and sigma_e may come as 1 x 1 arrays, e.g. from the aggregate state S
+    key = (int(N), round(np.asarray(rho, dtype=float).item(), decimals),
+           round(np.asarray(sigma_e, dtype=float).item(), decimals),
+           tuple(np.round(np.asarray(bounds, dtype=float).ravel()[:int(N)+1], decimals)))
+    return _CachedNormalTransition(*key).copy()
+
+
+class MarginalPerturbation(LinearOperator):
+    '''
+    Mapping Gamma_state of the reduced histogram states to perturbations of
+    the stacked marginal distributions that leave the mass of each marginal
+    unchanged.
+
+    Each marginal x (one block of Xss with n points) is perturbed by n-1
+    states; state j moves sum(x) of mass to point j and takes it from all
+    points in proportion to x, i.e. the block is sum(x) [I; 0] - x 1'.
+    Products cost O(number of points), and the dense matrix is never built.
+
+    Parameters
+    ----------
+    Xss : np.array
+        steady state, starting with the stacked marginals
+    blocks : list of tuples
+        (first row, number of points) of each perturbed marginal; rows of
+        Xss outside the blocks (e.g. the entrepreneur state) are not perturbed
+    nrows : int
+        number of rows (points of all marginals)
+    '''
+
+    def __init__(self, Xss, blocks, nrows):
+        Xss = np.asarray(Xss, dtype=float).ravel()
+        self.blocks = [(int(r0), int(n)) for r0, n in blocks]
+        self.marginals = [Xss[r0:r0+n].copy() for r0, n in self.blocks]
+        self.mass = [np.sum(x) for x in self.marginals]
+        ncols = sum(n - 1 for r0, n in self.blocks)
+        LinearOperator.__init__(self, dtype=np.float64, shape=(int(nrows), ncols))
+
+    def _matmat(self, V):
+        V = np.asarray(V)
+        out = np.zeros((self.shape[0], V.shape[1]))
+        c0 = 0
+        for (r0, n), x, mass in zip(self.blocks, self.marginals, self.mass):
+            Vb = V[c0:c0+n-1]
+            out[r0:r0+n-1] += mass*Vb
+            out[r0:r0+n] -= x[:, np.newaxis]*np.sum(Vb, axis=0)[np.newaxis, :]
+            c0 += n - 1
+        return out
+
+    def _matvec(self, v):
+        return self._matmat(np.reshape(v, (-1, 1))).ravel()
+
+    def _rmatmat(self, W):
+        W = np.asarray(W)
+        out = np.zeros((self.shape[1], W.shape[1]))
+        c0 = 0
+        for (r0, n), x, mass in zip(self.blocks, self.marginals, self.mass):
+            out[c0:c0+n-1] = mass*W[r0:r0+n-1] - x.dot(W[r0:r0+n])[np.newaxis, :]
+            c0 += n - 1
+        return out
+
+    def _rmatvec(self, w):
+        return self._rmatmat(np.reshape(w, (-1, 1))).ravel()
+
+    def toarray(self):
+        '''
+        Dense matrix of the operator.
+        '''
+        return self._matmat(np.eye(self.shape[1]))
+
+
+###############################################################################
+# Grids, productivity transitions and interpolation weights (formerly
+# SharedFunc, SharedFunc2 and SharedFunc3)
+
+def DoubleLogGrid(n, x_min, x_max):
+    '''
+    n points between x_min and x_max, exp(exp(.)) spaced so that they are
+    dense near x_min
+    '''
+    return np.exp(np.exp(np.linspace(0., np.log(np.log(x_max - x_min +1)+1), n))-1)-1+x_min
+
+
+def MakeGrid(mpar, grid):
+    '''
+    Make a quadruble log grid
+    
+    Parameters
+    ----------
+    mpar : dict
+        mpar['nm']=mpar.nm : int
+    grid : dict
+        grid['m']=grid.m : np.array
+        
+    Returns
+    -------
+    grid : np.array
+        new grid
+    '''
+    m_min = -10.87 # natural borrowing limit
+    m_max = 150
+    return MakeGrid2(mpar, grid, m_min, m_max)
+
+
+def MakeGrid2(mpar, grid, m_min, m_max, with_zero=False):
+    '''
+    Make a quadruble log grid
+    
+    Parameters
+    ----------
+    mpar : dict
+        mpar['nm']=mpar.nm : int
+    grid : dict
+        grid['m']=grid.m : np.array
+    m_min : float
+    m_max : float
+    with_zero : bool
+        False: nm points (one-asset models); True: nm-1 points and zero,
+        so that zero bonds are on the grid (two-asset model)
+    
+    Returns
+    -------
+    grid : np.array
+        new grid
+    '''
+    if with_zero:
+        grid['m'] = np.sort(np.append(DoubleLogGrid(mpar['nm']-1, m_min, m_max), 0.))
+    else:
+        grid['m'] = DoubleLogGrid(mpar['nm'], m_min, m_max)
+        grid['m'][np.abs(grid['m'])==np.min(grid['m'])]=0.
+    
+    return grid
+
+
+def MakeGridkm(mpar, grid, k_min, k_max, m_min, m_max):
+    '''
+    Make a quadruble log grid
+    
+    Parameters
+    ----------
+    mpar : dict
+        mpar['nm']=mpar.nm : int
+    grid : dict
+        grid['m']=grid.m : np.array
+    k_min : float
+    k_max : float
+    m_min : float
+    m_max : float        
+    
+    Returns
+    -------
+    grid : np.array
+        new grid
+    '''
+    grid['k'] = np.exp(np.linspace(0., np.log(k_max - k_min +1.), mpar['nk']))-1 + k_min # set up quadruple exponential grid
+    
+    return MakeGrid2(mpar, grid, m_min, m_max, with_zero=True)
+
+
+def Transition(N,rho,sigma_e,bounds):
+    '''
+    Calculate transition probability matrix for a given grid for a Markov chain
+    with long-run variance equal to 1 and mean 0
+    
+     Parameters
+    ----------
+    N : float
+        number of states
+    rho : float
+    sigma_e : float
+    bounds : np.array (1,N+1)
+
+    Returns
+    ----------
+    P : np.array    
+        transition matrix
+    '''
+    # vectorised quadrature, reused for repeated (rho, sigma_e, bounds)
+    return CachedNormalTransition(N, rho, sigma_e, bounds)
+
+
+def ExTransitions(S, grid, mpar, par):
+    '''
+    Generate transition probabilities and grid
+    
+    Parameters
+    ----------
+    S : float
+        Aggregate exogenous state
+    grid : dict
+        grid['m']=grid.m : np.array
+        grid['h']=grid.h : np.array
+        grid['boundsH']=grid.boundsH : np.array (1,mpar['nh'])
+    par : dict
+        par['xi]=par.xi : float
+        par['rhoS']=par.rhoS : float
+        par['rhoH']=par.rhoH : float
+    mpar : dict
+        mpar['nm']=mpar.nm : int
+        mpar['nh']=mpar.nh : int   
+        mpar['in']=mpar.in : float
+        mpar['out']=mpar.out : float   
+    
+     Returns
+     -------
+     P_H : np.array
+         Transition probabilities
+     grid : dict
+         Grid
+     par : dict
+         Parameters
+    '''
+    
+    aux = np.sqrt(S) * np.sqrt(1-par['rhoH']**2)
+    
+    P = Transition(mpar['nh']-1, par['rhoH'], aux, grid['boundsH'].copy())
+    
+    P_H = np.concatenate((P, np.tile(mpar['in'],(int(mpar['nh']-1),1))), axis=1)
+    lastrow = np.concatenate((np.zeros((1,mpar['nh']-1)), [[1-mpar['out']]]), axis=1)
+    lastrow[0,int(np.ceil(mpar['nh']/2))-1] = mpar['out']
+    P_H = np.concatenate((P_H.copy(),lastrow.copy()),axis=0)
+    P_H = P_H.copy()/np.transpose(np.tile(np.sum(P_H, axis=1),(mpar['nh'],1)))
+    
+    return {'P_H': P_H, 'grid': grid, 'par': par}
+
+
+def ExTransitionsDerivative(S, grid, mpar, par):
+    '''
+    Derivative of ExTransitions(S, grid, mpar, par)['P_H'] with respect to
+    the aggregate state S (the variance of productivity shocks).
+
+    Returns
+    -------
+    dP_H : np.array (nh x nh)
+    '''
+    aux = np.sqrt(S) * np.sqrt(1-par['rhoH']**2)
+    nh = int(mpar['nh'])
+
+    P = Transition(nh-1, par['rhoH'], aux, grid['boundsH'].copy())
+    dP = NormalTransitionDerivative(nh-1, par['rhoH'], np.asarray(aux, dtype=float).item(),
+                                    grid['boundsH'].copy()) * np.asarray(aux/(2.*S), dtype=float).item()
+
+    # P_H before normalising its rows, as in ExTransitions
+    P_H = np.concatenate((P, np.tile(mpar['in'],(nh-1,1))), axis=1)
+    lastrow = np.concatenate((np.zeros((1,nh-1)), [[1-mpar['out']]]), axis=1)
+    lastrow[0,int(np.ceil(nh/2))-1] = mpar['out']
+    P_H = np.concatenate((P_H, lastrow), axis=0)
+    dP_H = np.zeros((nh, nh))
+    dP_H[:-1,:-1] = dP
+
+    total = np.sum(P_H, axis=1)[:, np.newaxis]
+    return dP_H/total - P_H*np.sum(dP_H, axis=1)[:, np.newaxis]/total**2
+
+
+def GenWeight(x,xgrid):
+    '''
+    Generate weights and indexes used for linear interpolation
+    (no extrapolation allowed)
+    
+    Parameters
+    ----------
+    x: np.array
+        Points at which function is to be interpolated 
+    xgrid: np.array
+        grid points at which function is measured
+        
+    Returns
+    -------
+    weight : np.array
+        weight for each index
+    index : np.array
+        index for integration    
+    '''
+    
+    index = np.digitize(x, xgrid)-1
+    index[x <= xgrid[0]] = 0
+    index[x >= xgrid[-1]] = len(xgrid)-2
+    
+    weight = (x-xgrid[index])/(xgrid[index+1]-xgrid[index]) # weight xm of higher gridpoint
+    weight[weight.copy()<=0] = 10**(-16) # no extrapolation
+    weight[weight.copy()>=1] = 1-10**(-16)
+    
+    return {'weight': weight, 'index': index}
+
+
+def GenWeightJVP(x, dx, xgrid):
+    '''
+    GenWeight and the derivative of its weight along dx, for fixed indexes;
+    weights clipped to the grid do not move.
+
+    Returns
+    -------
+    dict with weight and index as GenWeight, and dweight
+    '''
+    result = GenWeight(x, xgrid)
+    index = result['index']
+    weight = result['weight']
+
+    dweight = np.asarray(dx)/(xgrid[index+1]-xgrid[index])
+    dweight[(weight <= 10**(-16)) | (weight >= 1-10**(-16))] = 0.
+
+    return {'weight': weight, 'index': index, 'dweight': dweight}
+
+
+def Tauchen(rho, N, sigma, mue, types):
+    '''
+    Generates a discrete approximation to an AR 1 process following Tauchen(1987)
+    
+    Parameters
+    ----------
+    rho : float
+        coefficient for AR1
+    N : int
+        number of gridpoints
+    sigma : float
+        long-run variance
+    mue :  float   
+        mean of AR1 process
+    types : string
+        grid transition generation alogrithm
+        'importance' : importance sampling (Each bin has probability 1/N to realize)
+        'equi' : bin-centers are equi-spaced between +-3 std
+        'simple' : like equi + Transition Probabilities are calculated without using integrals
+        'simple importance' : like simple but with grid from importance
+        
+    return
+    -----------
+    grid : np.array
+        grid 
+    P : np.array
+        Markov probability
+    bounds : np.array
+        bounds
+    
+    '''
+    pijfunc = lambda x, bound1, bound2 : norm.pdf(x)*(norm.cdf((bound2-rho*x)/sigma_e)-norm.cdf((bound1-rho*x)/sigma_e))
+    
+    if types in {'importance','equi','simple','simple importance'}:
+       types = types
+    else:
+       types = 'importance'
+       print('Warning: TAUCHEN:NoOpt','No valid type set. Importance sampling used instead')
+       
+    if types == 'importance': # Importance sampling
+           
+       grid_probs = np.linspace(0,1,N+1) 
+       bounds = norm.ppf(grid_probs)
+       
+       # replace (-)Inf bounds by finite numbers
+       bounds[0] = bounds[1].copy()-99
+       bounds[-1] = bounds[-2].copy()+99
+        
+       # Calculate grid - centers
+       grid = 1*N*( norm.pdf(bounds[:-1]) - norm.pdf(bounds[1:]))
+      
+       sigma_e = np.sqrt(1-rho**2) # Calculate short run variance
+       P = NormalTransition(N, rho, sigma_e, bounds)
+              
+       #P=np.array([[0.9106870252,0.0893094991,0.0000037601],[0.0893075628,0.8213812539,0.0893075628],[0.0000037601,0.0893094991,0.9106899258]])
+       #print bounds 
+       #print P
+       P[int(np.floor((N-1)/2)+1):N,:] = P[int(np.ceil((N-1)/2))-1::-1,::-1].copy()
+       
+    elif types == 'equi': # use +-3 std equi-spaced grid
+        # Equi-spaced
+        step = 6/(N-1)
+        grid = np.range(-3.,3+step,step)
+        
+        bounds = np.concatenate(([-99],grid[:-1].copy()+step/2,[99]),axis=1)
+        sigma_e = np.sqrt(1-rho**2) # calculate short run variance
+        P=np.zeros((N,N))
+        
+        pijfunc = lambda x, bound1, bound2 : norm.pdf(x)*(norm.cdf((bound2-rho*x)/sigma_e)-norm.cdf((bound1-rho*x)/sigma_e))
+        
+        for i in range( int(np.floor((N-1)/2+1)) ): # Exploit symmetrie
+          for j in range(N):
+              pijvalue, err = sc.integrate.quad(pijfunc, bounds[i], bounds[i+1], args=(bounds[j], bounds[j+1]))
+              P[i,j] = pijvalue/(norm.cdf(bounds[i])-norm.cdf(bounds[i-1]))
+       
+        P[int(np.floor((N-1)/2)+1):N,:] = P[int(np.ceil((N-1)/2))-1::-1,::-1].copy()
+        
+    elif types == 'simple': # use simple transition probabilities
+        
+        step = 12/(N-1)
+        grid = np.range(-6.,6+step, step)
+        bounds=[]
+        sigma_e = np.sqrt(1-rho**2)
+        P=np.zeros((N,N))
+        
+        pijfunc = lambda x, bound1, bound2 : norm.pdf(x)*(norm.cdf((bound2-rho*x)/sigma_e)-norm.cdf((bound1-rho*x)/sigma_e))
+        
+        for i in range(N):
+            P[i,0] = norm.cdf((grid[0]+step/2-rho*grid[i])/sigma_e)
+            P[i,-1] = 1- norm.cdf((grid[-1]+step/2-rho*grid[i])/sigma_e)
+            for j in range(1,N-1):
+                P[i,j] = norm.cdf((grid[j]+step/2-rho*grid[i])/sigma_e) - norm.cdf((grid[j]-step/2-rho*grid[i])/sigma_e)
+                
+    elif types == 'simple importance': # use simple transition probabilities
+        
+        grid_probs = np.linspace(0.,1.,N+1)            
+        bounds = norm.ppd(grid_probs.copy())
+        
+        # calculate grid - centers
+        grid = N*(norm.pdf(bounds[:-1])-norm.pdf(bounds[1:]))
+        
+        #replace -Inf bounds by finite numbers
+        bounds[0] = bounds[1] - 99
+        bounds[-1] = bounds[-2] + 99
+        
+        sigma_e = np.sqrt(1-rho**2)
+        P=np.zeros((N,N))
+        pijfunc = lambda x, bound1, bound2 : norm.pdf(x)*(norm.cdf((bound2-rho*x)/sigma_e)-norm.cdf((bound1-rho*x)/sigma_e))
+        
+        for i in range(int(np.floor((N-1)/2))+1):
+            P[i,0] = norm.cdf((bounds[1]-rho*grid[i])/sigma_e)
+            P[i,-1] = 1- norm.cdf((bounds[-2]-rho*grid[i])/sigma_e)
+            for j in range(int(np.floor((N-1)/2))+1):
+                P[i,j] = norm.cdf((bounds[j+1]-rho*grid[i])/sigma_e) -norm.cdf((bounds[j]-rho*grid[i])/sigma_e)
+            
+        P[int(np.floor((N-1)/2))+1:,:] = P[int(np.ceil((N-1)/2))-1::-1,::-1].copy()
+    
+    
+    ps = np.sum(P,axis=1)
+    P=P.copy()/np.transpose(np.tile(ps.copy(),(N,1)))
+    
+    grid = grid.copy()*np.sqrt(sigma) + mue
+        
+    return {'grid': grid, 'P':P, 'bounds':bounds}
+
+
+def Fastroot(xgrid, fx):
+        
+        # fast linear interpolation root finding
+        # (=one Newton step at largest negative function value)
+        # stripped down version of interp1 that accepts multiple inputs (max 3)
+        # that are interpolated over the same grids x & xi
+    xgrid = xgrid.flatten(order='F')
+    fx = np.reshape( fx, (np.size(xgrid), np.size(fx)//np.size(xgrid)), order='F' )
+
+    dxgrid = np.diff(xgrid)
+    dfx = np.diff(fx,axis=0)
+    idx = np.zeros((1, np.size(fx)//np.size(xgrid))).T
+
+        # Make use of the fact that the difference equation is monotonically
+        # increasing in m
+    idx_min = (fx[0,:]>0) # Corner solutions left (if no solution x* to f(x)=0 exists)
+    idx_max = (fx[-1,:]<0) # Corner solutions right (if no solution x* to f(x)=0 exists)
+    index = np.squeeze(np.asarray((np.where((~idx_min) & (~idx_max))))) # interior solutions (if solution x* to f(x)=0 exists)
+
+    # Find index of two gridpoints where sign of fx changes from positive to negative,
+    idx[index] = np.asmatrix(np.argmax(np.diff(np.sign(fx[:,index]),axis=0),axis=0)).T
+    
+        
+    aux_index = np.asmatrix(np.arange(0, np.size(fx)//np.size(xgrid), 1)*np.size(xgrid)).T # aux for linear indexes
+    aux_index2 = np.arange(0, np.size(fx)//np.size(xgrid), 1)*(np.size(xgrid)-1)
+    fx=fx.flatten(order='F')    
+    fxx = fx[idx.astype(int)+aux_index].T
+    xl = xgrid[idx.astype(int)].T
+    dx = dxgrid[idx.astype(int)].T
+    dfx=dfx.flatten(order='F')
+    dfxx = dfx[idx.astype(int).T+np.asmatrix(aux_index2)]
+    # Because function is piecewise linear in gridpoints, one newton step is enough to find the solution
+    dfxx[dfxx.copy()== 0.] = 10**(-20) 
+    roots = xl - fxx*dx/dfxx
+
+    roots[np.asmatrix(idx_min)] = xgrid[0] # constrained choice
+    roots[np.asmatrix(idx_max)] = xgrid[-1] # no-extrapolation
+    
+    return roots
+
+
+def MergeResourceLists(grid, m_star_zero, aux_c, aux_inc, Resource, c_star, m_a_star):
+    '''
+    Merges, for every productivity state, the policies with k'=0 and m' below
+    m*(k'=0) with the unconstrained policies of EGM step 3, as columns of
+    padded arrays that can be interpolated in one call (EGM step 4).
+    
+    Parameters
+    ----------
+    grid : dict
+        grid['m'], grid['k'] : np.array
+    m_star_zero : np.array (nh)
+        money holdings that correspond to k'=0
+    aux_c : np.array (nm, nh)
+        consumption at k'=0 from the no-adjustment problem
+    aux_inc : np.array (1, nh)
+        non-capital income
+    Resource, c_star, m_a_star : np.array (nk, nh)
+        resources, consumption and money policy when no constraint binds
+        
+    Returns
+    -------
+    res_list, cons_list, mon_list, cap_list : np.array (nm+nk, nh)
+        resources and corresponding consumption, money and capital policy;
+        only the first length[j] rows of column j are used
+    length : np.array (nh)
+        number of valid points per productivity state
+    '''
+    grid_m = np.asarray(grid['m']).flatten()
+    grid_k = np.asarray(grid['k']).flatten()
+    nm = len(grid_m)
+    nk = len(grid_k)
+    
+    aux_c = np.asarray(aux_c)
+    aux_inc = np.asarray(aux_inc).flatten()
+    Resource = np.asarray(Resource)
+    c_star = np.asarray(c_star)
+    m_a_star = np.asarray(m_a_star)
+    
+    # number of money choices below m*(k'=0), zero if m*(k'=0) is at the borrowing limit
+    m_star_zero = np.asarray(m_star_zero).flatten()
+    n_zero = np.sum(grid_m[:,np.newaxis] < m_star_zero[np.newaxis,:], axis=0)
+    n_zero[m_star_zero <= grid_m[0]] = 0
+    
+    row = np.arange(nm+nk)[:,np.newaxis]
+    col = np.arange(len(m_star_zero))[np.newaxis,:]
+    k_cons = row < n_zero                               # part with k'=0
+    i_m = np.minimum(row, nm-1) + 0*col
+    i_k = np.clip(row - n_zero, 0, nk-1)
+    
+    res_list  = np.where(k_cons, grid_m[i_m] + aux_c[i_m, col] - aux_inc[col], Resource[i_k, col])
+    cons_list = np.where(k_cons, aux_c[i_m, col], c_star[i_k, col])
+    mon_list  = np.where(k_cons, grid_m[i_m], m_a_star[i_k, col])
+    cap_list  = np.where(k_cons, 0., grid_k[i_k])
+    
+    return {'res_list': res_list, 'cons_list': cons_list, 'mon_list': mon_list, 'cap_list': cap_list,
+            'length': n_zero + nk}
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+'''
+Impulse responses and simulations of the linearized model
+
+    X' = hx X + eta eps',   Y = gx X
+
+for many shocks, horizons and paths at once, and the distributions and
+policies implied by the reduced states and controls on demand.
+
+Usage, e.g. after SGU_solver:
+
+    from Assets.StateSpace import ImpulseResponses
+    x0 = np.zeros((mpar['numstates'], 1))
+    x0[-1] = par['sigmaS']
+    IRF = ImpulseResponses(SGUresult['hx'], SGUresult['gx'], x0, 16)
+'''
+from __future__ import print_function
+
+import numpy as np
+
+
+def ObservationMatrix(gx, rows=None):
+    '''
+    Matrix MX = (I; gx) that maps the states to the stacked states and
+    controls, or the given rows of it.
+
+    Parameters
+    ----------
+    gx : np.array (numcontrols x numstates)
+    rows : array of int
+        rows of (states; controls) to keep, all if None
+
+    Returns
+    -------
+    MX : np.array (len(rows) x numstates)
+    '''
+    gx = np.asarray(gx)
+    numstates = gx.shape[1]
+    if rows is None:
+        return np.vstack((np.eye(numstates), gx))
+
+    rows = np.asarray(rows, dtype=int)
+    MX = np.zeros((len(rows), numstates))
+    is_state = rows < numstates
+    MX[is_state, rows[is_state]] = 1.
+    MX[~is_state, :] = gx[rows[~is_state] - numstates, :]
+    return MX
+
+
+def ImpulseResponses(hx, gx, shocks, horizon, rows=None):
+    '''
+    Responses of the states and controls to initial impulses of the states.
+
+    All impulses are propagated together, one product with hx per period,
+    and the controls are obtained in a single product with gx at the end.
+
+    Parameters
+    ----------
+    hx : np.array (numstates x numstates)
+    gx : np.array (numcontrols x numstates)
+    shocks : np.array (numstates,) or (numstates x nshocks)
+        initial deviation of the states, one column per impulse
+    horizon : int
+        number of periods, the impulse is period 0
+    rows : array of int
+        rows of (states; controls) to return, all if None
+
+    Returns
+    -------
+    IRF : np.array (rows x horizon x nshocks)
+        IRF[:, t, j] is the deviation in period t after impulse j; with one
+        impulse, IRF[:, :, 0] is the former IRF_state_sparse of plot_IRF
+    '''
+    hx = np.asarray(hx)
+    shocks = np.asarray(shocks, dtype=float)
+    if shocks.ndim == 1:
+        shocks = shocks[:, np.newaxis]
+    numstates, nshocks = shocks.shape
+
+    X = np.empty((numstates, horizon, nshocks))
+    x = shocks
+    for t in range(horizon):
+        X[:, t, :] = x
+        x = hx.dot(x)
+
+    MX = ObservationMatrix(gx, rows)
+    return np.reshape(MX.dot(np.reshape(X, (numstates, horizon*nshocks))), (MX.shape[0], horizon, nshocks))
+
+
+def SimulateAggregates(hx, gx, eta, T, rows=None, paths=1, burnin=0, x0=None, seed=0):
+    '''
+    Stochastic simulation of the linearized model with normal shocks.
+
+    Only the states are iterated; the requested rows of (states; controls),
+    e.g. the aggregate controls, are obtained from them in one product with
+    the precomputed observation matrix.
+
+    Parameters
+    ----------
+    hx : np.array (numstates x numstates)
+    gx : np.array (numcontrols x numstates)
+    eta : np.array (numstates,) or (numstates x nshocks)
+        loading of the standard normal shocks on the states, e.g. sigmaS in
+        the last state
+    T : int
+        number of periods returned
+    rows : array of int
+        rows of (states; controls) to return, all if None
+    paths : int
+        number of independent paths
+    burnin : int
+        number of periods simulated and discarded before the first one
+    x0 : np.array (numstates,)
+        initial state, the steady state if None
+    seed : int
+        seed of the random number generator
+
+    Returns
+    -------
+    dict with
+    states : np.array (numstates x T x paths)
+    aggregates : np.array (rows x T x paths)
+    '''
+    hx = np.asarray(hx)
+    eta = np.asarray(eta, dtype=float)
+    if eta.ndim == 1:
+        eta = eta[:, np.newaxis]
+    numstates, nshocks = eta.shape
+
+    rng = np.random.RandomState(seed)
+    eps = rng.standard_normal((burnin + T, nshocks, paths))
+
+    x = np.zeros((numstates, paths))
+    if x0 is not None:
+        x[:] = np.reshape(np.asarray(x0, dtype=float), (numstates, 1))
+
+    X = np.empty((numstates, T, paths))
+    for t in range(burnin + T):
+        x = hx.dot(x) + eta.dot(eps[t])
+        if t >= burnin:
+            X[:, t - burnin, :] = x
+
+    MX = ObservationMatrix(gx, rows)
+    aggregates = np.reshape(MX.dot(np.reshape(X, (numstates, T*paths))), (MX.shape[0], T, paths))
+
+    return {'states': X, 'aggregates': aggregates}
+
+
+def DistributionPaths(states, Gamma_state, Xss=None):
+    '''
+    Marginal distributions implied by paths of the reduced states.
+
+    Parameters
+    ----------
+    states : np.array (numstates x ...)
+        paths of the states, e.g. IRF[:numstates] or the 'states' of
+        SimulateAggregates; the aggregate states after the histogram
+        states are ignored
+    Gamma_state : np.array, sparse matrix or LinearOperator
+        mapping of the reduced histogram states to the marginals
+    Xss : np.array
+        steady state; if given, levels are returned instead of deviations
+
+    Returns
+    -------
+    np.array (number of marginal points x ...)
+    '''
+    states = np.asarray(states)
+    nstates = Gamma_state.shape[1]
+    shape = states.shape[1:]
+
+    distr = Gamma_state.dot(np.reshape(states[:nstates], (nstates, -1)))
+    distr = np.reshape(np.asarray(distr), (Gamma_state.shape[0],) + shape)
+    if Xss is not None:
+        distr = distr + np.reshape(np.asarray(Xss)[:Gamma_state.shape[0]], (-1,) + (1,)*len(shape))
+
+    return distr
+
+
+def ControlPaths(controls, Gamma_control):
+    '''
+    Relative deviations of the full (uncompressed) controls implied by
+    paths of the reduced controls.
+
+    Parameters
+    ----------
+    controls : np.array (numcontrols x ...)
+        paths of the reduced controls, e.g. IRF[numstates:]
+    Gamma_control : np.array or function
+        matrix of the control basis (one-asset model), or a function
+        mapping a (numcontrols x n) array to the full controls, e.g. an
+        inverse DCT (two-asset model)
+
+    Returns
+    -------
+    np.array (number of full controls x ...)
+    '''
+    controls = np.asarray(controls)
+    shape = controls.shape[1:]
+    flat = np.reshape(controls, (controls.shape[0], -1))
+
+    if callable(Gamma_control):
+        full = np.asarray(Gamma_control(flat))
+    else:
+        full = np.asarray(Gamma_control.dot(flat))
+
+    return np.reshape(full, (full.shape[0],) + shape)
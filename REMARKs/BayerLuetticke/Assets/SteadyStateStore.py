@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+'''
+On-disk store of steady states, keyed by a hash of the model inputs.
+
+A steady state (the dict returned by SolveSteadyState) is saved as a
+directory holding an index.json with the dict structure and scalars, and
+one .npy file per array, so that the large arrays (joint_distr, Vm, Vk,
+policies) are memory-mapped on loading instead of read into memory.
+
+Usage, e.g. from the BayerLuetticke folder:
+
+    from Assets.SteadyStateStore import CachedSteadyState
+    EX1SS = CachedSteadyState(SteadyStateOneAssetIOU, **Params.parm_one_asset_IOU)
+'''
+from __future__ import print_function
+
+import numpy as np
+import hashlib
+import json
+import os
+import pickle
+import shutil
+from copy import deepcopy
+
+from .SharedKernels import RegularGridCopula, SplineCopula, AsSplineCopula
+
+# increase when the layout of the store or the content of the steady state changes
+STORE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SteadyStates')
+
+
+def _Encode(obj, arrays):
+    '''
+    Returns a json-serialisable description of obj; arrays are appended to
+    the list arrays and referred to by their position.
+    '''
+    def array(a):
+        arrays.append(np.ascontiguousarray(np.asarray(a)))
+        return {'type': 'array', 'index': len(arrays)-1, 'matrix': isinstance(a, np.matrix)}
+
+    if isinstance(obj, RegularGridCopula):
+        return {'type': 'RegularGridCopula',
+                'axes': [array(ax) for ax in obj.axes], 'values': array(obj.values)}
+    if isinstance(obj, SplineCopula) or (hasattr(obj, 'tck') and hasattr(obj, 'z')):
+        # one-asset copula; scipy interp2d objects of older steady states are stored as the same spline
+        obj = AsSplineCopula(obj)
+        return {'type': 'SplineCopula', 'x': array(obj.x), 'y': array(obj.y),
+                'values': array(obj.values), 'degree': obj.degree}
+    if isinstance(obj, dict):
+        for key in obj:
+            if not isinstance(key, str):
+                raise TypeError('Only string keys can be stored, got ' + repr(key))
+        return {'type': 'dict', 'items': {key: _Encode(obj[key], arrays) for key in sorted(obj)}}
+    if isinstance(obj, (list, tuple)):
+        return {'type': type(obj).__name__, 'items': [_Encode(item, arrays) for item in obj]}
+    if isinstance(obj, np.ndarray):
+        return array(obj)
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if obj is None or isinstance(obj, (bool, int, float, complex, str)):
+        if isinstance(obj, complex):
+            return {'type': 'complex', 'value': [obj.real, obj.imag]}
+        return {'type': 'value', 'value': obj}
+
+    raise TypeError('Cannot store object of type ' + type(obj).__name__)
+
+
+def _Decode(node, arrays):
+    '''
+    Inverse of _Encode; arrays is a function returning the array number i.
+    '''
+    kind = node['type']
+    if kind == 'array':
+        a = arrays(node['index'])
+        return np.asmatrix(a) if node['matrix'] else a
+    if kind == 'dict':
+        return {key: _Decode(item, arrays) for key, item in node['items'].items()}
+    if kind in ('list', 'tuple'):
+        items = [_Decode(item, arrays) for item in node['items']]
+        return items if kind == 'list' else tuple(items)
+    if kind == 'value':
+        return node['value']
+    if kind == 'complex':
+        return complex(*node['value'])
+    if kind == 'RegularGridCopula':
+        return RegularGridCopula([_Decode(ax, arrays) for ax in node['axes']], _Decode(node['values'], arrays))
+    if kind == 'SplineCopula':
+        return SplineCopula(_Decode(node['x'], arrays), _Decode(node['y'], arrays),
+                            _Decode(node['values'], arrays), degree=node['degree'])
+    if kind == 'interp2d':
+        # entries written before the copula was stored as a SplineCopula;
+        # z holds the values of shape (len(x), len(y)) raveled
+        x, y = _Decode(node['x'], arrays), _Decode(node['y'], arrays)
+        degree = {'linear': 1, 'cubic': 3, 'quintic': 5}[node['kind']]
+        return SplineCopula(x, y, np.reshape(_Decode(node['z'], arrays), (len(x), len(y))), degree=degree)
+
+    raise ValueError('Unknown entry in steady-state store: ' + kind)
+
+
+def InputsKey(inputs):
+    '''
+    Hash of a (nested) dict of model inputs: parameters, arrays and copulas.
+
+    Parameters
+    ----------
+    inputs : dict
+        e.g. {'par': par, 'mpar': mpar, 'grid': grid}
+
+    Returns
+    -------
+    key : str
+        sha1 hex digest, equal for equal inputs
+    '''
+    arrays = []
+    structure = _Encode(inputs, arrays)
+
+    sha = hashlib.sha1()
+    sha.update(json.dumps(structure, sort_keys=True).encode('utf-8'))
+    for a in arrays:
+        sha.update(str((a.dtype.str, a.shape)).encode('utf-8'))
+        sha.update(a.tobytes())
+
+    return sha.hexdigest()
+
+
+def SteadyStateKey(Model, par, mpar, grid):
+    '''
+    Hash of the inputs of a steady state: model class, par, mpar and grid.
+
+    Parameters
+    ----------
+    Model : class
+        e.g. SteadyStateOneAssetIOU or SteadyStateTwoAsset
+    par, mpar, grid : dict
+        parameters as passed to Model(par, mpar, grid)
+
+    Returns
+    -------
+    key : str
+        sha1 hex digest, equal for equal inputs
+    '''
+    return InputsKey({'model': Model.__module__ + '.' + Model.__name__,
+                      'par': par, 'mpar': mpar, 'grid': grid})
+
+
+def SaveSteadyState(SS, path, key=None):
+    '''
+    Saves the steady state dict SS to the directory path (replaced if it exists).
+
+    Parameters
+    ----------
+    SS : dict
+        result of SolveSteadyState
+    path : str
+        directory of the stored steady state
+    key : str
+        input hash stored with the steady state, see SteadyStateKey
+    '''
+    arrays = []
+    index = {'version': STORE_VERSION, 'key': key, 'content': _Encode(SS, arrays)}
+
+    # write to a temporary directory first, so that an interrupted save
+    # does not leave a store that looks complete
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    for ii, a in enumerate(arrays):
+        np.save(os.path.join(tmp_path, 'array%d.npy' % ii), a, allow_pickle=False)
+    with open(os.path.join(tmp_path, 'index.json'), 'w') as f:
+        json.dump(index, f, sort_keys=True)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def LoadSteadyState(path, mmap_mode='c'):
+    '''
+    Loads a steady state saved by SaveSteadyState.
+
+    Parameters
+    ----------
+    path : str
+        directory of the stored steady state
+    mmap_mode : str or None
+        passed to np.load; 'c' memory-maps the arrays copy-on-write, so that
+        they can be modified in memory without changing the store, None
+        reads them into memory
+
+    Returns
+    -------
+    SS : dict
+        steady state as returned by SolveSteadyState
+    '''
+    with open(os.path.join(path, 'index.json')) as f:
+        index = json.load(f)
+    if index['version'] != STORE_VERSION:
+        raise ValueError('Steady state in ' + path + ' has store version ' + str(index['version']) +
+                         ', expected ' + str(STORE_VERSION))
+
+    def arrays(ii):
+        return np.load(os.path.join(path, 'array%d.npy' % ii), mmap_mode=mmap_mode, allow_pickle=False)
+
+    return _Decode(index['content'], arrays)
+
+
+def CachedSteadyState(Model, par, mpar, grid, cache_dir=None, recompute=False, mmap_mode='c', seed=None):
+    '''
+    Returns the steady state of Model(par, mpar, grid), from the store if it
+    was computed before with the same inputs, otherwise it is solved (or read
+    from seed) and saved.
+
+    Parameters
+    ----------
+    Model : class
+        steady-state class with a method SolveSteadyState, e.g. SteadyStateTwoAsset
+    par, mpar, grid : dict
+        parameters of the model
+    cache_dir : str
+        folder of the store, Assets/SteadyStates if None
+    recompute : bool
+        solve and overwrite the stored steady state even if inputs match
+    mmap_mode : str or None
+        see LoadSteadyState
+    seed : str
+        pickle of the steady state of these inputs, e.g. the shipped
+        Assets/One/EX1SS.p; saved to the store instead of solving the model
+        when the store does not hold it yet. Ignored if recompute is True.
+
+    Returns
+    -------
+    SS : dict
+        steady state as returned by SolveSteadyState
+    '''
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+
+    key = SteadyStateKey(Model, par, mpar, grid)
+    path = os.path.join(cache_dir, Model.__name__ + '_' + key[:16])
+
+    if not recompute and os.path.isfile(os.path.join(path, 'index.json')):
+        with open(os.path.join(path, 'index.json')) as f:
+            index = json.load(f)
+        if index['version'] == STORE_VERSION and index['key'] == key:
+            print('Loading steady state from ' + path)
+            return LoadSteadyState(path, mmap_mode)
+        print('Stored steady state in ' + path + ' is outdated, recomputing')
+
+    if seed is not None and not recompute:
+        # the pickle is not checked against the inputs, the caller vouches for it
+        print('Seeding the store from ' + seed)
+        with open(seed, 'rb') as f:
+            SS = pickle.load(f)
+    else:
+        # SolveSteadyState changes par and grid in place, the key refers to the inputs
+        SS = Model(deepcopy(par), deepcopy(mpar), deepcopy(grid)).SolveSteadyState()
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    SaveSteadyState(SS, path, key)
+    print('Saved steady state to ' + path)
+
+    # a seeded steady state is read back, so that its copula is the stored SplineCopula
+    if mmap_mode is None and (seed is None or recompute):
+        return SS
+    return LoadSteadyState(path, mmap_mode)
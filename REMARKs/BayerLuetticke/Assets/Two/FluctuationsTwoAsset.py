@@ -4,8 +4,6 @@
 State Reduction, SGU_solver, Plot
 '''
 from __future__ import print_function
-import sys 
-sys.path.insert(0,'../')
 
 import numpy as np
 from numpy.linalg import matrix_rank
@@ -20,7 +18,12 @@ from scipy import sparse as sp
 from scipy import linalg
 from math import log, cos, pi, sqrt
 import time
-from SharedFunc3 import Transition, ExTransitions, GenWeight, MakeGridkm, Tauchen, Fastroot
+from ..LinearRE import SolveLinearRE
+from ..ParallelJacobian import FsysJacobian, JacobianCheckpoint
+from ..SteadyStateStore import InputsKey
+from ..StateSpace import ImpulseResponses
+from ..ReducedBasis import DCTCoefficients, SelectCoefficients, DCTBasis
+from ..SharedKernels import CopulaInterpolator, LotteryPushForward, BatchInterp1d, MarginalPerturbation, Transition, ExTransitions, GenWeight, MakeGridkm, Tauchen, Fastroot, MergeResourceLists
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
 import scipy.io
@@ -40,7 +43,7 @@ class FluctuationsTwoAsset:
         self.Vm = Vm
         self.Vk = Vk
         self.joint_distr = joint_distr
-        self.Copula = Copula
+        self.Copula = CopulaInterpolator(Copula, (mpar['nm'],mpar['nk'],mpar['nh']))
         self.mutil_c = mutil_c
         self.P_H = P_H
         
@@ -64,23 +67,11 @@ class FluctuationsTwoAsset:
         
         # Mapping for Histogram
 
-        Gamma_state = np.zeros((self.mpar['nm']+self.mpar['nk']+self.mpar['nh'], self.mpar['nm']+self.mpar['nk']+self.mpar['nh'] - 4))
-        for j in range(self.mpar['nm']-1):
-            Gamma_state[0:self.mpar['nm'],j] = -np.squeeze(Xss[0:self.mpar['nm']])
-            Gamma_state[j,j]=1. - Xss[j]
-            Gamma_state[j,j]=Gamma_state[j,j] - np.sum(Gamma_state[0:self.mpar['nm'],j])
-        bb = self.mpar['nm']
-
-        for j in range(self.mpar['nk']-1):
-            Gamma_state[bb+np.arange(0,self.mpar['nk'],1), bb+j-1] = -np.squeeze(Xss[bb+np.arange(0,self.mpar['nk'],1)])
-            Gamma_state[bb+j,bb-1+j] = 1. - Xss[bb+j]
-            Gamma_state[bb+j,bb-1+j] = Gamma_state[bb+j,bb-1+j] - np.sum(Gamma_state[bb+np.arange(0,self.mpar['nk']),bb-1+j])
-        bb = self.mpar['nm'] + self.mpar['nk']
-
-        for j in range(self.mpar['nh']-2):
-            Gamma_state[bb+np.arange(0,self.mpar['nh']-1,1), bb+j-2] = -np.squeeze(Xss[bb+np.arange(0,self.mpar['nh']-1,1)])
-            Gamma_state[bb+j,bb-2+j] = 1. - Xss[bb+j]
-            Gamma_state[bb+j,bb-2+j] = Gamma_state[bb+j,bb-2+j] - np.sum(Gamma_state[bb+np.arange(0,self.mpar['nh']-1,1),bb-2+j])
+        # perturbations of the liquid, illiquid and productivity marginals that keep
+        # their mass (the entrepreneur state, last point of h, is not perturbed)
+        Gamma_state = MarginalPerturbation(Xss, [(0, self.mpar['nm']), (self.mpar['nm'], self.mpar['nk']),
+                                                 (self.mpar['nm']+self.mpar['nk'], self.mpar['nh']-1)],
+                                           self.mpar['nm']+self.mpar['nk']+self.mpar['nh'])
 
 
         self.mpar['os'] = len(Xss) - (self.mpar['nm']+self.mpar['nk']+self.mpar['nh'])
@@ -93,7 +84,7 @@ class FluctuationsTwoAsset:
                
         indexVKdct = self.do_dct(invmutil(self.Vk.copy()),self.mpar,accuracy)
                 
-        aux = np.shape(Gamma_state)
+        aux = Gamma_state.shape
         self.mpar['numstates'] = np.int64(aux[1] + self.mpar['os'])
         self.mpar['numcontrols'] = np.int64(len(indexMUdct) + len(indexVKdct) + self.mpar['oc'])
         
@@ -109,25 +100,13 @@ class FluctuationsTwoAsset:
                 'State':State, 'State_m':State_m, 'Contr':Contr, 'Contr_m':Contr_m}
 
     def do_dct(self, obj, mpar, level):
-
-        obj = np.reshape(obj.copy(),(mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-        X1 = sf.dct(obj,norm='ortho',axis=0)
-        X2 = sf.dct(X1.copy(),norm='ortho',axis=1)
-        X3 = sf.dct(X2.copy(),norm='ortho',axis=2)
-
-        
-        XX = X3.flatten(order='F')
-        ind = np.argsort(abs(XX.copy()))[::-1]
-        i = 1   
-        while linalg.norm(XX[ind[:i]].copy())/linalg.norm(XX) < level:
-              i += 1    
+        '''
+        Retained DCT coefficients of obj, see ReducedBasis.SelectCoefficients;
+        level may also be a list of accuracy levels.
+        '''
+        XX = DCTCoefficients(obj, (mpar['nm'],mpar['nk'],mpar['nh']))
         
-        needed = i
-        
-        index_reduced = np.sort(ind[:i])
-        
-        
-        return index_reduced
+        return SelectCoefficients(XX, level)
    
 
         
@@ -150,7 +129,7 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
         Vector of state variables t (only coefficients of sparse polynomial)
     StateSS and ControlSS: matrix or ndarray
         Value of the state and control variables in steady state. For the Value functions these are at full grids.
-    Gamma_state: coo_matrix
+    Gamma_state: MarginalPerturbation
         Mapping such that perturbationof marginals are still distributions (sum to 1).
     Gamma_control: ndarray
         Values of the polynomial base at all nodes to map sparse coefficient changes to full grid
@@ -162,8 +141,8 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
         Liquid, illiquid and productivity grid
     Targets: dict
         Stores targets for government policy
-   Copula : dict
-        points for interpolation of joint distribution
+   Copula : RegularGridCopula
+        copula of the joint distribution on the grid of marginal CDFs
     P: ndarray
         steady state transition matrix
     aggrshock: str 
@@ -226,8 +205,8 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     
     ## State variables
     # read out marginal histogram in t+1, t
-    Distribution = StateSS[:-2].copy() + Gamma_state.copy().dot(State[:NxNx].copy())
-    Distributionminus = StateSS[:-2].copy() + Gamma_state.copy().dot(Stateminus[:NxNx].copy())
+    Distribution = StateSS[:-2].copy() + Gamma_state.dot(State[:NxNx].copy())
+    Distributionminus = StateSS[:-2].copy() + Gamma_state.dot(Stateminus[:NxNx].copy())
 
     # Aggregate Endogenous States
     RB = StateSS[-2] + State[-2]
@@ -240,29 +219,16 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     ## Split the control vector into items with names
     # Controls
 
-    XX = np.zeros((NN,1))
-    XX[indexMUdct] = Control[mutil_cind]
-    
-    aux = np.reshape(XX,(mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    aux = sf.idct(aux.copy(),norm='ortho',axis=0)
-    aux = sf.idct(aux.copy(),norm='ortho',axis=1)
-    aux = sf.idct(aux.copy(),norm='ortho',axis=2)
+    # retained DCT basis functions on the grid, built once per process
+    BasisMU = DCTBasis(indexMUdct, (mpar['nm'],mpar['nk'],mpar['nh']))
+    BasisVK = DCTBasis(indexVKdct, (mpar['nm'],mpar['nk'],mpar['nh']))
     
-    mutil_c_dev = aux.copy()
+    mutil_c_dev = BasisMU.dot(np.asarray(Control[mutil_cind]).ravel())
     
-    mutil_c = mutil(mutil_c_dev.copy().flatten(order='F') + np.squeeze(np.asarray(ControlSS[np.array(range(NN))])))
+    mutil_c = mutil(mutil_c_dev + np.squeeze(np.asarray(ControlSS[np.array(range(NN))])))
     
-    XX = np.zeros((NN,1))
-    XX[indexVKdct] = Control[Vkind]
-    
-    aux = np.reshape(XX,(mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    aux = sf.idct(aux.copy(),norm='ortho',axis=0)
-    aux = sf.idct(aux.copy(),norm='ortho',axis=1)
-    aux = sf.idct(aux.copy(),norm='ortho',axis=2)
-    
-
-    Vk_dev = aux.copy()
-    Vk = mutil(Vk_dev.copy().flatten(order='F')+np.squeeze(np.asarray(ControlSS[np.array(range(NN))+NN])))
+    Vk_dev = BasisVK.dot(np.asarray(Control[Vkind]).ravel())
+    Vk = mutil(Vk_dev + np.squeeze(np.asarray(ControlSS[np.array(range(NN))+NN])))
     
     
     # Aggregate Controls (t+1)
@@ -346,11 +312,8 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     cumdist = np.zeros((mpar['nm']+1,mpar['nk']+1,mpar['nh']+1))
     cm,ck,ch = np.meshgrid(np.asarray(np.cumsum(marginal_mminus)), np.asarray(np.cumsum(marginal_kminus)), np.asarray(np.cumsum(marginal_hminus)), indexing = 'ij')
     
-    # griddata does not support extrapolation for 3D
-    #cumdist[1:,1:,1:] = np.reshape(Copula((cm.flatten(order='F').copy(),ck.flatten(order='F').copy(),ch.flatten(order='F').copy())),(mpar['nm'],mpar['nk'],mpar['nh']), order='F')
-    Copula_aux = griddata(Copula['grid'],Copula['value'],(cm.flatten(order='F').copy(),ck.flatten(order='F').copy(),ch.flatten(order='F').copy()))
-    Copula_bounds = griddata(Copula['grid'],Copula['value'],(cm.flatten(order='F').copy(),ck.flatten(order='F').copy(),ch.flatten(order='F').copy()),method='nearest')
-    Copula_aux[np.isnan(Copula_aux.copy())] = Copula_bounds[np.isnan(Copula_aux.copy())].copy()
+    Copula = CopulaInterpolator(Copula, (mpar['nm'],mpar['nk'],mpar['nh']))
+    Copula_aux = Copula((cm.flatten(order='F'),ck.flatten(order='F'),ch.flatten(order='F')))
     
     cumdist[1:,1:,1:] = np.reshape(Copula_aux,(mpar['nm'],mpar['nk'],mpar['nh']), order='F')
     JDminus = np.diff(np.diff(np.diff(cumdist,axis=0),axis=1),axis=2)
@@ -405,15 +368,9 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     mutil_c_a = mutil(c_a_star.copy())
     mutil_c_aux = par['nu']*mutil_c_a + (1-par['nu'])*mutil_c_n
     aux = invmutil(mutil_c_aux.copy().flatten(order='F'))-np.squeeze(np.asarray(ControlSS[np.array(range(NN))]))
-    aux = np.reshape(aux,(mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    aux = sf.dct(aux.copy(),norm='ortho',axis=0)
-    aux = sf.dct(aux.copy(),norm='ortho',axis=1)
-    aux = sf.dct(aux.copy(),norm='ortho',axis=2)
-
-    
-    DC = np.asmatrix(aux.copy().flatten(order='F')).T
     
-    RHS[nx+mutil_cind] = DC[indexMUdct]
+    # projection on the retained coefficients
+    RHS[nx+mutil_cind] = BasisMU.T.dot(aux)[:,np.newaxis]
     
     
     ## Update Marginal Value of capital
@@ -428,26 +385,11 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     Vk_aux = par['nu']*(Rminus.item()+Qminus.item())*mutil_c_a + (1-par['nu'])*Rminus.item()*mutil_c_n +par['beta']*(1-par['nu'])*np.reshape(Vk_next,(mpar['nm'],mpar['nk'],mpar['nh']),order='F')
     
     aux = invmutil(Vk_aux.copy().flatten(order='F')) - np.squeeze(np.asarray(ControlSS[np.array(range(NN))+NN]))
-    aux = np.reshape(aux.copy(),(mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    aux = sf.dct(aux.copy(),norm='ortho',axis=0)
-    aux = sf.dct(aux.copy(),norm='ortho',axis=1)
-    aux = sf.dct(aux.copy(),norm='ortho',axis=2)    
-    
-    
-    DC = np.asmatrix(aux.copy().flatten(order='F')).T
         
-    RHS[nx+Vkind] = DC[indexVKdct]
+    RHS[nx+Vkind] = BasisVK.T.dot(aux)[:,np.newaxis]
     
     ## Differences for distriutions
     # find next smallest on-grid value for money choices
-    weight11 = np.empty((mpar['nm']*mpar['nk'],mpar['nh'],mpar['nh']))
-    weight12 = np.empty((mpar['nm']*mpar['nk'],mpar['nh'],mpar['nh']))
-    weight21 = np.empty((mpar['nm']*mpar['nk'],mpar['nh'],mpar['nh']))
-    weight22 = np.empty((mpar['nm']*mpar['nk'],mpar['nh'],mpar['nh']))
-    
-    weightn1 = np.empty((mpar['nm']*mpar['nk'],mpar['nh'],mpar['nh']))
-    weightn2 = np.empty((mpar['nm']*mpar['nk'],mpar['nh'],mpar['nh']))
-    
     ra_genweight = GenWeight(m_a_star,grid['m'])
     Dist_m_a = ra_genweight['weight'].copy()
     idm_a = ra_genweight['index'].copy()
@@ -460,82 +402,17 @@ def Fsys(State, Stateminus, Control_sparse, Controlminus_sparse, StateSS, Contro
     Dist_k = rk_genweight['weight'].copy()
     idk_a = rk_genweight['index'].copy()
     
-    idk_n = np.reshape(np.tile(np.outer(np.ones((mpar['nm'])),np.array(range(mpar['nk']))),(1,1,mpar['nh'])),(mpar['nm'],mpar['nk'],mpar['nh']),order = 'F')
-        
-    # Transition matrix for adjustment case
-    idm_a = np.tile(np.asmatrix(idm_a.copy().flatten('F')).T,(1,mpar['nh']))
-    idk_a = np.tile(np.asmatrix(idk_a.copy().flatten('F')).T,(1,mpar['nh']))
-    idh = np.kron(np.array(range(mpar['nh'])),np.ones((1,mpar['nm']*mpar['nk']*mpar['nh'])))
-    
-    idm_a = idm_a.copy().astype(int)
-    idk_a = idk_a.copy().astype(int)
-    idh = idh.copy().astype(int)
-    
-    index11 = np.ravel_multi_index([idm_a.flatten(order='F'),idk_a.flatten(order='F'),idh.flatten(order='F')],
-                                       (mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    index12 = np.ravel_multi_index([idm_a.flatten(order='F'),idk_a.flatten(order='F')+1,idh.flatten(order='F')],
-                                       (mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    index21 = np.ravel_multi_index([idm_a.flatten(order='F')+1,idk_a.flatten(order='F'),idh.flatten(order='F')],
-                                       (mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    index22 = np.ravel_multi_index([idm_a.flatten(order='F')+1,idk_a.flatten(order='F')+1,idh.flatten(order='F')],
-                                       (mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    # for no-adjustment case
-    idm_n = np.tile(np.asmatrix(idm_n.copy().flatten('F')).T,(1,mpar['nh']))
-    idk_n = np.tile(np.asmatrix(idk_n.copy().flatten('F')).T,(1,mpar['nh']))
-        
-    idm_n = idm_n.copy().astype(int)
-    idk_n = idk_n.copy().astype(int)
-    
-    indexn1 = np.ravel_multi_index([idm_n.flatten(order='F'),idk_n.flatten(order='F'),idh.flatten(order='F')],
-                                       (mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    indexn2 = np.ravel_multi_index([idm_n.flatten(order='F')+1,idk_n.flatten(order='F'),idh.flatten(order='F')],
-                                       (mpar['nm'],mpar['nk'],mpar['nh']),order='F')
-    
-    for hh in range(mpar['nh']):
-        
-        # corresponding weights
-        weight11_aux = (1-Dist_m_a[:,:,hh].copy())*(1-Dist_k[:,:,hh].copy())
-        weight12_aux = (1-Dist_m_a[:,:,hh].copy())*(Dist_k[:,:,hh].copy())  
-        weight21_aux = Dist_m_a[:,:,hh].copy()*(1-Dist_k[:,:,hh].copy())
-        weight22_aux = Dist_m_a[:,:,hh].copy()*(Dist_k[:,:,hh].copy())
-        
-        weightn1_aux = (1-Dist_m_n[:,:,hh].copy())
-        weightn2_aux = (Dist_m_n[:,:,hh].copy())
-        
-        # dimensions (m*k,h',h)
-        weight11[:,:,hh] = np.outer(weight11_aux.flatten(order='F').copy(),P[hh,:].copy())
-        weight12[:,:,hh] = np.outer(weight12_aux.flatten(order='F').copy(),P[hh,:].copy())
-        weight21[:,:,hh] = np.outer(weight21_aux.flatten(order='F').copy(),P[hh,:].copy())
-        weight22[:,:,hh] = np.outer(weight22_aux.flatten(order='F').copy(),P[hh,:].copy())
-        
-        weightn1[:,:,hh] = np.outer(weightn1_aux.flatten(order='F').copy(),P[hh,:].copy())
-        weightn2[:,:,hh] = np.outer(weightn2_aux.flatten(order='F').copy(),P[hh,:].copy())
-        
-    weight11= np.ndarray.transpose(weight11.copy(),(0,2,1))       
-    weight12= np.ndarray.transpose(weight12.copy(),(0,2,1))       
-    weight21= np.ndarray.transpose(weight21.copy(),(0,2,1))       
-    weight22= np.ndarray.transpose(weight22.copy(),(0,2,1))       
+    idk_n = np.tile(np.arange(mpar['nk'])[np.newaxis,:,np.newaxis],(mpar['nm'],1,mpar['nh']))
     
-    rowindex = np.tile(range(mpar['nm']*mpar['nk']*mpar['nh']),(1,4*mpar['nh']))
+    # flat (m,k) index of the lottery outcomes, adjustment and no-adjustment case
+    index11 = idm_a + mpar['nm']*idk_a
+    indexn1 = idm_n + mpar['nm']*idk_n
     
-    H_a = sp.coo_matrix((np.hstack((weight11.flatten(order='F'),weight21.flatten(order='F'),weight12.flatten(order='F'),weight22.flatten(order='F'))), 
-                   (np.squeeze(rowindex), np.hstack((np.squeeze(np.asarray(index11)),np.squeeze(np.asarray(index21)),np.squeeze(np.asarray(index12)),np.squeeze(np.asarray(index22)))) )), 
-                    shape=(mpar['nm']*mpar['nk']*mpar['nh'],mpar['nm']*mpar['nk']*mpar['nh']) )
-
-    weightn1= np.ndarray.transpose(weightn1.copy(),(0,2,1))       
-    weightn2= np.ndarray.transpose(weightn2.copy(),(0,2,1))       
-    
-    rowindex = np.tile(range(mpar['nm']*mpar['nk']*mpar['nh']),(1,2*mpar['nh']))
-    
-    H_n = sp.coo_matrix((np.hstack((weightn1.flatten(order='F'),weightn2.flatten(order='F'))), 
-                   (np.squeeze(rowindex), np.hstack((np.squeeze(np.asarray(indexn1)),np.squeeze(np.asarray(indexn2)))) )), 
-                    shape=(mpar['nm']*mpar['nk']*mpar['nh'],mpar['nm']*mpar['nk']*mpar['nh']) )
-    
-    # Joint transition matrix and transitions
-    H = par['nu']*H_a.copy() +(1-par['nu'])*H_n.copy()    
-        
-    JD_new = JDminus.flatten(order='F').copy().dot(H.todense())
-    JD_new = np.reshape(np.asarray(JD_new.copy()),(mpar['nm'],mpar['nk'],mpar['nh']),order='F')
+    JD_new = LotteryPushForward(JDminus, 
+                                [index11, index11+1, index11+mpar['nm'], index11+mpar['nm']+1, indexn1, indexn1+1],
+                                [par['nu']*(1.-Dist_m_a)*(1.-Dist_k), par['nu']*Dist_m_a*(1.-Dist_k),
+                                 par['nu']*(1.-Dist_m_a)*Dist_k, par['nu']*Dist_m_a*Dist_k,
+                                 (1.-par['nu'])*(1.-Dist_m_n), (1.-par['nu'])*Dist_m_n], P)
     
     # Next period marginal histograms
     # liquid assets
@@ -615,16 +492,8 @@ def EGM_policyupdate(EVm,EVk, Qminus, PIminus, RBminus, inc, meshes,grid,par,mpa
     if np.sum(np.abs(np.diff(np.sign(np.diff(m_star_n.copy(),axis=0)),axis=0)),axis=1).max() != 0.:
        print(' Warning: non monotone future liquid asset choice encountered ')
        
-    c_update = np.zeros((mpar['nm'],mpar['nk']*mpar['nh']))
-    m_update = np.zeros((mpar['nm'],mpar['nk']*mpar['nh']))
-    
-    for hh in range(mpar['nk']*mpar['nh']):
-         
-        Savings = interp1d(np.squeeze(np.asarray(m_star_n[:,hh].copy())), grid['m'].copy(), fill_value='extrapolate')
-        m_update[:,hh] = Savings(grid['m'].copy())
-        Consumption = interp1d(np.squeeze(np.asarray(m_star_n[:,hh].copy())), np.squeeze(np.asarray(c_n_aux[:,hh].copy())), fill_value='extrapolate')
-        c_update[:,hh] = Consumption(grid['m'].copy())
-    
+    # all (k,h) columns at once: savings m'(m,k,h) and consumption c(m,k,h)
+    m_update, c_update = BatchInterp1d(np.asarray(m_star_n), (grid['m'][:,np.newaxis], np.asarray(c_n_aux)), grid['m'])
     
     c_n_star = np.reshape(c_update,(mpar['nm'],mpar['nk'],mpar['nh']),order = 'F')
     m_n_star = np.reshape(m_update,(mpar['nm'],mpar['nk'],mpar['nh']),order = 'F')
@@ -682,72 +551,32 @@ def EGM_policyupdate(EVm,EVk, Qminus, PIminus, RBminus, inc, meshes,grid,par,mpa
     # Use consumption at k'=0 from constrained problem, when m' is on grid
     aux_c     = np.reshape(c_new[:,0,:],(mpar['nm'], mpar['nh']),order = 'F')
     aux_inc   = np.reshape(inc['labor'][0,0,:],(1, mpar['nh']),order = 'F')
-    cons_list = []
-    res_list  = []
-    mon_list  = []
-    cap_list  = []
-
-
-    for j in range(mpar['nh']):
-      # When choosing zero capital holdings, HHs might still want to choose money holdings smaller than m*(k'=0)
-       if m_star_zero[j]>grid['m'][0]:
-        # Calculate consumption policies, when HHs chooses money holdings lower than m*(k'=0) and capital holdings k'=0 and save them in cons_list
-        log_index    = grid['m'].T.copy() < m_star_zero[j]
-        # aux_c is the consumption policy under no cap. adj.
-        c_k_cons     = aux_c[log_index, j].copy()
-        cons_list.append( c_k_cons.copy() ) # Consumption at k'=0, m'<m_a*(0)
-        # Required Resources: Money choice + Consumption - labor income Resources that lead to k'=0 and m'<m*(k'=0)
-        res_list.append( grid['m'].T[log_index] + c_k_cons.copy() - aux_inc[0,j] )
-        mon_list.append( grid['m'].T[log_index])
-        cap_list.append( np.zeros((np.sum(log_index))))
-    
-
-    # Merge lists
-    c_a_aux  = np.reshape(c_a_aux.copy(),(mpar['nk'], mpar['nh']),order = 'F')
-    m_a_aux  = np.reshape(m_a_aux.copy(),(mpar['nk'], mpar['nh']),order = 'F')
-    Resource = np.reshape(Resource.copy(),(mpar['nk'], mpar['nh']),order = 'F')
-    
-    cons_list_1=[]
-    res_list_1=[]
-    mon_list_1=[]
-    cap_list_1=[]
-    
-    for j in range(mpar['nh']):
-   
-      cons_list_1.append( np.vstack((np.asmatrix(cons_list[j]).T, np.asmatrix(c_a_aux[:,j]).T)) )
-      res_list_1.append( np.vstack((np.asmatrix(res_list[j]).T, np.asmatrix(Resource[:,j]).T)) )
-      mon_list_1.append( np.vstack((np.asmatrix(mon_list[j]).T, np.asmatrix(m_a_aux[:,j]).T)) )
-      cap_list_1.append( np.vstack((np.asmatrix(cap_list[j].copy()).T, np.asmatrix(grid['k']).T)) )
+
+    # Merge policies with k'=0 and m'<m*(k'=0) with the unconstrained ones
+    merged = MergeResourceLists(grid, m_star_zero, aux_c, aux_inc, Resource, c_a_aux, m_a_aux)
+    res_list = merged['res_list']
+    
+    # Check monotonicity of resources (k'=0 part)
+    n_zero = merged['length'] - mpar['nk']
+    sign_change = np.abs(np.diff(np.sign(np.diff(res_list,axis=0)),axis=0))
+    if np.any(sign_change[np.arange(sign_change.shape[0])[:,np.newaxis] < n_zero-2] != 0.):
+       print('warning(non monotone resource list encountered)')
     
     ## EGM step 4: Interpolate back to fixed grid
-    c_a_star = np.zeros((mpar['nm']*mpar['nk'], mpar['nh']),order = 'F')
-    m_a_star = np.zeros((mpar['nm']*mpar['nk'], mpar['nh']),order = 'F')
-    k_a_star = np.zeros((mpar['nm']*mpar['nk'], mpar['nh']),order = 'F')
     Resource_grid  = np.reshape(inc['capital']+inc['money']+inc['rent'],(mpar['nm']*mpar['nk'], mpar['nh']),order = 'F')
     labor_inc_grid = np.reshape(inc['labor'],(mpar['nm']*mpar['nk'], mpar['nh']),order = 'F')
-
-    for j in range(mpar['nh']):
-      log_index=Resource_grid[:,j] < res_list[j][0]
-    
-      # when at most one constraint binds:
-      # Check monotonicity of resources
-      
-      if np.sum(np.abs(np.diff(np.sign(np.diff(res_list[j])))),axis = 0).max() != 0. :
-         print('warning(non monotone resource list encountered)')
-      cons = interp1d(np.squeeze(np.asarray(res_list_1[j].copy())), np.squeeze(np.asarray(cons_list_1[j].copy())),fill_value='extrapolate')
-      c_a_star[:,j] = cons(Resource_grid[:,j].copy())
-      mon = interp1d(np.squeeze(np.asarray(res_list_1[j].copy())), np.squeeze(np.asarray(mon_list_1[j].copy())),fill_value='extrapolate')
-      m_a_star[:,j] = mon(Resource_grid[:,j].copy())
-      cap = interp1d(np.squeeze(np.asarray(res_list_1[j].copy())), np.squeeze(np.asarray(cap_list_1[j].copy())),fill_value='extrapolate')
-      k_a_star[:,j] = cap(Resource_grid[:,j].copy())
-      # Lowest value of res_list corresponds to m_a'=0 and k_a'=0.
-    
-      # Any resources on grid smaller then res_list imply that HHs consume all resources plus income.
-      # When both constraints are binding:
-      c_a_star[log_index,j] = Resource_grid[log_index,j].copy() + labor_inc_grid[log_index,j].copy()-grid['m'][0]
-      m_a_star[log_index,j] = grid['m'][0]
-      k_a_star[log_index,j] = 0.
-
+    
+    # when at most one constraint binds, all productivity states at once
+    c_a_star, m_a_star, k_a_star = BatchInterp1d(res_list, (merged['cons_list'], merged['mon_list'], merged['cap_list']),
+                                                 Resource_grid, merged['length'])
+    
+    # Lowest value of res_list corresponds to m_a'=0 and k_a'=0.
+    # Any resources on grid smaller then res_list imply that HHs consume all resources plus income.
+    # When both constraints are binding:
+    log_index = Resource_grid < res_list[0,:]
+    c_a_star[log_index] = Resource_grid[log_index] + labor_inc_grid[log_index] - grid['m'][0]
+    m_a_star[log_index] = grid['m'][0]
+    k_a_star[log_index] = 0.
 
     c_a_star = np.reshape(c_a_star.copy(),(mpar['nm'] ,mpar['nk'], mpar['nh']),order = 'F')
     k_a_star = np.reshape(k_a_star.copy(),(mpar['nm'] ,mpar['nk'], mpar['nh']),order = 'F')
@@ -764,23 +593,16 @@ def plot_IRF(mpar,par,gx,hx,joint_distr,Gamma_state,grid,targets,Output):
     x0 = np.zeros((mpar['numstates'],1))
     x0[-1] = par['sigmaS']
         
-    MX = np.vstack((np.eye(len(x0)), gx))
-    IRF_state_sparse=[]
-    x=x0.copy()
     mpar['maxlag']=16
         
-    for t in range(0,mpar['maxlag']):
-        IRF_state_sparse.append(np.dot(MX,x))
-        x=np.dot(hx,x)
-        
-    IRF_state_sparse = np.asmatrix(np.squeeze(np.asarray(IRF_state_sparse))).T
+    IRF_state_sparse = np.asmatrix(ImpulseResponses(hx, gx, x0, mpar['maxlag'])[:, :, 0])
         
     aux = np.sum(np.sum(joint_distr,1),0)
         
     scale={}
     scale['h'] = np.tile(np.vstack((1,aux[-1])),(1,mpar['maxlag']))
         
-    IRF_distr = Gamma_state*IRF_state_sparse[:mpar['numstates']-mpar['os'],:mpar['maxlag']]
+    IRF_distr = np.asmatrix(Gamma_state.dot(np.asarray(IRF_state_sparse[:mpar['numstates']-mpar['os'],:mpar['maxlag']])))
         
     # preparation
         
@@ -949,95 +771,154 @@ def plot_IRF(mpar,par,gx,hx,joint_distr,Gamma_state,grid,targets,Output):
     f_N.show()
 
 
-def FF_1_3(range_, Xss,Yss,Gamma_state,indexMUdct,indexVKdct,par,mpar,grid,targets,Copula,P_H,aggrshock, 
-            Fb,packagesize, bl,ss, cc, out_DF1, out_DF3, out_bl):
-        
-    DF1=np.asmatrix( np.zeros((len(Fb),len(range_))) )
-    DF3=np.asmatrix( np.zeros((len(Fb),len(range_))) )
-    
-    F = lambda S, S_m, C, C_m : Fsys(S, S_m, C, C_m,
-                                         Xss,Yss,Gamma_state,indexMUdct,indexVKdct,
-                                         par,mpar,grid,targets,Copula,P_H,aggrshock)
-
-    
-    for Xct in range_:
-        X=np.zeros((mpar['numstates'],1))
-        h=par['scaleval1']
-        X[Xct]=h
-        Fx=F(ss.copy(),X,cc.copy(),cc.copy())
-        DF3[:, Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-        Fx=F(X,ss.copy(),cc.copy(),cc.copy())
-        DF1[:, Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-    if sum(range_ == mpar['numstates'] - 2) == 1:
-        Xct=mpar['numstates'] - 2
-        X=np.zeros((mpar['numstates'],1))
-        h=par['scaleval2']
-        X[Xct]=h
-        Fx=F(X,ss.copy(),cc.copy(),cc.copy())
-        DF3[:,Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-        Fx=F(X,ss.copy(),cc.copy(),cc.copy())
-        DF1[:,Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-    if sum(range_ == mpar['numstates'] - 1) == 1:
-        Xct=mpar['numstates'] - 1
-        X=np.zeros((mpar['numstates'],1))
-        h=par['scaleval2']
-        X[Xct]=h
-        Fx=F(ss.copy(),X,cc.copy(),cc.copy())
-        DF3[:,Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-        Fx=F(X,ss.copy(),cc.copy(),cc.copy())
-        DF1[:,Xct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-    
-    out_DF3.put(DF3)
-    out_DF1.put(DF1)
-    out_bl.put(bl)
-    
-
-
-def FF_2(range_, Xss,Yss,Gamma_state,indexMUdct,indexVKdct,par,mpar,grid,targets,Copula,P_H,aggrshock, 
-            Fb,packagesize, bl,ss, cc, out_DF2, out_bl2):
-        
-    DF2=np.asmatrix(np.zeros((len(Fb),len(range_))))
-    
-    F = lambda S, S_m, C, C_m : Fsys(S, S_m, C, C_m,
-                                         Xss,Yss,Gamma_state,indexMUdct,indexVKdct,
-                                         par,mpar,grid,targets,Copula,P_H,aggrshock)
+# parameters of the aggregate shock process, they only enter Fsys through S
+SHOCK_PARAMETERS = ('aggrshock', 'rhoS', 'sigmaS')
 
-    for Yct in range_:
-            Y=np.zeros((mpar['numcontrols'],1))
-            h=par['scaleval2']
-            Y[Yct]=h
-            Fx=F(ss.copy(),ss.copy(),Y,cc.copy())
-            DF2[:,Yct - bl*packagesize]=(Fx['Difference'] - Fb) / h
-    
-    out_DF2.put(DF2)
-    out_bl2.put(bl)
-    
 
-def SGU_solver(Xss,Yss,Gamma_state,indexMUdct,indexVKdct,par,mpar,grid,targets,Copula,P_H,aggrshock):
+def FsysStructure(mpar, Gamma_state, aggrshock):
+    '''
+    Structure of the Jacobians of Fsys that is known without evaluating it.
+
+    Fsys is linear in the histogram states of t+1 and in S(t+1), which only
+    enter the left-hand side, so these columns of F1 are given by Gamma_state.
+    The other columns come with the residuals they can affect: controls of
+    t+1 only enter through the policies (liquid and illiquid asset
+    histograms and DCT coefficients) and a few aggregate equations;
+    productivity marginals are not affected by policies, as the lottery
+    preserves mass per productivity. The liquid and illiquid marginals of t
+    only enter the joint distribution, whose productivity marginal they
+    leave unchanged, and bonds or capital of t; aggregate controls of t
+    other than those entering incomes and the Euler equations only enter
+    aggregate equations.
+
+    The pattern of a column is a superset of its nonzeros. All DCT columns
+    of F2 and all asset marginal columns of F3 affect the asset marginals
+    of t+1, so at least Ny + nm + nk - 2 Fsys calls remain whatever the
+    pattern.
 
-   out_DF1 = mp.Queue()
-   out_DF3 = mp.Queue()
-   out_DF2 = mp.Queue()
-   out_bl = mp.Queue()
-   out_bl2 = mp.Queue()
+    Parameters
+    ----------
+    mpar : dict
+        mpar['nm'], mpar['nk'], mpar['nh'], mpar['numstates'], mpar['numcontrols'], mpar['oc']
+    Gamma_state : MarginalPerturbation
+        mapping of the reduced histogram states to the marginals
+    aggrshock : str
+        'MP', 'TFP' or 'Uncertainty'
+
+    Returns
+    -------
+    dict with
+    F1_known_cols : np.array
+        columns of F1 known analytically
+    F1_known : np.array
+        these columns of F1
+    rows : dict
+        name ('F1'-'F4') -> dict column -> residual indices the column can
+        affect; columns not listed can affect all residuals
+    '''
+    nm, nk, nh = mpar['nm'], mpar['nk'], mpar['nh']
+    nx = mpar['numstates']
+    NxNx = nx - mpar['os']
+    Ny = mpar['numcontrols'] - mpar['oc']
+    RBind = NxNx
+    Sind = NxNx + 1
+
+    # aggregate controls, in the order of Fsys
+    AGG = {'Q': 0, 'PI': 1, 'Y': 2, 'G': 3, 'W': 4, 'R': 5, 'Profit': 6, 'N': 7, 'T': 8, 'K': 9, 'B': 10}
+    agg = lambda *names: [nx + Ny + AGG[name] for name in names]
+
+    policy_rows = np.concatenate((np.arange(nm+nk-2), nx + np.arange(Ny)))
+    empty = np.zeros(0, dtype=int)
+
+    # LHS marginals: Distribution[:nm-1], Distribution[nm:nm+nk-1] and Distribution[nm+nk:nm+nk+nh-2]
+    dist_rows = np.concatenate((np.arange(nm-1), nm + np.arange(nk-1), nm + nk + np.arange(nh-2)))
+    F1_known = np.zeros((nx + mpar['numcontrols'], NxNx + 1))
+    F1_known[:NxNx, :NxNx] = np.asarray(Gamma_state.dot(np.eye(NxNx)))[dist_rows, :]
+    F1_known[Sind, NxNx] = 1.
+
+    rows = {'F1': {RBind: np.concatenate(([RBind], policy_rows))},
+            'F2': {}, 'F3': {}, 'F4': {}}
+    for col in range(Ny):
+        rows['F2'][col] = policy_rows
+    # inflation and output of t+1 enter marginal costs, inflation also the real return,
+    # capital enters adjustment costs and bonds the fiscal rule and the government
+    # budget; the other aggregates of t+1 do not enter Fsys
+    rows['F2'][Ny + AGG['PI']] = np.concatenate((policy_rows, agg('N', 'W', 'R', 'Profit')))
+    rows['F2'][Ny + AGG['Y']] = np.array(agg('N', 'W', 'R', 'Profit'))
+    rows['F2'][Ny + AGG['K']] = np.array(agg('Profit', 'Q'))
+    rows['F2'][Ny + AGG['B']] = np.array(agg('PI', 'G'))
+    for name in ('Q', 'G', 'W', 'R', 'Profit', 'N', 'T'):
+        rows['F2'][Ny + AGG[name]] = empty
+
+    # liquid and illiquid marginals of t: the joint distribution of t and real
+    # bonds resp. capital of t
+    asset_rows = np.arange(nm+nk-2)
+    for col in range(nm-1):
+        rows['F3'][col] = np.concatenate((asset_rows, agg('B')))
+    for col in range(nm-1, nm+nk-2):
+        rows['F3'][col] = np.concatenate((asset_rows, agg('K')))
+    # RB(t) enters incomes and the policies, the Taylor rule and the fiscal rule
+    rows['F3'][RBind] = np.concatenate(([RBind], policy_rows, agg('PI', 'G')))
+    if aggrshock == 'MP':
+        # S(t) only enters the Taylor rule and its own law of motion
+        rows['F3'][Sind] = np.array([RBind, Sind])
+    elif aggrshock == 'TFP':
+        # TFP(t) enters production, marginal costs and factor prices
+        rows['F3'][Sind] = np.array([Sind] + agg('N', 'Y', 'W', 'R'))
+
+    # aggregate controls of t: their own LHS and the aggregate equations
+    # they enter; Q, PI, W, R, Profit and N also enter incomes or the
+    # Euler equations and hence the policies
+    rows['F4'][Ny + AGG['Q']] = np.concatenate((policy_rows, agg('Q')))
+    rows['F4'][Ny + AGG['PI']] = np.concatenate(([RBind], policy_rows, agg('PI', 'G', 'N', 'W', 'R', 'Profit')))
+    rows['F4'][Ny + AGG['Y']] = np.array(agg('Y', 'N', 'W', 'R', 'Profit'))
+    rows['F4'][Ny + AGG['G']] = np.array(agg('G'))
+    rows['F4'][Ny + AGG['W']] = np.concatenate((policy_rows, agg('W', 'T')))
+    rows['F4'][Ny + AGG['R']] = np.concatenate((policy_rows, agg('R')))
+    rows['F4'][Ny + AGG['Profit']] = np.concatenate((policy_rows, agg('Profit', 'T')))
+    rows['F4'][Ny + AGG['N']] = np.concatenate((policy_rows, agg('N', 'Y', 'W', 'R', 'T')))
+    rows['F4'][Ny + AGG['T']] = np.array(agg('T', 'PI', 'G'))
+    rows['F4'][Ny + AGG['K']] = np.array(agg('K', 'N', 'Y', 'W', 'R', 'Profit', 'Q'))
+    rows['F4'][Ny + AGG['B']] = np.array(agg('B', 'PI', 'G'))
+
+    return {'F1_known_cols': np.append(np.arange(NxNx), Sind), 'F1_known': F1_known, 'rows': rows}
+
+
+def SGU_solver(Xss,Yss,Gamma_state,indexMUdct,indexVKdct,par,mpar,grid,targets,Copula,P_H,aggrshock,workers=None,structured=True,derivative='forward',checkpoint=None):
+   '''
+   workers : int
+       number of processes used for the Jacobian, None uses cpu_count()/2-1
+       and 1 computes all columns in the calling process
+   structured : bool
+       use the known structure of Fsys (FsysStructure) to skip and group
+       columns of the Jacobian; False perturbs every column separately
+   derivative : str or function
+       'forward' or 'central' differences, or a Jacobian-vector product of
+       Fsys, see ParallelJacobian.FsysJacobian
+   checkpoint : str
+       folder in which the columns of the Jacobian are stored as they are
+       computed; a rerun with the same steady state, DCT coefficients and
+       step sizes loads them instead, also when only the shock process
+       (aggrshock, rhoS, sigmaS) differs, which only enters the column of
+       S(t). The folder must be cleared when Fsys itself is changed.
+   '''
 
    State       = np.zeros((mpar['numstates'],1))
    State_m     = State.copy()
    Contr       = np.zeros((mpar['numcontrols'],1))
    Contr_m     = Contr.copy()
 
-   F = lambda S, S_m, C, C_m : Fsys(S, S_m, C, C_m,
-                                    Xss,Yss,Gamma_state,indexMUdct,indexVKdct,
-                                    par,mpar,grid,targets,Copula,P_H,aggrshock)
+   Copula = CopulaInterpolator(Copula, (mpar['nm'],mpar['nk'],mpar['nh']))
+
+   FsysArgs = (Xss,Yss,Gamma_state,indexMUdct,indexVKdct,
+               par,mpar,grid,targets,Copula,P_H,aggrshock)
 
    start_time = time.perf_counter() 
-   result_F = F(State,State_m,Contr.copy(),Contr_m.copy())
+   result_F = Fsys(State,State_m,Contr.copy(),Contr_m.copy(),*FsysArgs)
    end_time   = time.perf_counter()
    print('Elapsed time is ', (end_time-start_time), ' seconds.')
    Fb=result_F['Difference'].copy()
 
-   pool=cpu_count()/2
-
    F1=np.zeros((mpar['numstates'] + mpar['numcontrols'], mpar['numstates']))
    F2=np.zeros((mpar['numstates'] + mpar['numcontrols'], mpar['numcontrols']))
    F3=np.zeros((mpar['numstates'] + mpar['numcontrols'], mpar['numstates']))
@@ -1047,159 +928,55 @@ def SGU_solver(Xss,Yss,Gamma_state,indexMUdct,indexVKdct,par,mpar,grid,targets,C
    print(' A *E[xprime uprime] =B*[x u]')
    print(' A = (dF/dxprimek dF/duprime), B =-(dF/dx dF/du)')
 
-   #numscale=1
-   pnum=pool
-   packagesize=int(ceil(mpar['numstates'] / float(3.0*pnum)))
-   blocks=int(ceil(mpar['numstates'] / float(packagesize) ))
-
    par['scaleval1'] = 1e-5
    par['scaleval2'] = 1e-5
 
-   start_time = time.perf_counter()
-   print('Computing Jacobian F1=DF/DXprime F3 =DF/DX')
-   print('Total number of parallel blocks: ', str(blocks), '.')
-   procs1=[]
-   for bl in range(0,blocks):
-       range_= range(bl*packagesize, min(packagesize*(bl+1),mpar['numstates']))
-       cc=np.zeros((mpar['numcontrols'],1))
-       ss=np.zeros((mpar['numstates'],1))
-       p1=Process(target=FF_1_3, args=(range_, Xss,Yss,Gamma_state,indexMUdct,indexVKdct,par,mpar,
-                                          grid,targets,Copula,P_H,aggrshock,Fb,packagesize, bl,ss,cc,
-                                          out_DF1,out_DF3, out_bl))
-       procs1.append(p1)
-       p1.start()
-       print('Block number: ', str(bl))    
-
-   FF1 = []    
-   FF3 = []
-   order_bl = []
-
-   for i in range(blocks):
-       FF1.append(out_DF1.get())
-       FF3.append(out_DF3.get())
-       order_bl.append(out_bl.get())
-
-
-   print('bl order')
-   print(order_bl)
-
-   for p1 in procs1:
-       p1.join()
-
-   for i in range(0,int(ceil(mpar['numstates'] / float(packagesize)) )):
-       range_= range(i*packagesize, min(packagesize*(i+1),mpar['numstates']))
-       F1[:,range_]=FF1[order_bl.index(i)].copy()
-       F3[:,range_]=FF3[order_bl.index(i)].copy()    
-
-   end_time   = time.perf_counter()        
-   print('Elapsed time is ', (end_time-start_time), ' seconds.')
-
-   # jacobian wrt Y'
-   packagesize=int(ceil(mpar['numcontrols'] / (3.0*pnum)))
-   blocks=int(ceil(mpar['numcontrols'] / float(packagesize)))
-   print('Computing Jacobian F2 - DF/DYprime')
-   print('Total number of parallel blocks: ', str(blocks),'.')
-
-   start_time = time.perf_counter()
-
-   procs2=[]
-   for bl in range(0,blocks):
-       range_= range(bl*packagesize,min(packagesize*(bl+1),mpar['numcontrols']))
-       cc=np.zeros((mpar['numcontrols'],1))
-       ss=np.zeros((mpar['numstates'],1))
-       p2=Process(target=FF_2, args=(range_, Xss,Yss,Gamma_state,indexMUdct,indexVKdct,par,mpar,
-                                        grid,targets,Copula,P_H,aggrshock,Fb,packagesize, bl,ss,cc,
-                                        out_DF2, out_bl2))
-       procs2.append(p2)
-       p2.start()
-       print('Block number: ', str(bl))
-
-   FF=[]
-   order_bl2 = []
+   # the two aggregate states (RB and S) use scaleval2
+   state_cols  = np.arange(mpar['numstates'])
+   state_steps = np.where(state_cols >= mpar['numstates'] - 2, par['scaleval2'], par['scaleval1'])
+   contr_cols  = np.arange(mpar['numcontrols'])
+   contr_steps = np.full(mpar['numcontrols'], par['scaleval2'])
+   # only the last oc columns of F4 differ from the identity
+   oc_cols     = np.arange(mpar['numcontrols'] - mpar['oc'], mpar['numcontrols'])
+   # every column of F3 perturbs Stateminus. The former FF_1_3 perturbed
+   # State for the RB(t) column of F3, which copied the F1 column and lost
+   # the dependence on RBminus (e.g. rho_R in the Taylor rule); this changes
+   # hx and gx, see the commit that introduced FsysJacobian here.
+
+   perturb = [('F1', state_cols, state_steps), ('F3', state_cols, state_steps),
+              ('F2', contr_cols, contr_steps), ('F4', oc_cols, np.full(mpar['oc'], par['scaleval2']))]
+
+   if structured:
+      structure = FsysStructure(mpar, Gamma_state, aggrshock)
+      F1[:, structure['F1_known_cols']] = structure['F1_known']
+      perturb[0] = ('F1', np.setdiff1d(state_cols, structure['F1_known_cols']),
+                    state_steps[np.setdiff1d(state_cols, structure['F1_known_cols'])])
+      perturb = [(name, cols, steps, [structure['rows'][name].get(col) for col in cols])
+                 for name, cols, steps in perturb]
+
+   if checkpoint is not None:
+      inputs = {'Xss': Xss, 'Yss': Yss, 'indexMUdct': indexMUdct, 'indexVKdct': indexVKdct,
+                'par': dict((key, val) for key, val in par.items() if key not in SHOCK_PARAMETERS),
+                'mpar': mpar, 'grid': grid, 'targets': targets, 'Copula': Copula, 'P_H': P_H}
+      key = InputsKey(inputs)
+      inputs['par'] = par
+      inputs['aggrshock'] = aggrshock
+      Sind = mpar['numstates'] - 1
+      checkpoint = JacobianCheckpoint(checkpoint, key, {('F1', Sind): InputsKey(inputs),
+                                                        ('F3', Sind): InputsKey(inputs)})
+
+   print('Computing Jacobian F1=DF/DXprime F3 =DF/DX F2=DF/DYprime F4=DF/DY')
+   FsysJacobian(Fsys, FsysArgs, Fb, mpar['numstates'], mpar['numcontrols'], perturb,
+                {'F1': F1, 'F2': F2, 'F3': F3, 'F4': F4}, workers=workers, derivative=derivative,
+                checkpoint=checkpoint)
 
-   for i in range(blocks):
-       FF.append(out_DF2.get())
-       order_bl2.append(out_bl2.get()) 
-
-   print('bl2 order')
-   print(order_bl2)
-
-
-   for p2 in procs2:
-       p2.join()
-
-   for i in range(0,int( ceil(mpar['numcontrols'] / float(packagesize)) ) ):
-       range_=range(i*packagesize, min(packagesize*(i+1),mpar['numcontrols']))
-       F2[:,range_]=FF[order_bl2.index(i)]
-
-   end_time = time.perf_counter()
-   print('Elapsed time is ', (end_time-start_time), ' seconds.')
-
-   FF=[]
-   FF1=[]
-   FF3=[]
-   cc=np.zeros((mpar['numcontrols'],1))
-   ss=np.zeros((mpar['numstates'],1))
-
-   for Yct in range(0, mpar['oc']):
-       Y=np.zeros((mpar['numcontrols'],1))
-       h=par['scaleval2']
-       Y[-1-Yct]=h
-       Fx=F(ss.copy(),ss.copy(),cc.copy(),Y)
-       F4[:,-1 - Yct]=(Fx['Difference'] - Fb) / h
-  
    F2[mpar['nm']+mpar['nk']-3:mpar['numstates']-2,:] = 0
 
-   s,t,Q,Z=linalg.qz(np.hstack((F1,F2)), -np.hstack((F3,F4)), output='complex')
-   abst = abs(np.diag(t))*(abs(np.diag(t))!=0.)+  (abs(np.diag(t))==0.)*10**(-11)
-   #relev=np.divide(abs(np.diag(s)), abs(np.diag(t)))
-   relev=np.divide(abs(np.diag(s)), abst)    
-
-   ll=sorted(relev)
-   slt=relev >= 1
-   nk=sum(slt)
-   slt=1*slt
-
-   s_ord,t_ord,__,__,__,Z_ord=linalg.ordqz(np.hstack((F1,F2)), -np.hstack((F3,F4)), sort='ouc', output='complex')
-
-   def _sortOverridEigen(x, y):
-       out = np.empty_like(x, dtype=bool)
-       xzero = (x == 0)
-       yzero = (y == 0)
-       out[xzero & yzero] = False
-       out[~xzero & yzero] = True
-       out[~yzero] = (abs(x[~yzero]/y[~yzero]) > ll[-1 - mpar['numstates']])
-       return out
-
-   if nk > mpar['numstates']:
-      if mpar['overrideEigen']:
-         print('Warning: The Equilibrium is Locally Indeterminate, critical eigenvalue shifted to: ', str(ll[-1 - mpar['numstates']]))
-         slt=relev > ll[-1 - mpar['numstates']]
-         nk=sum(slt)
-         s_ord,t_ord,__,__,__,Z_ord=linalg.ordqz(np.hstack((F1,F2)), -np.hstack((F3,F4)), sort=_sortOverridEigen, output='complex')
-      else:
-         print('No Local Equilibrium Exists, last eigenvalue: ', str(ll[-1 - mpar['numstates']]))
-   elif nk < mpar['numstates']:
-      if mpar['overrideEigen']:
-         print('Warning: No Local Equilibrium Exists, critical eigenvalue shifted to: ', str(ll[-1 - mpar['numstates']]))
-         slt=relev > ll[-1 - mpar['numstates']]
-         nk=sum(slt)
-         s_ord,t_ord,__,__,__,Z_ord=linalg.ordqz(np.hstack((F1,F2)), -np.hstack((F3,F4)), sort=_sortOverridEigen, output='complex')
-      else:
-         print('No Local Equilibrium Exists, last eigenvalue: ', str(ll[-1 - mpar['numstates']]))
-  
-   z21=Z_ord[nk:,0:nk]
-   z11=Z_ord[0:nk,0:nk]
-   s11=s_ord[0:nk,0:nk]
-   t11=t_ord[0:nk,0:nk]
-
-   if matrix_rank(z11) < nk:
-      print ('Warning: invertibility condition violated')
-       
-   z11i  = np.dot(np.linalg.inv(z11), np.eye(nk)) # compute the solution
-   gx = np.real(np.dot(z21,z11i))
-   hx = np.real(np.dot(z11,np.dot(np.dot(np.linalg.inv(s11),t11),z11i)))
-   return{'hx': hx, 'gx': gx, 'F1': F1, 'F2': F2, 'F3': F3, 'F4': F4, 'par': par }
+   resultRE = SolveLinearRE(F1, F2, F3, F4, mpar['numstates'], mpar['overrideEigen'])
+   hx = resultRE['hx']
+   gx = resultRE['gx']
+
+   return{'hx': hx, 'gx': gx, 'F1': F1, 'F2': F2, 'F3': F3, 'F4': F4, 'par': par, 'LinearRE': resultRE }
 
 
 # Sequential implementation of SGU_solver
@@ -1405,10 +1182,12 @@ def SGU_solver(Xss,Yss,Gamma_state,indexMUdct,indexVKdct,par,mpar,grid,targets,C
 if __name__ == '__main__':
     __spec__ = None
 #    __spec__ = __spec__
-    from time import clock
-    import pickle
+    from copy import copy
+    from . import defineSSParametersTwoAsset as Params
+    from .SteadyStateTwoAsset import SteadyStateTwoAsset
+    from ..SteadyStateStore import CachedSteadyState
     
-    EX3SS=pickle.load(open("EX3SS_20.p", "rb"))
+    EX3SS = CachedSteadyState(SteadyStateTwoAsset, **copy(Params.parm_TwoAsset))
     
     start_time0 = time.perf_counter()        
     
@@ -4,17 +4,13 @@ Classes to solve the steady state of liquid and illiquid assets model
 '''
 from __future__ import print_function
 
-
-import sys 
-sys.path.insert(0,'../')
-
 import numpy as np
 import scipy as sc
 from scipy.stats import norm 
-from scipy.interpolate import interp1d, interp2d, griddata, RegularGridInterpolator
+from scipy.interpolate import interp1d, interp2d, griddata
 from scipy import sparse as sp
 import time
-from SharedFunc3 import Transition, ExTransitions, GenWeight, MakeGridkm, Tauchen, Fastroot
+from ..SharedKernels import RegularGridCopula, ErgodicDistribution, BatchInterp1d, Transition, GenWeight, MakeGridkm, Tauchen, Fastroot, MergeResourceLists
 
 
 class SteadyStateTwoAsset:
@@ -51,8 +47,8 @@ class SteadyStateTwoAsset:
             marginal value of assets m
          joint_distr : np.array
             joint distribution of m and h
-         Copula : dict
-            points for interpolation of joint distribution
+         Copula : RegularGridCopula
+            copula of the joint distribution on the grid of marginal CDFs
          c_a_star : np.array
             policy function for consumption w/ adjustment
          c_n_star : np.array
@@ -250,16 +246,8 @@ class SteadyStateTwoAsset:
  
             
    
-        Cgridm, Cgridk, Cgridh = np.meshgrid(marginal_m.copy(),marginal_k.copy(),marginal_h.copy(),indexing='ij')
-        Cpoints = np.concatenate(( [Cgridm.flatten(order='F')],[Cgridk.flatten(order='F')],[Cgridh.flatten(order='F')]),axis=0).T
-        
-        
-        #Copula_aux = griddata((marginal_m.copy(),marginal_k.copy(),marginal_h.copy()),cum_dist.copy().transpose(),(points,points,points),method ='cubic')
-        #Copula_aux = griddata(Cpoints,cum_dist.copy().flatten(order='F'),(points0,points1,points2))
-        #Copula = RegularGridInterpolator((spm,spk,sph),np.reshape(Copula_aux,(200,200,20),order='F'),bounds_error = False, fill_value = None)
-        Copula ={}
-        Copula['grid'] = Cpoints.copy()
-        Copula['value'] = cum_dist.flatten(order = 'F').copy()
+        # Copula on the tensor grid of marginal CDFs, evaluated by Fsys
+        Copula = RegularGridCopula((marginal_m, marginal_k, marginal_h), cum_dist)
 
         
        
@@ -311,6 +299,10 @@ class SteadyStateTwoAsset:
         ------------
         joint_distr : np.array
             joint distribution of m and h
+        distJD : float
+            largest change in the last iteration
+        iterations, residual, time :
+            diagnostics of the solver chosen by mpar['JDsolver']
         
         '''
         ## Initialize matirces
@@ -411,34 +403,11 @@ class SteadyStateTwoAsset:
         
         ## Joint transition matrix and transitions
         
-        distJD = 9999.
-        countJD = 1
-        joint_distr = (joint_distr.copy().flatten(order='F')).T
-        joint_distr_next = joint_distr.copy().dot(H.copy().todense())
-        joint_distr_next = joint_distr_next.copy()/joint_distr_next.copy().sum(axis=1)
-
-        distJD = np.max((np.abs(joint_distr_next.copy().flatten(order='F')-joint_distr.copy().flatten(order='F'))))
-                          
-        if distJD > 10**(-9):
-            eigen, joint_distr = sp.linalg.eigs(H.transpose(), k=1, which='LM')
-            joint_distr = joint_distr.copy().real  
-            joint_distr = joint_distr.copy().transpose()/joint_distr.copy().sum()
-
-        distJD = 9999.
-        
-        while (distJD > 10**(-14) or countJD<50) and countJD<10000:
-        
-            joint_distr_next = joint_distr.copy().dot(H.copy().todense())
-            joint_distr_next = joint_distr_next.copy()/joint_distr_next.copy().sum(axis=1)
-            
-            distJD = np.max((np.abs(joint_distr_next.copy().flatten(order='F')-joint_distr.copy().flatten(order='F'))))
-            
-            countJD += 1
-            joint_distr = joint_distr_next.copy()
-                 
-        joint_distr = np.array(joint_distr.copy())
+        resultED = ErgodicDistribution(H, mpar.get('JDsolver','eigs'), joint_distr)
+        print('Joint distribution (', mpar.get('JDsolver','eigs'), '): iterations ', resultED['iterations'],
+              ', residual ', resultED['residual'], ', elapsed time ', resultED['time'], ' seconds.')
         
-        return {'joint_distr': joint_distr, 'distJD': distJD}
+        return resultED
            
 
     def PoliciesSS(self, c_a_guess, c_n_guess, psi_guess, grid, inc, RR, RBRB, P, mpar, par, meshes):
@@ -483,10 +452,11 @@ class SteadyStateTwoAsset:
             res_list  = results_EGM_Step3['res_list']
             mon_list = results_EGM_Step3['mon_list']
             cap_list = results_EGM_Step3['cap_list']
+            length = results_EGM_Step3['length']
                                     
             
             # Step 4: Interpolate Consumption Policy
-            results_EGM_Step4 = self.EGM_Step4( cons_list,res_list, mon_list,cap_list,inc,mpar,grid ) 
+            results_EGM_Step4 = self.EGM_Step4( cons_list,res_list, mon_list,cap_list,inc,mpar,grid,length ) 
             c_a_new = results_EGM_Step4['c_a_new'].copy()
             m_a_star = results_EGM_Step4['m_a_star'].copy()
             cap_a_star = results_EGM_Step4['cap_a_star'].copy()
@@ -577,15 +547,8 @@ class SteadyStateTwoAsset:
 
         # Interpolate grid.m and c_n_aux defined on m_star_n over grid.m
         # [c_update, m_update]=egm1b_aux_mex(grid.m,m_star_n,c_n_aux);
-        c_update=np.zeros((mpar['nm'], mpar['nk']*mpar['nh']))
-        m_update=np.zeros((mpar['nm'], mpar['nk']*mpar['nh']))
-        
-        for hh in range(mpar['nk']*mpar['nh']):
-            
-            Savings=interp1d(m_star_n[:,hh].copy(),grid['m'], fill_value='extrapolate') # generate savings function a(s,a*)=a'
-            m_update[:,hh] = Savings(grid['m']) # Obtain m'(m,h) by Interpolation
-            Consumption = interp1d(m_star_n[:,hh].copy(),c_n_aux[:,hh],fill_value='extrapolate') # generate consumption function c(s,a*(s,a'))
-            c_update[:,hh] = Consumption(grid['m'])  # Obtain c(m,h) by interpolation (notice this is out of grid, used linear interpolation)
+        # all (k,h) columns at once: a(s,a*)=a' and c(s,a*(s,a')), linear extrapolation off grid
+        m_update, c_update = BatchInterp1d(m_star_n, (grid['m'][:,np.newaxis], c_n_aux), grid['m'])
 
         c_update = np.reshape(c_update,(mpar['nm'], mpar['nk'], mpar['nh']), order='F')
         m_update = np.reshape(m_update,(mpar['nm'], mpar['nk'], mpar['nh']), order='F')
@@ -680,99 +643,46 @@ class SteadyStateTwoAsset:
         # Use consumption at k'=0 from constrained problem, when m' is on grid
         aux_c = np.reshape(c_n_aux[:,0,:].copy(), (mpar['nm'], mpar['nh']), order='F')
         aux_inc = np.reshape( inc['labor'][0,0,:].copy() + inc['profits'], (1, mpar['nh']), order='F' )
-        cons_list = []
-        res_list = []
-        mon_list = []
-        cap_list = []
-
-        # j=0
-        for j in range(mpar['nh']):
-            # When choosing zero capital holdings, HHs might still want to choose money
-            # holdings smaller than m*(k'=0)
-            if m_star_zero[j] > grid['m'].T[0]:
-                # Calculate consumption policies, when HHs chooses money holdings
-                # lower than m*(k'=0) and capital holdings k'=0 and save them in cons_list
-                a = (grid['m']< m_star_zero[j]).astype(int).T
-                log_index = self.indices(a, lambda x: x==1)
-                # log_index = np.squeeze((np.cumsum(log_index.copy())-1)[:-1])
-                # aux_c is the consumption policy under no cap. adj. (fix kï¿½=0), for mï¿½<m_a*(k'=0)
-                c_k_cons=aux_c[log_index, j].T.copy()
-                cons_list.append(c_k_cons.copy()) # Consumption at k'=0, m'<m_a*(0)
-                # Required Resources: Money choice + Consumption - labor income
-                # Resources that lead to k'=0 and m'<m*(k'=0)
-               
-                res_list.append(np.squeeze(grid['m'].T[log_index]) + c_k_cons.copy() - aux_inc.T[j])
-                mon_list.append(np.squeeze(grid['m'].T[log_index]))
-                
-                #log_index = (grid['m']< m_star_zero[j]).astype(int)
-                cap_list.append(np.zeros((np.sum(a.copy()),1)))
-
-
-        # Merge lists
-        c_star = np.reshape(c_star.copy(),(mpar['nk'], mpar['nh']), order='F')
-        m_a_star = np.reshape(m_a_star.copy(),(mpar['nk'], mpar['nh']), order='F')
-        Resource = np.reshape(Resource.copy(),(mpar['nk'], mpar['nh']), order='F')
-        
-        cons_list_1=[]
-        res_list_1=[]
-        mon_list_1=[]
-        cap_list_1=[]
-        
-        for j in range(mpar['nh']):
-            if m_star_zero[j] > grid['m'].T[0]:
-               cons_list_1.append( np.vstack((np.asmatrix(cons_list[j]).T, np.asmatrix(c_star[:,j]).T)) )
-               res_list_1.append( np.vstack((np.asmatrix(res_list[j]).T, np.asmatrix(Resource[:,j]).T)) )
-               mon_list_1.append( np.vstack((np.asmatrix(mon_list[j]).T, np.asmatrix(m_a_star[:,j]).T)) )
-               cap_list_1.append( np.vstack((np.asmatrix(cap_list[j]), np.asmatrix(grid['k']).T)) )
-            else:
-                cons_list_1.append(np.asmatrix(c_star[:,j]).T)
-                res_list_1.append(np.asmatrix(Resource[:,j]).T)
-                mon_list_1.append(np.asmatrix(m_a_star[:,j]).T)
-                cap_list_1.append( np.asmatrix(grid['k'].T))
-                
-        return {'c_star': c_star, 'Resource': Resource, 'cons_list':cons_list_1, 'res_list':res_list_1, 'mon_list':mon_list_1, 'cap_list':cap_list_1}
+        # When choosing zero capital holdings, HHs might still want to choose money
+        # holdings smaller than m*(k'=0): merge these (k'=0) policies with the
+        # unconstrained ones, one column per productivity state
+        merged = MergeResourceLists(grid, m_star_zero, aux_c, aux_inc, Resource, c_star, m_a_star)
+
+        return {'c_star': c_star, 'Resource': Resource, 'cons_list':merged['cons_list'], 'res_list':merged['res_list'],
+                'mon_list':merged['mon_list'], 'cap_list':merged['cap_list'], 'length':merged['length']}
 
 
     def indices(self, a, func):
         return [i for (i, val) in enumerate(a) if func(val)] 
 
             
-    def EGM_Step4(self, cons_list, res_list, mon_list, cap_list, inc, mpar, grid ):
+    def EGM_Step4(self, cons_list, res_list, mon_list, cap_list, inc, mpar, grid, length=None ):
         # EGM_Step4 obtains consumption, money, and capital policy under adjustment.
         # The function uses the {(cons_list{j},res_list{j})} as measurement
         # points. The consumption function in (m,k) can be obtained from
         # interpolation by using the total resources available at (m,k): R(m,k)=qk+m/pi.
+        # The lists are columns of padded arrays, of which the first length[j]
+        # rows are used, so that all productivity states are interpolated at once.
         # c_a_new(m,k,h): Update for consumption policy under adjustment
         # m_a_new(m,k,h): Update for money policy under adjustment
         # k_a_new(m,k,h): Update for capital policy under adjustment
         
-        c_a_new=np.empty((mpar['nm']*mpar['nk'], mpar['nh']))
-        m_a_new=np.empty((mpar['nm']*mpar['nk'], mpar['nh']))
-        k_a_new=np.empty((mpar['nm']*mpar['nk'], mpar['nh']))
         Resource_grid=np.reshape(inc['capital']+inc['money']+inc['rent'], (mpar['nm']*mpar['nk'], mpar['nh']),order='F')
         labor_inc_grid=np.reshape(inc['labor'] + inc['profits'], (mpar['nm']*mpar['nk'], mpar['nh']), order='F')
 
-        for j in range(mpar['nh']):
-            a = (Resource_grid[:,j].copy() < res_list[j][0]).astype(int).T
-            log_index = self.indices(a, lambda x: x==1)
-            # when at most one constraint binds:
-            #     [c_a_new(:,j), m_a_new(:,j),k_a_new(:,j)] = ...
-            #         myinter1m_mex(res_list{j},Resource_grid(:,j),cons_list{j},mon_list{j},cap_list{j});
-            
-            cons = interp1d(np.squeeze(np.asarray(res_list[j].copy())), np.squeeze(np.asarray(cons_list[j].copy())), fill_value='extrapolate')
-            c_a_new[:,j] = cons(Resource_grid[:,j])
-            mon = interp1d(np.squeeze(np.asarray(res_list[j].copy())), np.squeeze(np.asarray(mon_list[j].copy())), fill_value='extrapolate')
-            m_a_new[:,j] = mon(Resource_grid[:,j])
-            cap = interp1d(np.squeeze(np.asarray(res_list[j].copy())), np.squeeze(np.asarray(cap_list[j].copy())), fill_value='extrapolate')
-            k_a_new[:,j] = cap(Resource_grid[:,j])
-    
-            # Lowest value of res_list corresponds to m_a'=0 and k_a'=0.
-            # Any resources on grid smaller then res_list imply that HHs consume all
-            # resources plus income.
-            # When both constraints are binding:
-            c_a_new[log_index,j] = Resource_grid[log_index,j].copy() + labor_inc_grid[log_index,j].copy() - grid['m'].T[0]
-            m_a_new[log_index,j] = grid['m'].T[0]
-            k_a_new[log_index,j] = 0
+        # when at most one constraint binds:
+        #     [c_a_new(:,j), m_a_new(:,j),k_a_new(:,j)] = ...
+        #         myinter1m_mex(res_list{j},Resource_grid(:,j),cons_list{j},mon_list{j},cap_list{j});
+        c_a_new, m_a_new, k_a_new = BatchInterp1d(res_list, (cons_list, mon_list, cap_list), Resource_grid, length)
+
+        # Lowest value of res_list corresponds to m_a'=0 and k_a'=0.
+        # Any resources on grid smaller then res_list imply that HHs consume all
+        # resources plus income.
+        # When both constraints are binding:
+        log_index = Resource_grid < np.asarray(res_list)[0,:]
+        c_a_new[log_index] = Resource_grid[log_index] + labor_inc_grid[log_index] - grid['m'].T[0]
+        m_a_new[log_index] = grid['m'].T[0]
+        k_a_new[log_index] = 0
 
         c_a_new = np.reshape(c_a_new.copy(),(mpar['nm'], mpar['nk'], mpar['nh']), order='F')
         k_a_new = np.reshape(k_a_new.copy(),(mpar['nm'], mpar['nk'], mpar['nh']), order='F')
@@ -1147,22 +1057,17 @@ class SteadyStateTwoAsset:
 
 if __name__ == '__main__':
     
-    import defineSSParametersTwoAsset as Params
+    from . import defineSSParametersTwoAsset as Params
     from copy import copy
     import time
-    import pickle
+    from ..SteadyStateStore import CachedSteadyState
     
     EX3param = copy(Params.parm_TwoAsset)
     
-    start_time0 = time.clock()        
-    EX3 = SteadyStateTwoAsset(**EX3param)
+    start_time0 = time.perf_counter()
     
-    EX3SS = EX3.SolveSteadyState()
+    # solved once per set of parameters, then loaded from Assets/SteadyStates
+    EX3SS = CachedSteadyState(SteadyStateTwoAsset, **EX3param)
     
-    end_time0 = time.clock()
+    end_time0 = time.perf_counter()
     print('Elapsed time is ',  (end_time0-start_time0), ' seconds.')
-    
-    pickle.dump(EX3SS, open("EX3SS_20.p", "wb"))
-    
-    
-    #EX3SS=pickle.load(open("EX3SS_ag.p", "rb"))
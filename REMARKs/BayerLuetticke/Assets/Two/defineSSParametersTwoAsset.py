@@ -75,6 +75,7 @@ grid['m_max'] = 10*grid['K']
 ## Numerical Parameters
 mpar['crit']    = 1e-10
 mpar['overrideEigen'] = 1  # Warning appears, but critical Eigenvalue shifted
+mpar['JDsolver'] = 'direct'  # Ergodic distribution: 'eigs', 'direct' or 'power' (warm start)
 
 
 
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+'''
+Checks of the distribution methods of IndShockConsumerType_extend on a
+small grid, with a given consumption function instead of a solved model.
+Skipped if HARK is not installed.
+
+Run from the Assets folder:  python -m pytest test_ConsIndShockModel_extension.py
+or as a script:              python test_ConsIndShockModel_extension.py
+'''
+from __future__ import print_function
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip('HARK')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ConsIndShockModel_extension import IndShockConsumerType_extend
+from Assets.SharedKernels import WeightedPercentiles, LorenzShares
+
+
+class KinkedConsumption(object):
+    '''
+    c(m) = min(m, 0.3 + 0.5 m): consume everything below m = 0.6, with the
+    derivative of a HARK consumption function.
+    '''
+    def __call__(self, m):
+        return np.minimum(m, 0.3 + 0.5*np.asarray(m))
+
+    def derivative(self, m):
+        return np.where(np.asarray(m) < 0.6, 1.0, 0.5)
+
+
+class Solution(object):
+    def __init__(self, cFunc):
+        self.cFunc = cFunc
+
+
+def MakeAgent(LivPrb=0.98):
+    '''
+    An agent with the attributes the distribution methods use, without
+    solving the model: a kinked consumption function, three transitory and
+    two permanent shocks, and a small uneven grid.
+    '''
+    agent = IndShockConsumerType_extend.__new__(IndShockConsumerType_extend)
+    agent.cycles = 0
+    agent.Rfree = 1.03
+    agent.LivPrb = [LivPrb]
+    agent.solution = [Solution(KinkedConsumption())]
+    TranShocks = np.array([0.7, 1.0, 1.3])
+    PermShocks = np.array([0.9, 1.1])
+    ShockProbs = np.outer([0.25, 0.5, 0.25], [0.5, 0.5]).ravel()
+    agent.IncomeDstn = [[ShockProbs, np.repeat(TranShocks, 2), np.tile(PermShocks, 3)]]
+    agent.Dist_mGrid = np.array([0.0, 0.2, 0.5, 0.9, 1.4, 2.2, 3.5, 5.0])
+    agent.Dist_pGrid = np.array([0.6, 0.8, 1.0, 1.25, 1.6])
+    return agent
+
+
+def LoopJumpToGrid(agent, m_vals, perm_vals, probs):
+    '''
+    The former JumpToGrid: a loop over the values with explicit weights.
+    '''
+    mGrid, pGrid = agent.Dist_mGrid, agent.Dist_pGrid
+    probGrid = np.zeros((len(mGrid), len(pGrid)))
+    for m, p, prob in zip(m_vals, perm_vals, probs):
+        corners = []
+        for grid, val in ((mGrid, m), (pGrid, p)):
+            if val <= grid[0]:
+                corners.append(((0, 1.0),))
+            elif val >= grid[-1]:
+                corners.append(((len(grid) - 1, 1.0),))
+            else:
+                i = np.digitize(val, grid) - 1
+                lowerWeight = (grid[i + 1] - val)/(grid[i + 1] - grid[i])
+                corners.append(((i, lowerWeight), (i + 1, 1.0 - lowerWeight)))
+        for i, mWeight in corners[0]:
+            for j, pWeight in corners[1]:
+                probGrid[i, j] += prob*mWeight*pWeight
+    return probGrid.flatten()
+
+
+def DenseTranMatrix(agent):
+    '''
+    The former CalcTransitionMatrix: one dense column per grid point.
+    '''
+    mGrid, pGrid = agent.Dist_mGrid, agent.Dist_pGrid
+    bNext = agent.Rfree*(mGrid - agent.solution[0].cFunc(mGrid))
+    ShockProbs, TranShocks, PermShocks = agent.IncomeDstn[0]
+    LivPrb = agent.LivPrb[0]
+    NewBornDist = LoopJumpToGrid(agent, TranShocks, np.ones_like(TranShocks), ShockProbs)
+    TranMatrix = np.zeros((len(mGrid)*len(pGrid), len(mGrid)*len(pGrid)))
+    for i in range(len(mGrid)):
+        for j in range(len(pGrid)):
+            mNext_ij = bNext[i]/PermShocks + TranShocks
+            pNext_ij = pGrid[j]*PermShocks
+            TranMatrix[:, i*len(pGrid) + j] = LivPrb*LoopJumpToGrid(agent, mNext_ij, pNext_ij, ShockProbs) \
+                + (1.0 - LivPrb)*NewBornDist
+    return TranMatrix
+
+
+def test_jump_to_grid():
+    agent = MakeAgent()
+    rng = np.random.RandomState(0)
+    m_vals = rng.uniform(-0.5, 6.0, 40)
+    perm_vals = rng.uniform(0.4, 2.0, 40)
+    probs = rng.rand(40)
+    assert np.allclose(agent.JumpToGrid(m_vals, perm_vals, probs), LoopJumpToGrid(agent, m_vals, perm_vals, probs),
+                       rtol=0., atol=1e-15)
+
+
+def test_transition_matrix():
+    agent = MakeAgent()
+    agent.CalcTransitionMatrix()
+    TranMatrix = agent.TranMatrix
+    assert TranMatrix.format == 'csr'
+    assert np.allclose(np.asarray(TranMatrix.sum(axis=0)).ravel(), 1.0, rtol=0., atol=1e-14)
+    assert np.allclose(TranMatrix.toarray(), DenseTranMatrix(agent), rtol=0., atol=1e-15)
+
+
+def test_newborns():
+    '''
+    Every column holds the mass 1 - LivPrb of newborns, who start with
+    their transitory income and permanent income one.
+    '''
+    agent = MakeAgent()
+    agent.CalcTransitionMatrix()
+    immortal = MakeAgent(LivPrb=1.0)
+    immortal.CalcTransitionMatrix()
+    LivPrb = agent.LivPrb[0]
+    newborns = agent.TranMatrix.toarray() - LivPrb*immortal.TranMatrix.toarray()
+
+    ShockProbs, TranShocks, PermShocks = agent.IncomeDstn[0]
+    NewBornDist = agent.JumpToGrid(TranShocks, np.ones_like(TranShocks), ShockProbs)
+    assert np.allclose(newborns, (1.0 - LivPrb)*NewBornDist[:, np.newaxis], rtol=0., atol=1e-15)
+    assert np.isclose(np.sum(NewBornDist), 1.0, rtol=0., atol=1e-15)
+    mGrid, pGrid = np.meshgrid(agent.Dist_mGrid, agent.Dist_pGrid, indexing='ij')
+    assert np.isclose(NewBornDist.dot(mGrid.ravel()), ShockProbs.dot(TranShocks), rtol=0., atol=1e-14)
+    assert np.isclose(NewBornDist.dot(pGrid.ravel()), 1.0, rtol=0., atol=1e-14)
+
+
+def test_iterate_ergodic():
+    agent = MakeAgent()
+    agent.CalcTransitionMatrix()
+    agent.CalcErgodicDist(method='direct')
+    path = agent.IterateDistribution(20)
+    assert path['distr'].shape == (20,) + agent.ergodic_distr.shape
+    assert np.allclose(path['distr'], agent.ergodic_distr[np.newaxis], rtol=0., atol=1e-14)
+    for name in ('mLvl', 'cLvl', 'aLvl'):
+        assert np.allclose(path[name], path[name][0], rtol=1e-13, atol=0.)
+
+
+def test_distribution_stats():
+    '''
+    Four points with mass (unnormalized) and wealth aLvl = 0, 0.15, 1 and
+    3.52: means, percentiles and Lorenz shares by hand.
+    '''
+    agent = MakeAgent()
+    distr = np.zeros((len(agent.Dist_mGrid), len(agent.Dist_pGrid)))
+    distr[1, 2], distr[3, 2], distr[5, 3], distr[7, 4] = 0.2, 0.8, 0.6, 0.4
+    percentiles = (0.05, 0.3, 0.6, 0.95)
+    stats = agent.CalcDistributionStats(distr, percentiles=percentiles)
+
+    mean = stats['mean']
+    assert np.isclose(mean['mLvl'], 2.805, rtol=0., atol=1e-14)
+    assert np.isclose(mean['cLvl'], 1.741, rtol=0., atol=1e-14)
+    assert np.isclose(mean['aLvl'], 1.064, rtol=0., atol=1e-14)
+    assert np.isclose(mean['pLvl'], 1.195, rtol=0., atol=1e-14)
+    assert np.allclose(stats['wealth_percentiles'], [0., 0.15, 1., 3.52], rtol=0., atol=1e-14)
+    assert np.allclose(stats['MPC_percentiles'], [0.5, 0.5, 0.5, 1.], rtol=0., atol=0.)
+    # cumulative wealth is piecewise linear in the mass 0.1, 0.5, 0.8, 1
+    lorenz = np.array([0.015, 0.045, 0.16, 0.36])/1.064
+    assert np.allclose(stats['lorenz'], lorenz, rtol=0., atol=1e-14)
+    assert np.array_equal(stats['MPC_distr']['values'], [0.5, 1.])
+    assert np.allclose(stats['MPC_distr']['weights'], [0.9, 0.1], rtol=0., atol=1e-15)
+
+    variables = agent.DistributionVariables()
+    assert np.array_equal(stats['wealth_percentiles'], WeightedPercentiles(variables['aLvl'], distr, percentiles))
+    assert np.allclose(stats['lorenz'], LorenzShares(variables['aLvl'], distr, (0.2, 0.4, 0.6, 0.8)),
+                       rtol=0., atol=1e-15)
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'passed')
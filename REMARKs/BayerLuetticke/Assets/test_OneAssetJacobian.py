@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''
+Checks of the Jacobian-vector product FsysJVP of the one-asset model
+against forward differences of Fsys at the shipped steady state EX1SS.
+
+Run from the Assets folder:  python -m pytest test_OneAssetJacobian.py
+or as a script:              python test_OneAssetJacobian.py
+'''
+from __future__ import print_function
+
+import os
+import sys
+import pickle
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Assets.ParallelJacobian import FsysJacobian
+from Assets.SharedKernels import ExTransitions, ExTransitionsDerivative
+
+EX1SS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'One', 'EX1SS.p')
+
+
+def LoadReducedModel():
+    '''
+    State reduction of the shipped steady state, None if it is missing.
+    '''
+    if not os.path.exists(EX1SS_PATH):
+        return None
+    from Assets.One.FluctuationsOneAssetIOUs import FluctuationsOneAssetIOUs
+    with open(EX1SS_PATH, 'rb') as f:
+        EX1SS = pickle.load(f)
+    return FluctuationsOneAssetIOUs(**EX1SS).StateReduc()
+
+
+def Jacobians(SR, derivative, step):
+    '''
+    F1-F4 of the one-asset Fsys, all columns, with the derivative given;
+    histogram states use the step 1e-9 of SGU_solver, RB, S and the
+    controls the step given.
+    '''
+    from Assets.One.FluctuationsOneAssetIOUs import Fsys
+    mpar = SR['mpar']
+    nx, ny = mpar['numstates'], mpar['numcontrols']
+    FsysArgs = (SR['Xss'], SR['Yss'], SR['Gamma_state'], SR['Gamma_control'], SR['InvGamma'], SR['Copula'],
+                SR['par'], mpar, SR['grid'], SR['targets'], SR['P_H'], SR['aggrshock'], SR['oc'])
+    Fb = Fsys(np.zeros((nx, 1)), np.zeros((nx, 1)), np.zeros((ny, 1)), np.zeros((ny, 1)), *FsysArgs)['Difference']
+
+    state_steps = np.where(np.arange(nx) >= nx - 2, step, 1e-9)
+    perturb = [('F1', np.arange(nx), state_steps), ('F3', np.arange(nx), state_steps),
+               ('F2', np.arange(ny), np.full(ny, step)), ('F4', np.arange(ny), np.full(ny, step))]
+    out = {'F1': np.zeros((nx+ny, nx)), 'F3': np.zeros((nx+ny, nx)),
+           'F2': np.zeros((nx+ny, ny)), 'F4': np.zeros((nx+ny, ny))}
+    return FsysJacobian(Fsys, FsysArgs, Fb, nx, ny, perturb, out, workers=1, derivative=derivative)
+
+
+def test_jvp_forward_differences():
+    '''
+    With steps small enough not to cross a kink of Fsys (a binding
+    borrowing constraint or an interpolation segment switching), forward
+    differences agree with the Jacobian-vector product up to their
+    truncation and rounding errors.
+    '''
+    SR = LoadReducedModel()
+    if SR is None:
+        return
+    from Assets.One.FluctuationsOneAssetIOUs import FsysJVP
+    forward = Jacobians(SR, 'forward', 1e-7)
+    jvp = Jacobians(SR, FsysJVP, 1e-7)
+    for name in ('F1', 'F2', 'F3', 'F4'):
+        scale = np.max(np.abs(jvp[name]))
+        assert np.max(np.abs(jvp[name] - forward[name])) <= 1e-6*scale, name
+
+
+def test_jvp_linear():
+    '''
+    The product does not depend on the step size used as direction.
+    '''
+    SR = LoadReducedModel()
+    if SR is None:
+        return
+    from Assets.One.FluctuationsOneAssetIOUs import FsysJVP
+    small = Jacobians(SR, FsysJVP, 1e-7)
+    large = Jacobians(SR, FsysJVP, 1e-2)
+    for name in ('F1', 'F2', 'F3', 'F4'):
+        assert np.allclose(small[name], large[name], rtol=1e-10, atol=1e-10*np.max(np.abs(small[name]))), name
+
+
+def test_transition_derivative():
+    if not os.path.exists(EX1SS_PATH):
+        return
+    with open(EX1SS_PATH, 'rb') as f:
+        EX1SS = pickle.load(f)
+    grid, mpar, par = EX1SS['grid'], EX1SS['mpar'], EX1SS['par']
+    h = 1e-5
+    for S in (1.0, 1.3):
+        central = (ExTransitions(S + h, grid, mpar, par)['P_H'] - ExTransitions(S - h, grid, mpar, par)['P_H'])/(2*h)
+        dP_H = ExTransitionsDerivative(S, grid, mpar, par)
+        assert np.allclose(dP_H, central, rtol=0., atol=1e-7)
+        assert np.allclose(np.sum(dP_H, axis=1), 0., rtol=0., atol=1e-15)
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'passed')
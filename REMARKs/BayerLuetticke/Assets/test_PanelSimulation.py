@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+'''
+Checks of the panel simulation: alias draws against the transition matrix,
+tabulated policies against interp1d, and the simulated histories in single
+precision and written to disk in chunks.
+
+Run from the Assets folder:  python -m pytest test_PanelSimulation.py
+or as a script:              python test_PanelSimulation.py
+'''
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+from scipy.interpolate import interp1d
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Assets.PanelSimulation import PANEL_VARS, PolicyTable, EvaluatePolicy, AliasTables, DrawAlias, \
+    SimulatePanel
+
+
+def MakeTransition(nstates=4, seed=0):
+    '''
+    A random transition matrix whose second row is deterministic.
+    '''
+    rng = np.random.RandomState(seed)
+    P = rng.rand(nstates, nstates)**2
+    P[1] = 0.
+    P[1, 2] = 1.
+    return P/np.sum(P, axis=1, keepdims=True)
+
+
+def MakePolicies(nstates=4, n=30, seed=0):
+    '''
+    Concave consumption policies on state specific, unevenly spaced nodes
+    of cash at hand, as from the EGM.
+    '''
+    rng = np.random.RandomState(seed)
+    m_nodes = np.sort(rng.uniform(-1., 10., (n, nstates)), axis=0)
+    c_nodes = 0.5 + np.sqrt(m_nodes - m_nodes[0] + 0.1)*(1. + 0.1*np.arange(nstates))
+    return m_nodes, c_nodes
+
+
+def AliasFrequencies(prob, alias):
+    '''
+    Probability of each column implied by the alias tables.
+    '''
+    nstates, n = prob.shape
+    freq = prob/n
+    for i in range(nstates):
+        np.add.at(freq[i], alias[i], (1. - prob[i])/n)
+    return freq
+
+
+def test_alias_tables():
+    P = MakeTransition()
+    prob, alias = AliasTables(P)
+    assert np.allclose(AliasFrequencies(prob, alias), P, rtol=0., atol=1e-14)
+
+
+def test_draw_alias():
+    P = MakeTransition()
+    prob, alias = AliasTables(P)
+    rng = np.random.RandomState(1)
+    ndraws = 2000000
+    for i in range(P.shape[0]):
+        states = np.full(ndraws, i, dtype=np.intp)
+        draws = DrawAlias(prob, alias, states, rng.uniform(size=ndraws))
+        freq = np.bincount(draws, minlength=P.shape[1])/float(ndraws)
+        assert np.allclose(freq, P[i], rtol=0., atol=1e-3)
+    # the deterministic row never leaves its target
+    draws = DrawAlias(prob, alias, np.ones(ndraws, dtype=np.intp), rng.uniform(size=ndraws))
+    assert np.all(draws == 2)
+
+
+def test_evaluate_policy():
+    m_nodes, c_nodes = MakePolicies()
+    table = PolicyTable(m_nodes, c_nodes)
+    rng = np.random.RandomState(2)
+    x = rng.uniform(-3., 12., 5000)
+    states = rng.randint(0, m_nodes.shape[1], 5000)
+    c = EvaluatePolicy(table, x, states)
+    for j in range(m_nodes.shape[1]):
+        expected = interp1d(m_nodes[:, j], c_nodes[:, j], fill_value='extrapolate')(x[states == j])
+        assert np.allclose(c[states == j], expected, rtol=0., atol=1e-13)
+
+    out = np.empty(5000, dtype=np.float32)
+    assert EvaluatePolicy(table, x.astype(np.float32), states, out=out) is out
+    assert np.allclose(out, c, rtol=1e-5, atol=1e-5)
+
+
+def Simulate(**kwargs):
+    m_nodes, c_nodes = MakePolicies()
+    table = PolicyTable(m_nodes, c_nodes)
+    P = MakeTransition()
+    income = np.array([0.5, 1., 1.5, 2.])
+    rng = np.random.RandomState(3)
+    b0 = rng.uniform(-0.5, 5., 1000)
+    s0 = rng.randint(0, 4, 1000)
+    return SimulatePanel(table, P, income, (1.01, 1.05), b0, s0, 25, seed=4, **kwargs)
+
+
+def test_simulate_float32():
+    double = Simulate()
+    single = Simulate(dtype=np.float32)
+    assert np.array_equal(single['incStateNow'], double['incStateNow'])
+    for name in ('cNow', 'mNow', 'bNow'):
+        assert single[name].dtype == np.float32
+        assert np.allclose(single[name], double[name], rtol=0., atol=1e-4)
+    # the recorded bonds and cash at hand follow the budget constraint
+    b = double['bNow']
+    assert np.allclose(b[1:], double['mNow'][1:] - double['cNow'][1:], rtol=0., atol=1e-12)
+    assert np.array_equal(double['bNow_final'], b[-1])
+
+
+def test_simulate_on_disk():
+    directory = tempfile.mkdtemp()
+    try:
+        memory = Simulate()
+        disk = Simulate(chunk=7, directory=directory)
+        for name in PANEL_VARS:
+            stored = np.load(os.path.join(directory, name + '.npy'))
+            assert np.array_equal(stored, memory[name])
+            assert np.array_equal(disk[name], memory[name])
+        del disk
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'passed')
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+'''
+Checks of FsysJacobian on a small analytic system: forward differences,
+central differences and a Jacobian-vector product against the exact
+Jacobian and against each other, in-process and in a pool.
+
+Run from the Assets folder:  python -m pytest test_ParallelJacobian.py
+or as a script:              python test_ParallelJacobian.py
+'''
+from __future__ import print_function
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Assets.ParallelJacobian import FsysJacobian, CompareJacobians
+
+NUMSTATES = 3
+NUMCONTROLS = 2
+STEP = 1e-5
+
+
+def AnalyticFsys(State, Stateminus, Control, Controlminus, A, B, D, const):
+    '''
+    Residual const + A x + B x^2 + D x^3 of x = (State, Stateminus, Control,
+    Controlminus), whose Jacobian at x = 0 is A.
+    '''
+    x = np.concatenate([np.ravel(State), np.ravel(Stateminus), np.ravel(Control), np.ravel(Controlminus)])
+    return {'Difference': const + A.dot(x) + B.dot(x**2) + D.dot(x**3)}
+
+
+def AnalyticJVP(State, Stateminus, Control, Controlminus, A, B, D, const):
+    '''
+    Derivative of AnalyticFsys at x = 0 along the direction given.
+    '''
+    x = np.concatenate([np.ravel(State), np.ravel(Stateminus), np.ravel(Control), np.ravel(Controlminus)])
+    return A.dot(x)
+
+
+def MakeSystem(seed=0):
+    '''
+    Coefficients with a sparsity pattern shared by A, B and D, and the
+    residuals each column can affect.
+    '''
+    rng = np.random.RandomState(seed)
+    nrows = NUMSTATES + NUMCONTROLS
+    pattern = rng.rand(nrows, 2*nrows) < 0.4
+    pattern[np.arange(2*nrows) % nrows, np.arange(2*nrows)] = True
+    pattern[:, 0] = False  # a structurally zero column
+    A, B, D = [np.where(pattern, rng.randn(nrows, 2*nrows), 0.) for ii in range(3)]
+    const = rng.randn(nrows)
+    return (A, B, D, const), pattern
+
+
+def Perturb(pattern):
+    '''
+    All columns of F1-F4 with their step sizes and residual patterns.
+    '''
+    offsets = {'F1': 0, 'F3': NUMSTATES, 'F2': 2*NUMSTATES, 'F4': 2*NUMSTATES + NUMCONTROLS}
+    counts = {'F1': NUMSTATES, 'F3': NUMSTATES, 'F2': NUMCONTROLS, 'F4': NUMCONTROLS}
+    perturb = []
+    for name in ('F1', 'F2', 'F3', 'F4'):
+        cols = np.arange(counts[name])
+        rows = [np.flatnonzero(pattern[:, offsets[name] + col]) for col in cols]
+        perturb.append((name, cols, STEP*np.ones(len(cols)), rows))
+    return perturb, offsets
+
+
+def Jacobian(FsysArgs, pattern, derivative, workers=1):
+    '''
+    F1-F4 by FsysJacobian with the derivative given, and the exact ones.
+    '''
+    nrows = NUMSTATES + NUMCONTROLS
+    perturb, offsets = Perturb(pattern)
+    out = {name: np.zeros((nrows, len(cols))) for name, cols, steps, rows in perturb}
+    Fb = AnalyticFsys(np.zeros((NUMSTATES, 1)), np.zeros((NUMSTATES, 1)), np.zeros((NUMCONTROLS, 1)),
+                      np.zeros((NUMCONTROLS, 1)), *FsysArgs)['Difference']
+    FsysJacobian(AnalyticFsys, FsysArgs, Fb, NUMSTATES, NUMCONTROLS, perturb, out,
+                 workers=workers, derivative=derivative)
+    exact = {name: FsysArgs[0][:, offsets[name]:offsets[name] + out[name].shape[1]] for name in out}
+    return out, exact
+
+
+def test_forward_central_jvp():
+    FsysArgs, pattern = MakeSystem()
+    forward, exact = Jacobian(FsysArgs, pattern, 'forward')
+    central, exact = Jacobian(FsysArgs, pattern, 'central')
+    jvp, exact = Jacobian(FsysArgs, pattern, AnalyticJVP)
+    for name in exact:
+        # forward differences are off by B h, central ones by D h^2
+        assert np.allclose(forward[name], exact[name], rtol=0., atol=1e-4)
+        assert np.allclose(central[name], exact[name], rtol=0., atol=1e-8)
+        assert np.allclose(jvp[name], exact[name], rtol=0., atol=1e-14)
+        assert np.allclose(central[name], forward[name], rtol=0., atol=1e-4)
+        assert np.allclose(jvp[name], forward[name], rtol=0., atol=1e-4)
+
+
+def test_workers():
+    FsysArgs, pattern = MakeSystem()
+    for derivative in ('forward', 'central', AnalyticJVP):
+        serial, exact = Jacobian(FsysArgs, pattern, derivative, workers=1)
+        pooled, exact = Jacobian(FsysArgs, pattern, derivative, workers=2)
+        for name in serial:
+            assert np.array_equal(serial[name], pooled[name])
+
+
+def test_compare_jacobians():
+    FsysArgs, pattern = MakeSystem()
+    forward, exact = Jacobian(FsysArgs, pattern, 'forward')
+    perturb, offsets = Perturb(pattern)
+    Fb = AnalyticFsys(np.zeros((NUMSTATES, 1)), np.zeros((NUMSTATES, 1)), np.zeros((NUMCONTROLS, 1)),
+                      np.zeros((NUMCONTROLS, 1)), *FsysArgs)['Difference']
+    report = CompareJacobians(AnalyticFsys, FsysArgs, Fb, NUMSTATES, NUMCONTROLS, forward, perturb,
+                              derivative=AnalyticJVP)
+    for name in report:
+        assert report[name]['max_abs'] == np.max(np.abs(forward[name] - exact[name]))
+        assert 0. < report[name]['max_abs'] < 1e-4
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'passed')
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+'''
+Regression checks of SharedKernels against the implementations they replace.
+
+Run from the Assets folder:  python -m pytest test_SharedKernels.py
+or as a script:              python test_SharedKernels.py
+'''
+from __future__ import print_function
+
+import os
+import sys
+
+import numpy as np
+from scipy.interpolate import griddata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Assets.SharedKernels import RegularGridCopula, CopulaInterpolator, SplineCopula, AsSplineCopula, \
+    BatchInterp1d, BatchInterp1dJVP
+
+
+def MakeCopulaAxes(shape=(6, 5, 3), seed=0):
+    '''
+    Marginal CDFs of random marginal distributions, as in the steady state.
+    '''
+    rng = np.random.RandomState(seed)
+    axes = [np.cumsum(rng.rand(n)) for n in shape]
+    return [ax/ax[-1] for ax in axes]
+
+
+def GriddataCopula(Copula, points):
+    '''
+    The former evaluation in Fsys: linear griddata, nearest value outside
+    the convex hull of the grid.
+    '''
+    points = tuple(np.ravel(q) for q in points)
+    Copula_aux = griddata(Copula['grid'], Copula['value'], points)
+    Copula_bounds = griddata(Copula['grid'], Copula['value'], points, method='nearest')
+    Copula_aux[np.isnan(Copula_aux)] = Copula_bounds[np.isnan(Copula_aux)]
+    return Copula_aux
+
+
+def test_copula_on_grid():
+    axes = MakeCopulaAxes()
+    cm, ck, ch = np.meshgrid(*axes, indexing='ij')
+    Copula = RegularGridCopula(axes, (cm*ck*ch).flatten(order='F'))
+    nodes = tuple(Copula['grid'][:, d] for d in range(3))
+    assert np.allclose(Copula(nodes), Copula['value'], rtol=0., atol=1e-14)
+    assert np.allclose(Copula(nodes), GriddataCopula(Copula, nodes), rtol=0., atol=1e-12)
+
+
+def test_copula_interior():
+    '''
+    Linear griddata interpolates on the simplices of a Delaunay
+    triangulation, the copula multilinearly on the boxes of the grid: both
+    are exact for an affine function, so they agree at any interior point.
+    A tensor product copula (independent marginals) is reproduced exactly
+    by the multilinear interpolation only.
+    '''
+    axes = MakeCopulaAxes()
+    rng = np.random.RandomState(1)
+    points = tuple(rng.uniform(ax[0], ax[-1], 500) for ax in axes)
+    cm, ck, ch = np.meshgrid(*axes, indexing='ij')
+
+    affine = RegularGridCopula(axes, (0.1 + cm + 2.*ck - ch).flatten(order='F'))
+    assert np.allclose(affine(points), GriddataCopula(affine, points), rtol=0., atol=1e-12)
+
+    product = RegularGridCopula(axes, (cm*ck*ch).flatten(order='F'))
+    exact = points[0]*points[1]*points[2]
+    assert np.allclose(product(points), exact, rtol=0., atol=1e-12)
+    assert np.max(np.abs(GriddataCopula(product, points) - exact)) >= np.max(np.abs(product(points) - exact))
+
+
+def test_copula_outside():
+    '''
+    Beyond a corner of the grid both the clamping and the nearest value fill
+    give the value at the corner.
+    '''
+    axes = MakeCopulaAxes()
+    cm, ck, ch = np.meshgrid(*axes, indexing='ij')
+    Copula = RegularGridCopula(axes, (cm*ck*ch).flatten(order='F'))
+    points = (np.array([axes[0][0] - 0.01, axes[0][-1] + 0.01]),
+              np.array([axes[1][0] - 0.01, axes[1][-1] + 0.01]),
+              np.array([axes[2][0] - 0.01, axes[2][-1] + 0.01]))
+    assert np.allclose(Copula(points), GriddataCopula(Copula, points), rtol=0., atol=1e-14)
+
+
+def test_copula_from_dict():
+    axes = MakeCopulaAxes()
+    cm, ck, ch = np.meshgrid(*axes, indexing='ij')
+    Copula = RegularGridCopula(axes, (cm*ck*ch).flatten(order='F'))
+    converted = CopulaInterpolator({'grid': Copula['grid'], 'value': Copula['value']}, Copula.shape)
+    for ax, ax_converted in zip(Copula.axes, converted.axes):
+        assert np.array_equal(ax, ax_converted)
+    assert np.array_equal(Copula.values, converted.values)
+
+
+def test_copula_steady_state():
+    '''
+    The copula of the stored two-asset steady state, evaluated at its own
+    marginal CDFs as in Fsys at the steady state.
+    '''
+    import pickle
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Two', 'EX3SS_20.p')
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as f:
+        EX3SS = pickle.load(f)
+    mpar = EX3SS['mpar']
+    shape = (mpar['nm'], mpar['nk'], mpar['nh'])
+    Copula = CopulaInterpolator(EX3SS['Copula'], shape)
+
+    joint_distr = np.reshape(np.asarray(EX3SS['joint_distr']), shape, order='F')
+    marginals = [np.cumsum(np.sum(joint_distr, axis=axis)) for axis in ((1, 2), (0, 2), (0, 1))]
+    cm, ck, ch = np.meshgrid(*marginals, indexing='ij')
+    points = (cm.flatten(order='F'), ck.flatten(order='F'), ch.flatten(order='F'))
+    assert np.allclose(Copula(points), GriddataCopula(Copula, points), rtol=0., atol=1e-12)
+
+
+def test_spline_copula_steady_state():
+    '''
+    The interp2d copulas of the shipped one-asset steady states, converted
+    to SplineCopula, give the spline of the pickled interp2d (evaluated with
+    its knots and coefficients, as interp2d can no longer be called).
+    '''
+    import pickle
+    from scipy.interpolate import bisplev
+    x = np.linspace(-0.1, 1.1, 57)
+    y = np.linspace(0., 1.05, 7)
+    for name in ('EX1SS.p', 'EX2SS.p'):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'One', name)
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            interp = pickle.load(f)['Copula']
+        Copula = AsSplineCopula(interp)
+        assert AsSplineCopula(Copula) is Copula
+        for dx, dy in ((0, 0), (1, 0), (0, 1)):
+            assert np.allclose(Copula(x, y, dx, dy), bisplev(x, y, interp.tck, dx, dy).T, rtol=0., atol=1e-14)
+
+
+def test_spline_copula_on_grid():
+    axes = MakeCopulaAxes(shape=(8, 4))
+    cm, ch = np.meshgrid(*axes, indexing='ij')
+    Copula = SplineCopula(axes[0], axes[1], cm*ch)
+    assert Copula(*axes).shape == (4, 8)
+    assert np.allclose(Copula(*axes), (cm*ch).T, rtol=0., atol=1e-14)
+
+
+def test_spline_copula_jvp():
+    '''
+    Forward differences of the clamped spline: interior queries move with
+    the slope, queries on the boundary moving outwards do not move.
+    '''
+    axes = MakeCopulaAxes(shape=(8, 4))
+    cm, ch = np.meshgrid(*axes, indexing='ij')
+    Copula = SplineCopula(axes[0], axes[1], cm*ch + 0.1*np.sin(3*cm)*ch)
+    rng = np.random.RandomState(2)
+    for dx, dy in ((rng.randn(8), rng.randn(4)), (-np.ones(8), np.ones(4)), (np.ones(8), -np.ones(4))):
+        values, derivative = Copula.JVP(axes[0], axes[1], dx, dy)
+        h = 1e-7
+        forward = (Copula(axes[0] + h*dx, axes[1] + h*dy) - values)/h
+        assert np.allclose(values, Copula(*axes), rtol=0., atol=0.)
+        assert np.allclose(derivative, forward, rtol=0., atol=1e-5)
+
+
+def test_batch_interp_jvp():
+    rng = np.random.RandomState(3)
+    x = np.sort(rng.randn(20, 5), axis=0)
+    y = (rng.randn(20, 5), x**2)
+    xq = np.linspace(-3., 3., 31)
+    dx, dy = rng.randn(20, 5), (rng.randn(20, 5), 2*x)
+    h = 1e-7
+    values, derivatives = BatchInterp1dJVP(x, y, xq, dx, dy)
+    plus = BatchInterp1d(x + h*dx, (y[0] + h*dy[0], y[1] + h*dy[1]), xq)
+    minus = BatchInterp1d(x - h*dx, (y[0] - h*dy[0], y[1] - h*dy[1]), xq)
+    for value, derivative, yy, pp, mm in zip(values, derivatives, y, plus, minus):
+        assert np.array_equal(value, BatchInterp1d(x, yy, xq))
+        assert np.allclose(derivative, (pp - mm)/(2*h), rtol=1e-6, atol=1e-6)
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'passed')
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+'''
+Round trip of steady states through SteadyStateStore.
+
+Run from the Assets folder:  python -m pytest test_SteadyStateStore.py
+or as a script:              python test_SteadyStateStore.py
+'''
+from __future__ import print_function
+
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+from copy import copy
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Assets.SharedKernels import SplineCopula
+from Assets.SteadyStateStore import CachedSteadyState
+
+
+def test_seed_from_shipped_pickle():
+    '''
+    A store without the steady state is seeded from the shipped EX1SS.p
+    instead of solving the model; its interp2d copula comes back as the
+    same spline, and the second call reads the store.
+    '''
+    import Assets.One.defineSSParameters as Params
+    from Assets.One.SteadyStateOneAssetIOUs import SteadyStateOneAssetIOU
+
+    seed = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'One', 'EX1SS.p')
+    if not os.path.exists(seed):
+        return
+    with open(seed, 'rb') as f:
+        EX1SS = pickle.load(f)
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        SS = CachedSteadyState(SteadyStateOneAssetIOU, cache_dir=cache_dir, seed=seed,
+                               **copy(Params.parm_one_asset_IOU))
+        assert len(os.listdir(cache_dir)) == 1
+        # seed is not read again once the store holds the steady state
+        stored = CachedSteadyState(SteadyStateOneAssetIOU, cache_dir=cache_dir, seed=os.devnull,
+                                   mmap_mode=None, **copy(Params.parm_one_asset_IOU))
+    finally:
+        shutil.rmtree(cache_dir)
+
+    for result in (SS, stored):
+        assert np.array_equal(result['joint_distr'], EX1SS['joint_distr'])
+        assert np.array_equal(result['grid']['m'], EX1SS['grid']['m'])
+        assert result['par'] == EX1SS['par']
+        assert isinstance(result['Copula'], SplineCopula)
+        assert np.array_equal(result['Copula'].spline.tck[2], EX1SS['Copula'].tck[2])
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(name, 'passed')
@@ -12,10 +12,11 @@ from HARK.core import AgentType, Market
 from HARK.simulation import drawDiscrete
 from Assets.One.SteadyStateOneAssetIOUs import SteadyStateOneAssetIOU
 from Assets.One.FluctuationsOneAssetIOUs import FluctuationsOneAssetIOUs, SGU_solver
+from Assets.StateSpace import SimulateAggregates
+from Assets.PanelSimulation import PolicyTable, EvaluatePolicy, AliasTables, DrawAlias, SimulatePanel
 from copy import copy, deepcopy
 import numpy as np
 import scipy as sc
-from scipy.interpolate import interp1d
 
 class BayerLuettickeAgent(AgentType):
     '''
@@ -24,7 +25,7 @@ class BayerLuettickeAgent(AgentType):
     '''
     poststate_vars_ = ['bNow','incStateNow']
     
-    def __init__(self,AgentCount,seed=0):
+    def __init__(self,AgentCount,seed=0,dtype=np.float64):
         '''
         Instantiate a new BayerLuettickeType with solution from BayerLuetticke_code.
 
@@ -32,6 +33,11 @@ class BayerLuettickeAgent(AgentType):
         ----------
         AgentCount : int
             Number of agents of this type for simulation
+        seed : int
+            Seed of the random number generator
+        dtype : np.dtype
+            Floating type of the histories of simulatePanel, np.float32
+            halves their size for large panels
         Returns
         -------
         None
@@ -41,6 +47,7 @@ class BayerLuettickeAgent(AgentType):
         self.poststate_vars = deepcopy(self.poststate_vars_)
         self.track_vars     = []
         self.seed               = seed
+        self.dtype              = dtype
         self.resetRNG()
         self.time_flow = False
         self.time_vary      = []
@@ -110,15 +117,11 @@ class BayerLuettickeAgent(AgentType):
         -------
         None
         '''
-        incStatePrev = self.incStateNow
-        incStateNow = np.zeros(self.AgentCount,dtype=int)
         #base_draws = self.RNG.permutation(np.arange(self.AgentCount,dtype=float)/self.AgentCount + 1.0/(2*self.AgentCount))
         base_draws = self.RNG.uniform(size=self.AgentCount)
-        Cutoffs = np.cumsum(self.incStateTransition,axis=1)
-        for j in range(self.incStateTransition.shape[0]):
-            these = incStatePrev == j
-            incStateNow[these] = np.searchsorted(Cutoffs[j,:],base_draws[these]).astype(int)
-        self.incStateNow = incStateNow.astype(int)
+        # all agents at once from the alias tables of their previous state
+        prob, alias = self.incStateAlias
+        self.incStateNow = DrawAlias(prob,alias,self.incStateNow.astype(int),base_draws).astype(int)
         
     def getStates(self):
         '''
@@ -147,11 +150,7 @@ class BayerLuettickeAgent(AgentType):
         -------
         None
         '''
-        cNow = np.zeros(self.AgentCount) + np.nan
-        for j in range(self.incStateTransition.shape[0]):
-            these =  j == self.incStateNow
-            cNow[these] = self.SSConsumptionFunc[j](self.bNow[these])
-        self.cNow = cNow
+        self.cNow = EvaluatePolicy(self.SSConsumptionTable,self.bNow,self.incStateNow)
         return None
         
     def getPostStates(self):
@@ -168,11 +167,31 @@ class BayerLuettickeAgent(AgentType):
         '''
         bPrev = self.bNow
         #For the moment we are only calculating in the steady state - take fixed steady state values below
+        RR = np.where(bPrev<0.,self.RR[1],self.RR[0])
+               
+        self.mNow = bPrev*RR + self.incomeArray[self.incStateNow]
+        self.bNow = self.mNow - self.cNow
+        return None
+
+    def getIncome(self):
+        '''
+        Steady state gross real rates and after-tax income of each income state.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        income_array : np.array
+            Income in each state (including entrepreneur state)
+        RR : tuple
+            Gross real rate of savers and of borrowers
+        '''
         par = self.FluctuationsOneAssetIOU.par
         RB = par['RB']
         borrwedge = par['borrwedge']
         PI = par['PI']
-        RR = (RB+(bPrev.copy()<0.)*borrwedge)/PI
         W = par['W']
         N = par['N']
         H = par['H']
@@ -185,9 +204,43 @@ class BayerLuettickeAgent(AgentType):
         income_array[-1] = Profits*profitshare
         # Add taxes on all income
         income_array = par['tau']*income_array
-               
-        self.mNow = bPrev*RR + income_array[self.incStateNow]
-        self.bNow = self.mNow - self.cNow
+        return income_array, (RB/PI, (RB+borrwedge)/PI)
+
+    def simulatePanel(self,T=None,track_vars=None,chunk=100,directory=None):
+        '''
+        Simulates the agents in the steady state like simulate(), but all
+        periods in one vectorized loop, after getEconomyData. Agents start
+        from draws of the steady state distribution.
+
+        Parameters
+        ----------
+        T : int
+            Number of periods, T_sim if None
+        track_vars : [str]
+            Variables to record as <name>_hist (T x AgentCount), out of
+            'bNow', 'cNow', 'mNow' and 'incStateNow'; self.track_vars if None
+        chunk : int
+            Number of periods kept in memory before they are written to disk
+        directory : str
+            If given, the histories are written to directory/<name>.npy and
+            the <name>_hist attributes are memory maps of these files
+
+        Returns
+        -------
+        None
+        '''
+        if T is None:
+            T = self.T_sim
+        if track_vars is None:
+            track_vars = self.track_vars
+        self.initializeSim()
+        hist = SimulatePanel(self.SSConsumptionTable,self.incStateTransition,self.incomeArray,self.RR,
+                             self.bNow,self.incStateNow,T,seed=self.RNG.randint(0,2**31-1),
+                             dtype=self.dtype,track_vars=track_vars,chunk=chunk,directory=directory)
+        for name in track_vars:
+            setattr(self,name+'_hist',hist[name])
+        self.bNow = hist['bNow_final']
+        self.incStateNow = hist['incStateNow_final']
         return None
     
     def getEconomyData(self,Economy):
@@ -212,13 +265,11 @@ class BayerLuettickeAgent(AgentType):
         self.m_policy = self.FluctuationsOneAssetIOU.m_policy
         self.numIncStates = self.FluctuationsOneAssetIOU.mpar['nh']
         self.assetGridsize = self.FluctuationsOneAssetIOU.mpar['nm']
-        self.incStateTransition = self.FluctuationsOneAssetIOU.P_H
-        #Build steady state consumption function
-        SSConsumptionFunc = []
-        for j in range(self.numIncStates):
-            SSConsumptionFunc_j = interp1d(self.m_policy[:,j], self.c_policy[:,j], fill_value='extrapolate')
-            SSConsumptionFunc.append(SSConsumptionFunc_j)
-        self.SSConsumptionFunc = SSConsumptionFunc
+        self.incStateTransition = np.asarray(self.FluctuationsOneAssetIOU.P_H)
+        self.incStateAlias = AliasTables(self.incStateTransition)
+        #Steady state consumption function of all income states on one grid
+        self.SSConsumptionTable = PolicyTable(self.m_policy, self.c_policy)
+        self.incomeArray, self.RR = self.getIncome()
 
 class BayerLuettickeEconomy(Market):
     '''
@@ -266,25 +317,50 @@ class BayerLuettickeEconomy(Market):
         for agent in self.agents:
             agent.getEconomyData(self)
 
+    def simulateAggregates(self,T=None,paths=1,seed=0):
+        '''
+        Simulates the aggregate states and controls of the linearized model
+        with aggregate shocks, after solve().
+
+        Parameters
+        ----------
+        T : int
+            Number of periods, act_T if None.
+        paths : int
+            Number of independent paths.
+        seed : int
+            Seed of the random number generator.
+
+        Returns
+        -------
+        dict with 'states' (numstates x T x paths) and 'aggregates', the
+        aggregate controls (oc x T x paths), as deviations from the steady state
+        '''
+        mpar = self.SR['mpar']
+        if T is None:
+            T = self.act_T
+        eta = np.zeros(mpar['numstates'])
+        eta[-1] = self.SR['par']['sigmaS']
+        rows = mpar['numstates'] + mpar['numcontrols'] - self.SR['oc'] + np.arange(self.SR['oc'])
+        return SimulateAggregates(self.SGUresult['hx'],self.SGUresult['gx'],eta,T,rows=rows,paths=paths,seed=seed)
+
 ###############################################################################
 
 if __name__ == '__main__':
     import Assets.One.defineSSParameters as Params
     from copy import copy
-    import pickle
+    from Assets.SteadyStateStore import CachedSteadyState
     import pylab as plt
     
     simulate = True
-    solve_ss = False
+    solve_ss = False # True recomputes the steady state even if it is stored
 
-    #First calculate the steady state
-    if solve_ss:
-        EX1param = copy(Params.parm_one_asset_IOU)
-        EX1 = SteadyStateOneAssetIOU(**EX1param)
-        EX1SS = EX1.SolveSteadyState()
-        pickle.dump(EX1SS, open("Assets/One/EX1SS.p", "wb"))
-    else:
-        EX1SS=pickle.load(open("Assets/One/EX1SS.p", "rb"))
+    #First calculate the steady state, or load it if solved before with the same parameters;
+    #a fresh checkout starts from the shipped EX1SS.p
+    EX1param = copy(Params.parm_one_asset_IOU)
+    EX1SS = CachedSteadyState(SteadyStateOneAssetIOU, recompute=solve_ss,
+                              seed=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Assets', 'One', 'EX1SS.p'),
+                              **EX1param)
     #Build BayerLuetticke's object
     FluctuationsOneAssetIOU=FluctuationsOneAssetIOUs(**EX1SS)
         
@@ -299,8 +375,7 @@ if __name__ == '__main__':
     if simulate:
         BayerLuettickeExampleAgent.T_sim = 1000
         BayerLuettickeExampleAgent.track_vars = ['bNow','cNow','mNow','incStateNow']
-        BayerLuettickeExampleAgent.initializeSim()
-        BayerLuettickeExampleAgent.simulate()
+        BayerLuettickeExampleAgent.simulatePanel()
         
         
         ###########################################################
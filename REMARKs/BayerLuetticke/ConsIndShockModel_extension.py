@@ -12,6 +12,7 @@ import scipy as sc
 from scipy import sparse as sp
 from HARK.ConsumptionSaving.ConsIndShockModel import IndShockConsumerType
 from HARK.utilities import makeGridExpMult
+from Assets.SharedKernels import GridLottery, ErgodicDistribution, WeightedPercentiles, LorenzShares
 
 
 class IndShockConsumerType_extend(IndShockConsumerType):
@@ -57,11 +58,11 @@ class IndShockConsumerType_extend(IndShockConsumerType):
         if self.cycles != 0:
             print('Distributional methods presently only work for perpetual youth agents (cycles=0)')
         else:
-            if Dist_mGrid == None:
+            if Dist_mGrid is None:
                 self.Dist_mGrid = self.aXtraGrid
             else:
                 self.Dist_mGrid = Dist_mGrid
-            if Dist_pGrid == None:
+            if Dist_pGrid is None:
                 num_points = 50
                 #Dist_pGrid is taken to cover most of the ergodic distribution
                 p_variance = self.PermShkStd[0]**2
@@ -74,91 +75,188 @@ class IndShockConsumerType_extend(IndShockConsumerType):
     def CalcTransitionMatrix(self):
         '''
         Calculates how the distribution of agents across market resources 
-        transitions from one period to the next
+        transitions from one period to the next.
+        
+        The lotteries of all grid points and shock nodes are computed at once
+        and the matrix is stored sparse (CSR): column i*len(Dist_pGrid)+j holds
+        the distribution next period of agents at Dist_mGrid[i] and
+        Dist_pGrid[j], with at most four entries per shock node plus the
+        distribution of the newborns.
         ''' 
         Dist_mGrid = self.Dist_mGrid
         Dist_pGrid = self.Dist_pGrid
+        nm, nP = len(Dist_mGrid), len(Dist_pGrid)
         aNext = Dist_mGrid - self.solution[0].cFunc(Dist_mGrid)
         bNext = self.Rfree*aNext
         ShockProbs = self.IncomeDstn[0][0]
         TranShocks = self.IncomeDstn[0][1]
         PermShocks = self.IncomeDstn[0][2]
         LivPrb = self.LivPrb[0]
+        nshocks = len(ShockProbs)
+        
+        # lotteries of m (nm x shocks) and p (nP x shocks), independent of each other
+        mNext = bNext[:,np.newaxis]/PermShocks[np.newaxis,:] + TranShocks[np.newaxis,:]
+        pNext = Dist_pGrid[:,np.newaxis]*PermShocks[np.newaxis,:]
+        mLower, mUpperWeight = GridLottery(mNext, Dist_mGrid)
+        pLower, pUpperWeight = GridLottery(pNext, Dist_pGrid)
+        
+        # the four corners of each (i, j, shock), broadcast to nm x nP x shocks
+        rows, vals = [], []
+        for mStep, mWeight in ((0, 1.0-mUpperWeight), (1, mUpperWeight)):
+            for pStep, pWeight in ((0, 1.0-pUpperWeight), (1, pUpperWeight)):
+                rows.append((mLower+mStep)[:,np.newaxis,:]*nP + (pLower+pStep)[np.newaxis,:,:])
+                vals.append(LivPrb*ShockProbs*mWeight[:,np.newaxis,:]*pWeight[np.newaxis,:,:])
+        cols = np.broadcast_to(np.arange(nm*nP).reshape(nm,nP,1), (nm,nP,nshocks))
+        
         #New borns have this distribution (assumes start with no assets and permanent income=1)
         NewBornDist = self.JumpToGrid(TranShocks,np.ones_like(TranShocks),ShockProbs)
-        TranMatrix = np.zeros((len(Dist_mGrid)*len(Dist_pGrid),len(Dist_mGrid)*len(Dist_pGrid)))
-        for i in range(len(Dist_mGrid)):
-            for j in range(len(Dist_pGrid)):
-                mNext_ij = bNext[i]/PermShocks + TranShocks
-                pNext_ij = Dist_pGrid[j]*PermShocks
-                TranMatrix[:,i*len(Dist_pGrid)+j] = LivPrb*self.JumpToGrid(mNext_ij, pNext_ij, ShockProbs) + (1.0-LivPrb)*NewBornDist
-        self.TranMatrix = TranMatrix
+        NewBornIndex = np.flatnonzero(NewBornDist)
+        rows.append(np.repeat(NewBornIndex[:,np.newaxis], nm*nP, axis=1))
+        vals.append(np.repeat((1.0-LivPrb)*NewBornDist[NewBornIndex,np.newaxis], nm*nP, axis=1))
+        
+        rows = np.concatenate([np.ravel(r) for r in rows])
+        vals = np.concatenate([np.ravel(v) for v in vals])
+        cols = np.concatenate([np.ravel(cols)]*4 + [np.tile(np.arange(nm*nP), len(NewBornIndex))])
+        # duplicate entries (corners shared by several shocks) are summed
+        self.TranMatrix = sp.coo_matrix((vals,(rows,cols)), shape=(nm*nP,nm*nP)).tocsr()
                 
     def JumpToGrid(self,m_vals, perm_vals, probs):
         '''
         Distributes values onto a predefined grid, maintaining the means
         ''' 
-        probGrid = np.zeros((len(self.Dist_mGrid),len(self.Dist_pGrid)))
-        mIndex = np.digitize(m_vals,self.Dist_mGrid) - 1
-        mIndex[m_vals <= self.Dist_mGrid[0]] = -1
-        mIndex[m_vals >= self.Dist_mGrid[-1]] = len(self.Dist_mGrid)-1
-        
-        pIndex = np.digitize(perm_vals,self.Dist_pGrid) - 1
-        pIndex[perm_vals <= self.Dist_pGrid[0]] = -1
-        pIndex[perm_vals >= self.Dist_pGrid[-1]] = len(self.Dist_pGrid)-1
-        
-        for i in range(len(m_vals)):
-            if mIndex[i]==-1:
-                mlowerIndex = 0
-                mupperIndex = 0
-                mlowerWeight = 1.0
-                mupperWeight = 0.0
-            elif mIndex[i]==len(self.Dist_mGrid)-1:
-                mlowerIndex = -1
-                mupperIndex = -1
-                mlowerWeight = 1.0
-                mupperWeight = 0.0
-            else:
-                mlowerIndex = mIndex[i]
-                mupperIndex = mIndex[i]+1
-                mlowerWeight = (self.Dist_mGrid[mupperIndex]-m_vals[i])/(self.Dist_mGrid[mupperIndex]-self.Dist_mGrid[mlowerIndex])
-                mupperWeight = 1.0 - mlowerWeight
-                
-            if pIndex[i]==-1:
-                plowerIndex = 0
-                pupperIndex = 0
-                plowerWeight = 1.0
-                pupperWeight = 0.0
-            elif pIndex[i]==len(self.Dist_pGrid)-1:
-                plowerIndex = -1
-                pupperIndex = -1
-                plowerWeight = 1.0
-                pupperWeight = 0.0
-            else:
-                plowerIndex = pIndex[i]
-                pupperIndex = pIndex[i]+1
-                plowerWeight = (self.Dist_pGrid[pupperIndex]-perm_vals[i])/(self.Dist_pGrid[pupperIndex]-self.Dist_pGrid[plowerIndex])
-                pupperWeight = 1.0 - plowerWeight
-                
-            probGrid[mlowerIndex][plowerIndex] = probGrid[mlowerIndex][plowerIndex] + probs[i]*mlowerWeight*plowerWeight
-            probGrid[mlowerIndex][pupperIndex] = probGrid[mlowerIndex][pupperIndex] + probs[i]*mlowerWeight*pupperWeight
-            probGrid[mupperIndex][plowerIndex] = probGrid[mupperIndex][plowerIndex] + probs[i]*mupperWeight*plowerWeight
-            probGrid[mupperIndex][pupperIndex] = probGrid[mupperIndex][pupperIndex] + probs[i]*mupperWeight*pupperWeight
-            
-        return probGrid.flatten()
+        nP = len(self.Dist_pGrid)
+        mLower, mUpperWeight = GridLottery(m_vals, self.Dist_mGrid)
+        pLower, pUpperWeight = GridLottery(perm_vals, self.Dist_pGrid)
+        
+        probGrid = np.zeros(len(self.Dist_mGrid)*nP)
+        for mStep, mWeight in ((0, 1.0-mUpperWeight), (1, mUpperWeight)):
+            for pStep, pWeight in ((0, 1.0-pUpperWeight), (1, pUpperWeight)):
+                probGrid += np.bincount((mLower+mStep)*nP + pLower+pStep, weights=probs*mWeight*pWeight,
+                                        minlength=len(probGrid))
+        return probGrid
     
-    def CalcErgodicDist(self):
+    def CalcErgodicDist(self, method='eigs'):
         '''
         Calculates the egodic distribution across normalized market resources and
         permanent income as the eigenvector associated with the eigenvalue 1.
         The distribution is reshaped as an array with the ij'th element representing
         the probability of being at the i'th point on the mGrid and the j'th
         point on the pGrid.
+        
+        Parameters
+        ----------
+        method : str
+            Solver of the sparse ergodic distribution: 'eigs', 'direct' or
+            'power', see SharedKernels.ErgodicDistribution
         ''' 
-        eigen, ergodic_distr = sp.linalg.eigs(self.TranMatrix, k=1, which='LM')
-        ergodic_distr = ergodic_distr.real/np.sum(ergodic_distr.real)
+        # TranMatrix maps today (columns) to tomorrow (rows)
+        ergodic_distr = ErgodicDistribution(self.TranMatrix.T, method=method)['joint_distr']
         self.ergodic_distr = ergodic_distr.reshape((len(self.Dist_mGrid),len(self.Dist_pGrid)))
         
+    def DistributionVariables(self):
+        '''
+        Values of the individual variables at the points of the distribution
+        grid, each an array (len(Dist_mGrid) x len(Dist_pGrid)).
+        
+        Returns
+        -------
+        dict with
+        mNrm : normalized market resources
+        pLvl : permanent income
+        mLvl, cLvl, aLvl : market resources, consumption and end-of-period
+            assets in levels
+        MPC : marginal propensity to consume out of market resources
+        '''
+        mNrm = np.asarray(self.Dist_mGrid, dtype=float)
+        cNrm = self.solution[0].cFunc(mNrm)
+        MPC = self.solution[0].cFunc.derivative(mNrm)
+        ones = np.ones((1,len(self.Dist_pGrid)))
+        pLvl = np.asarray(self.Dist_pGrid, dtype=float)[np.newaxis,:]
+        return {'mNrm': mNrm[:,np.newaxis]*ones, 'pLvl': np.ones((len(mNrm),1))*pLvl,
+                'mLvl': mNrm[:,np.newaxis]*pLvl, 'cLvl': cNrm[:,np.newaxis]*pLvl,
+                'aLvl': (mNrm-cNrm)[:,np.newaxis]*pLvl, 'MPC': MPC[:,np.newaxis]*ones}
+    
+    def CalcDistributionStats(self, distr=None, wealth='aLvl', percentiles=(0.1,0.25,0.5,0.75,0.9),
+                              lorenz_percentiles=(0.2,0.4,0.6,0.8)):
+        '''
+        Aggregates and distributional statistics computed exactly from a
+        distribution on the grid, instead of from a simulated panel.
+        
+        Parameters
+        ----------
+        distr : np.array (len(Dist_mGrid) x len(Dist_pGrid))
+            Distribution of agents, the ergodic distribution if None
+        wealth : str
+            Variable of DistributionVariables whose percentiles and Lorenz
+            curve are computed
+        percentiles : sequence of floats
+            Percentiles of wealth and of the MPC
+        lorenz_percentiles : sequence of floats
+            Points of the Lorenz curve of wealth
+        
+        Returns
+        -------
+        dict with
+        mean : dict
+            Mean of each variable of DistributionVariables
+        wealth_percentiles, MPC_percentiles : np.array
+            Percentiles of wealth and of the MPC
+        lorenz : np.array
+            Share of wealth held by the lowest lorenz_percentiles of agents
+        MPC_distr : dict
+            'values' (sorted distinct MPCs) and 'weights' (their mass)
+        '''
+        if distr is None:
+            distr = self.ergodic_distr
+        weights = np.ravel(distr)/np.sum(distr)
+        variables = self.DistributionVariables()
+        
+        stats = {'mean': dict((name, weights.dot(np.ravel(val))) for name, val in variables.items())}
+        stats['wealth_percentiles'] = WeightedPercentiles(variables[wealth], weights, percentiles)
+        stats['lorenz'] = LorenzShares(variables[wealth], weights, lorenz_percentiles)
+        stats['MPC_percentiles'] = WeightedPercentiles(variables['MPC'], weights, percentiles)
+        # the MPC depends on normalized market resources only
+        MPC, where = np.unique(variables['MPC'][:,0], return_inverse=True)
+        stats['MPC_distr'] = {'values': MPC,
+                              'weights': np.bincount(where, weights=np.sum(np.reshape(weights, np.shape(distr)), axis=1))}
+        return stats
+    
+    def IterateDistribution(self, T, distr0=None, means=('mLvl','cLvl','aLvl')):
+        '''
+        Iterates a distribution forward with the transition matrix, e.g. the
+        path back to the ergodic distribution after a redistribution.
+        
+        Parameters
+        ----------
+        T : int
+            Number of periods; period 0 is distr0
+        distr0 : np.array (len(Dist_mGrid) x len(Dist_pGrid))
+            Initial distribution, the ergodic distribution if None
+        means : sequence of str
+            Variables of DistributionVariables whose mean is tracked
+        
+        Returns
+        -------
+        dict with
+        distr : np.array (T x len(Dist_mGrid) x len(Dist_pGrid))
+            Distribution in each period
+        <name> : np.array (T,)
+            Mean of each variable in means in each period
+        '''
+        if distr0 is None:
+            distr0 = self.ergodic_distr
+        shape = (len(self.Dist_mGrid),len(self.Dist_pGrid))
+        distr = np.empty((T,shape[0]*shape[1]))
+        distr[0] = np.ravel(distr0)
+        for t in range(1,T):
+            distr[t] = self.TranMatrix.dot(distr[t-1])
+        
+        path = {'distr': distr.reshape((T,)+shape)}
+        variables = self.DistributionVariables()
+        for name in means:
+            path[name] = distr.dot(np.ravel(variables[name]))
+        return path
+        
 if __name__ == '__main__':
     import HARK.ConsumptionSaving.ConsumerParameters as Params
     from HARK.utilities import plotFuncsDer, plotFuncs
@@ -73,7 +73,7 @@ my_file_path = os.path.dirname(os.path.abspath("DCT-Copula-Illustration.ipynb"))
 # Relative directory for pickled code
 code_dir = os.path.join(my_file_path, "../Assets/Two") 
 
-sys.path.insert(0, code_dir)
+sys.path.insert(0, os.path.dirname(my_file_path)) # the REMARK folder, which holds the Assets package
 sys.path.insert(0, my_file_path)
 
 # %% {"code_folding": [0]}
@@ -176,9 +176,8 @@ print('The copula consists of two parts: gridpoints and values at those gridpoin
 
 import sys 
 
-# Relative directory for BL codes 
-sys.path.insert(0,'../../../..')  # comment by TW: this is not the same as in TwoAsset.ipynb. 
-from FluctuationsTwoAsset import FluctuationsTwoAsset
+# BL codes, from the Assets package of the REMARK folder
+from Assets.Two.FluctuationsTwoAsset import FluctuationsTwoAsset
 
 # %% {"code_folding": [0]}
 ## Import other necessary libraries
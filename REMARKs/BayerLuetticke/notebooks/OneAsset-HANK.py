@@ -56,7 +56,7 @@ my_file_path = os.path.dirname(os.path.abspath("OneAsset-HANK.ipynb"))
 # Relative directory for pickled code
 code_dir = os.path.join(my_file_path, "../Assets/One/") 
 
-sys.path.insert(0, code_dir)
+sys.path.insert(0, os.path.dirname(my_file_path)) # the REMARK folder, which holds the Assets package
 sys.path.insert(0, my_file_path)
 
 # %% {"code_folding": []}
@@ -73,7 +73,7 @@ os.chdir(code_dir) # Go to the directory with pickled code
 EX2SS=pickle.load(open("EX2SS.p", "rb"))
 
 # %%
-from FluctuationsOneAssetIOUsBond import FluctuationsOneAssetIOUs, SGU_solver, plot_IRF
+from Assets.One.FluctuationsOneAssetIOUsBond import FluctuationsOneAssetIOUs, SGU_solver, plot_IRF
 
 # %% {"code_folding": []}
 # Uncertainty Shock
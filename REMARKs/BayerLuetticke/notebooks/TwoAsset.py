@@ -178,7 +178,7 @@ my_file_path = os.path.dirname(os.path.abspath("TwoAsset.ipynb"))
 # Relative directory for pickled code
 code_dir = os.path.join(my_file_path, "../Assets/Two") 
 
-sys.path.insert(0, code_dir)
+sys.path.insert(0, os.path.dirname(my_file_path)) # the REMARK folder, which holds the Assets package
 sys.path.insert(0, my_file_path)
 
 # %% {"code_folding": [0]}
@@ -354,7 +354,7 @@ EX3SS=pickle.load(open("EX3SS_20.p", "rb"))
 
 # %%
 import time
-from FluctuationsTwoAsset import FluctuationsTwoAsset, SGU_solver, plot_IRF
+from Assets.Two.FluctuationsTwoAsset import FluctuationsTwoAsset, SGU_solver, plot_IRF
 
 start_time = time.perf_counter() 
 
@@ -0,0 +1,542 @@
+# -*- coding: utf-8 -*-
+'''
+Driver for the Krusell-Smith economy of this REMARK, built on HARK's
+AggShockMarkovConsumerType and CobbDouglasMarkovEconomy.
+
+It adds to HARK's market fixed point
+    * a regression of the aggregate law of motion for all Markov states at
+      once, which also keeps the R^2 of each state;
+    * a solve loop that records per-iteration wall time, R^2 and the change
+      of the saving rule coefficients;
+    * warm starting an economy (e.g. the heterogeneous discount factor one)
+      from an already solved economy, both its saving rule AFunc and the
+      consumers' policy functions cFunc;
+    * a deterministic histogram mode, in which each type is a distribution
+      over capital and employment on a fixed grid instead of AgentCount
+      Monte Carlo households, so that aggregate capital has no sampling
+      noise.
+'''
+from __future__ import print_function
+
+import time
+from copy import copy, deepcopy
+from multiprocessing import Pool, cpu_count
+import numpy as np
+
+from HARK.ConsumptionSaving.ConsAggShockModel import (AggShockMarkovConsumerType,
+                                                       CobbDouglasMarkovEconomy,
+                                                       AggregateSavingRule,
+                                                       AggShocksDynamicRule)
+
+# Simulation modes of KSConsumerType
+SIM_MODES = ('montecarlo', 'histogram')
+
+# Economy data shared by all types, sent with each type to the workers
+SHARED_VARS = ('AFunc', 'Mgrid')
+
+
+def aggregateLawRegression(logM, logA, states, StateCount):
+    '''
+    OLS of logA on logM separately for each Markov state, computed for all
+    states at once from grouped sums.
+
+    Parameters
+    ----------
+    logM : np.array
+        log aggregate market resources (regressor)
+    logA : np.array
+        log aggregate savings (regressand)
+    states : np.array of int
+        Markov state of each observation
+    StateCount : int
+        number of Markov states
+
+    Returns
+    -------
+    intercept, slope, rSq : np.array (StateCount,)
+        nan for states without observations
+    '''
+    logM = np.asarray(logM, dtype=float)
+    logA = np.asarray(logA, dtype=float)
+    states = np.asarray(states, dtype=int)
+
+    count = np.bincount(states, minlength=StateCount).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        meanM = np.bincount(states, logM, minlength=StateCount)/count
+        meanA = np.bincount(states, logA, minlength=StateCount)/count
+        dM = logM - meanM[states]
+        dA = logA - meanA[states]
+        varM = np.bincount(states, dM*dM, minlength=StateCount)
+        varA = np.bincount(states, dA*dA, minlength=StateCount)
+        cov = np.bincount(states, dM*dA, minlength=StateCount)
+
+        slope = cov/varM
+        intercept = meanA - slope*meanM
+        rSq = cov**2/(varM*varA)
+    return intercept, slope, rSq
+
+
+def makeHistGrid(aMax, HistCount=1000, HistCurv=2.0):
+    '''
+    Grid of end-of-period assets for the histogram mode, from zero (the
+    borrowing constraint) to aMax, denser near the constraint.
+    '''
+    return aMax*np.linspace(0., 1., HistCount)**HistCurv
+
+
+def gridLottery(vals, grid):
+    '''
+    Lower grid index and weight on the upper neighbour of each value, so
+    that the two weights put the mean on the value; values outside the grid
+    go to its end points.
+    '''
+    idx = np.clip(np.searchsorted(grid, vals, side='right') - 1, 0, len(grid) - 2)
+    upper = np.clip((vals - grid[idx])/(grid[idx + 1] - grid[idx]), 0., 1.)
+    return idx, upper
+
+
+class KSConsumerType(AggShockMarkovConsumerType):
+    '''
+    AggShockMarkovConsumerType that can be warm started from a solved
+    consumer and simulated by a histogram over capital and employment.
+
+    In histogram mode the type is a distribution HistDstn (HistCount x number
+    of income shocks) over end-of-period assets k on the grid HistGrid and
+    the income shock (employment state epsilon) of the period. Each period
+    it is pushed forward with the consumption function, capital between
+    grid points is split on its two neighbours with lottery weights that
+    keep its mean, so that aggregate capital is exact for the given history
+    of aggregate shocks: no sampling noise, and act_T only needs to be long
+    enough for the regression rather than for averaging out households.
+    The types hand aLvlNow and pLvlNow to the economy as one element arrays
+    (mean assets, permanent income level), so all types of an economy must
+    use the same mode and AgentCount.
+
+    Additional attributes
+    ---------------------
+    SimMode : str
+        'montecarlo' (HARK's simulation of AgentCount households) or
+        'histogram'
+    HistCount, HistCurv, HistMaxFac : int, float, float
+        size and curvature of the histogram grid, whose top is HistMaxFac
+        times the steady state capital of the economy
+    HistInit : str
+        distribution at the start of each simulated history: 'point' puts
+        all households at HARK's initial assets, 'last' starts from the end
+        of the previous history (of the previous fixed point iteration),
+        which shortens the transition at the start of the history
+    solution_warm : solution or None
+        solution used instead of the terminal period one as the starting
+        point of the infinite horizon solution
+    '''
+    def __init__(self, SimMode='montecarlo', HistCount=1000, HistCurv=2.0, HistMaxFac=8.0,
+                 HistInit='point', **kwds):
+        if SimMode not in SIM_MODES:
+            raise ValueError('Unknown SimMode: ' + str(SimMode))
+        if HistInit not in ('point', 'last'):
+            raise ValueError('Unknown HistInit: ' + str(HistInit))
+        self.SimMode = SimMode
+        self.HistCount = HistCount
+        self.HistCurv = HistCurv
+        self.HistMaxFac = HistMaxFac
+        self.HistInit = HistInit
+        self.HistDstn = None
+        self.solution_warm = None
+        AggShockMarkovConsumerType.__init__(self, **kwds)
+
+    def updateSolutionTerminal(self):
+        if getattr(self, 'solution_warm', None) is not None:
+            self.solution_terminal = deepcopy(self.solution_warm)
+        else:
+            AggShockMarkovConsumerType.updateSolutionTerminal(self)
+
+    def getEconomyData(self, Economy):
+        AggShockMarkovConsumerType.getEconomyData(self, Economy)
+        self.HistGrid = makeHistGrid(self.HistMaxFac*Economy.kSS, self.HistCount, self.HistCurv)
+        self.HistDstn = None
+
+    def reset(self):
+        AggShockMarkovConsumerType.reset(self)
+        if self.SimMode == 'histogram':
+            self.resetHistogram()
+
+    def resetHistogram(self):
+        '''
+        Distribution at the start of a simulated history, see HistInit. The
+        employment states of the (fictitious) previous period are those of
+        the initial Markov state.
+        '''
+        for IncomeDstn in self.IncomeDstn[0]:
+            if np.any(np.asarray(IncomeDstn[1]) != 1.):
+                raise ValueError('The histogram mode needs a common permanent income level '
+                                 '(no idiosyncratic permanent shocks).')
+        probs = np.asarray(self.IncomeDstn[0][int(np.mean(getattr(self, 'MrkvNow', 0)))][0], dtype=float)
+
+        if self.HistInit == 'point' or self.HistDstn is None:
+            # all households start at the mean of HARK's initial assets
+            idx, upper = gridLottery(np.array([np.mean(self.aNrmNow)]), self.HistGrid)
+            kDstn = np.zeros(len(self.HistGrid))
+            kDstn[idx] += 1. - upper
+            kDstn[idx + 1] += upper
+        else:
+            kDstn = np.sum(self.HistDstn, axis=1)
+        self.HistDstn = kDstn[:, np.newaxis]*probs[np.newaxis, :]
+        self.HistpLvl = np.mean(self.pLvlNow)
+        self.aLvlNow = np.array([self.HistpLvl*np.dot(kDstn, self.HistGrid)])
+        self.pLvlNow = np.array([self.HistpLvl])
+
+    def marketAction(self):
+        if self.SimMode == 'histogram':
+            self.histogramStep()
+        else:
+            AggShockMarkovConsumerType.marketAction(self)
+
+    def histogramStep(self):
+        '''
+        Moves the histogram forward one period with the current aggregate
+        state and prices: capital k of the households of each employment
+        state epsilon of the current Markov state (drawn independently of
+        last period's, as unemployment is serially uncorrelated here) gives
+        m = R k/PermShkAgg + w z epsilon and end-of-period assets m - c(m, M).
+        Sets aLvlNow and pLvlNow to one element arrays with the mean assets
+        and the permanent income level.
+        '''
+        Mrkv = int(self.MrkvNow)
+        probs, PermShks, TranShks = [np.asarray(x, dtype=float) for x in self.IncomeDstn[0][Mrkv][:3]]
+        PermShkAgg = float(self.PermShkAggNow)
+        cFunc = self.solution[0].cFunc[Mrkv]
+        HistCount = len(self.HistGrid)
+        kDstn = np.sum(self.HistDstn, axis=1)
+
+        # market resources at each node (rows) for each employment state (columns)
+        mNrm = (self.RfreeNow/PermShkAgg)*self.HistGrid[:, np.newaxis] \
+            + (self.wRteNow*self.TranShkAggNow*TranShks)[np.newaxis, :]
+        aNrm = mNrm - cFunc(mNrm.ravel(), self.MaggNow*np.ones(mNrm.size)).reshape(mNrm.shape)
+
+        # lottery on the capital grid, within the same employment column
+        idx, upper = gridLottery(aNrm.ravel(), self.HistGrid)
+        column = np.tile(np.arange(len(probs)), HistCount)
+        weights = (kDstn[:, np.newaxis]*probs[np.newaxis, :]).ravel()
+        size = HistCount*len(probs)
+        self.HistDstn = (np.bincount(idx*len(probs) + column, weights*(1. - upper), minlength=size)
+                         + np.bincount((idx + 1)*len(probs) + column, weights*upper, minlength=size)
+                         ).reshape(HistCount, len(probs))
+
+        top_mass = np.sum(self.HistDstn[-1])
+        if top_mass > 1e-6 and not getattr(self, 'HistTopWarned', False):
+            print('Warning: ', '{:.2e}'.format(top_mass), ' of the households are at the top of '
+                  'the histogram grid, increase HistMaxFac')
+            self.HistTopWarned = True
+
+        self.HistpLvl *= PermShkAgg
+        self.aLvlNow = np.array([self.HistpLvl*np.dot(np.sum(self.HistDstn, axis=1), self.HistGrid)])
+        self.pLvlNow = np.array([self.HistpLvl])
+
+    def getHistogramStats(self):
+        '''
+        Statistics of the current histogram by employment state.
+
+        Returns
+        -------
+        dict with
+        share : np.array
+            population share of each income shock (employment state)
+        mean_aLvl : np.array
+            mean wealth of each employment state
+        top_mass : float
+            share at the top node of the grid (should be about zero)
+        '''
+        share = np.sum(self.HistDstn, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_aLvl = self.HistpLvl*np.dot(self.HistGrid, self.HistDstn)/share
+        return {'share': share, 'mean_aLvl': mean_aLvl, 'top_mass': np.sum(self.HistDstn[-1])}
+
+
+class KSMarkovEconomy(CobbDouglasMarkovEconomy):
+    '''
+    CobbDouglasMarkovEconomy whose aggregate saving rule is estimated for all
+    Markov states at once and which keeps the fit of the last regression in
+    the attribute regression (dict with intercept, slope and rSq, before
+    damping).
+    '''
+    def calcAFunc(self, MaggNow, AaggNow):
+        discard_periods = self.T_discard
+        update_weight = 1. - self.DampingFac
+        total_periods = len(MaggNow)
+        StateCount = self.MrkvArray.shape[0]
+
+        logAagg = np.log(np.asarray(AaggNow[discard_periods:total_periods], dtype=float))
+        logMagg = np.log(np.asarray(MaggNow[discard_periods - 1:total_periods - 1], dtype=float))
+        MrkvHist = np.asarray(self.MrkvNow_hist[discard_periods - 1:total_periods - 1], dtype=int)
+
+        intercept, slope, rSq = aggregateLawRegression(logMagg, logAagg, MrkvHist, StateCount)
+        self.regression = {'intercept': intercept, 'slope': slope, 'rSq': rSq}
+
+        # Damp the new coefficients with the previous ones
+        intercept = update_weight*intercept + (1. - update_weight)*np.asarray(self.intercept_prev)
+        slope = update_weight*slope + (1. - update_weight)*np.asarray(self.slope_prev)
+        self.intercept_prev = list(intercept)
+        self.slope_prev = list(slope)
+
+        AFunc_list = [AggregateSavingRule(intercept[i], slope[i]) for i in range(StateCount)]
+        self.AFunc = AFunc_list
+        if self.verbose:
+            print('intercept=' + str(list(intercept)) + ', slope=' + str(list(slope))
+                  + ', r-sq=' + str(list(rSq)))
+        return AggShocksDynamicRule(AFunc_list)
+
+
+def _SolveType(task):
+    '''
+    Solves one consumer type with the economy data of the task.
+
+    Parameters
+    ----------
+    task : tuple
+        (index of the type, type without the shared economy data, dict with
+        the shared economy data)
+
+    Returns
+    -------
+    (index of the type, solution)
+    '''
+    n, this_type, shared = task
+    for name, value in shared.items():
+        setattr(this_type, name, value)
+    this_type.solve()
+    return n, this_type.solution
+
+
+def makePool(agents, workers=1):
+    '''
+    Pool of worker processes for solveTypes, None if the types are to be
+    solved in this process (workers == 1 or a single type).
+
+    Parameters
+    ----------
+    agents : list of AgentType
+    workers : int
+        number of processes, at most one per type; None uses the number of
+        processors
+    '''
+    if workers is None:
+        workers = cpu_count()
+    workers = max(min(int(workers), len(agents)), 1)
+    return Pool(processes=workers) if workers > 1 else None
+
+
+def solveTypes(agents, workers=1, pool=None):
+    '''
+    Solves the consumer types given the current economy data, the types in
+    a pool of worker processes when one is given or when workers > 1.
+
+    Each task carries one type without its previous solution, and the
+    shared economy data (SHARED_VARS) of the first type, which is small: the
+    saving rules and the grid of aggregate resources. Only the new solution
+    comes back. Solutions are stored in the order of agents whatever the
+    order in which workers finish, so the result does not depend on the
+    number of workers. Only the solution is returned: attributes that
+    solve() sets besides it are not copied back.
+
+    Parameters
+    ----------
+    agents : list of AgentType
+        consumer types of the economy, sharing the economy data
+    workers : int
+        number of processes, see makePool; only used without pool
+    pool : multiprocessing.Pool
+        pool to use, e.g. one kept over all iterations of the fixed point
+        (see solveKrusellSmith); a pool made here is closed on return
+    '''
+    own_pool = pool is None
+    if own_pool:
+        pool = makePool(agents, workers)
+    if pool is None:
+        for this_type in agents:
+            this_type.solve()
+        return
+
+    shared = {name: getattr(agents[0], name) for name in SHARED_VARS}
+    tasks = []
+    for n, this_type in enumerate(agents):
+        task_type = copy(this_type)
+        for name in SHARED_VARS + ('solution',):
+            task_type.__dict__.pop(name, None)
+        tasks.append((n, task_type, shared))
+
+    try:
+        for n, solution in pool.imap_unordered(_SolveType, tasks):
+            agents[n].solution = solution
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+
+def makeBetaTypes(AgentDictionary, IncomeDstn, DiscFac_list, **kwds):
+    '''
+    Consumer types that differ only in their discount factor, built afresh
+    from the parameter dictionary rather than deep copied from a solved
+    consumer (whose solution and simulated history would be copied too).
+
+    Parameters
+    ----------
+    AgentDictionary : dict
+        parameters of KSConsumerType
+    IncomeDstn : list
+        income distribution by Markov state, replaces IncomeDstn[0]
+    DiscFac_list : sequence of float
+        discount factor of each type
+    kwds :
+        further arguments of KSConsumerType, e.g. SimMode='histogram'
+
+    Returns
+    -------
+    list of KSConsumerType, type n has seed n
+    '''
+    types = []
+    for n, DiscFac in enumerate(DiscFac_list):
+        params = dict(AgentDictionary)
+        params.update(kwds)
+        params['DiscFac'] = DiscFac
+        NewType = KSConsumerType(**params)
+        NewType.IncomeDstn[0] = deepcopy(IncomeDstn)
+        NewType.seed = n
+        types.append(NewType)
+    return types
+
+
+def warmStartEconomy(economy, solved_economy, solved_type=None):
+    '''
+    Starts the aggregate fixed point of economy from the saving rule of
+    solved_economy and, if solved_type is given, the infinite horizon
+    problem of each of its consumers from the policy functions of
+    solved_type. Call after the consumers got the economy data.
+
+    Parameters
+    ----------
+    economy : KSMarkovEconomy
+        economy to solve
+    solved_economy : CobbDouglasMarkovEconomy
+        solved economy with the same Markov states
+    solved_type : AggShockMarkovConsumerType
+        solved consumer of solved_economy
+    '''
+    economy.intercept_prev = list(solved_economy.intercept_prev)
+    economy.slope_prev = list(solved_economy.slope_prev)
+    economy.AFunc = [AggregateSavingRule(economy.intercept_prev[i], economy.slope_prev[i])
+                     for i in range(len(economy.intercept_prev))]
+    for this_type in economy.agents:
+        this_type.AFunc = economy.AFunc
+        if solved_type is not None:
+            this_type.solution_warm = solved_type.solution[0]
+            this_type.updateSolutionTerminal()
+
+
+def solveKrusellSmith(economy, tolerance=None, max_loops=None, verbose=True, workers=1):
+    '''
+    Solves for the aggregate saving rule like Market.solve, recording for
+    each iteration of the fixed point the wall time of the consumers'
+    solution and of the simulation, the R^2 of the regressions and the
+    change of the (damped) coefficients.
+
+    Parameters
+    ----------
+    economy : KSMarkovEconomy
+    tolerance : float
+        distance between saving rules at which to stop, economy.tolerance if None
+    max_loops : int
+        maximal number of iterations, economy.max_loops if None
+    verbose : bool
+        print a line per iteration
+    workers : int
+        number of processes solving the consumer types, see makePool; the
+        pool is made once and used in all iterations. Pools re-import the
+        calling script in each worker unless processes are forked, so a
+        script calling this with workers > 1 needs an
+        if __name__ == '__main__': guard on platforms where the default start
+        method is spawn (Windows, macOS).
+
+    Returns
+    -------
+    dict with one entry per iteration in each of
+    solve_time, simulate_time, total_time : list of float (seconds)
+    intercept, slope, rSq : list of np.array (StateCount,)
+    d_intercept, d_slope : list of np.array (StateCount,)
+        change of the coefficients from the previous iteration
+    distance : list of float
+        distance of the saving rule to the previous one
+    '''
+    tolerance = economy.tolerance if tolerance is None else tolerance
+    max_loops = economy.max_loops if max_loops is None else max_loops
+
+    telemetry = {name: [] for name in ('solve_time', 'simulate_time', 'total_time', 'intercept',
+                                       'slope', 'rSq', 'd_intercept', 'd_slope', 'distance')}
+    old_dynamics = None
+    pool = makePool(economy.agents, workers)
+    try:
+        for loop in range(max_loops):
+            start_time = time.perf_counter()
+            solveTypes(economy.agents, pool=pool)
+            solved_time = time.perf_counter()
+            economy.makeHistory()
+            simulated_time = time.perf_counter()
+
+            intercept_prev = np.array(economy.intercept_prev, dtype=float)
+            slope_prev = np.array(economy.slope_prev, dtype=float)
+            new_dynamics = economy.updateDynamics()
+            distance = new_dynamics.distance(old_dynamics) if old_dynamics is not None else 1000000.0
+            old_dynamics = new_dynamics
+            end_time = time.perf_counter()
+
+            intercept = np.array(economy.intercept_prev, dtype=float)
+            slope = np.array(economy.slope_prev, dtype=float)
+            telemetry['solve_time'].append(solved_time - start_time)
+            telemetry['simulate_time'].append(simulated_time - solved_time)
+            telemetry['total_time'].append(end_time - start_time)
+            telemetry['intercept'].append(intercept)
+            telemetry['slope'].append(slope)
+            telemetry['rSq'].append(np.array(getattr(economy, 'regression', {}).get('rSq', np.nan)))
+            telemetry['d_intercept'].append(intercept - intercept_prev)
+            telemetry['d_slope'].append(slope - slope_prev)
+            telemetry['distance'].append(distance)
+
+            if verbose:
+                print('Iteration ', str(loop + 1), ': ', '{:.2f}'.format(end_time - start_time),
+                      ' seconds (solve ', '{:.2f}'.format(solved_time - start_time), ', simulate ',
+                      '{:.2f}'.format(simulated_time - solved_time), '), r-sq=',
+                      str(telemetry['rSq'][-1]), ', max coefficient change ',
+                      '{:.2e}'.format(max(np.max(np.abs(intercept - intercept_prev)),
+                                          np.max(np.abs(slope - slope_prev)))))
+            if distance < tolerance:
+                break
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    economy.dynamics = new_dynamics
+    return telemetry
+
+
+def getWealthSample(economy):
+    '''
+    Wealth (aLvl) of all households of the economy's consumer types and
+    their weights: the simulated households in montecarlo mode, the
+    histogram nodes in histogram mode. Types get equal total weight.
+
+    Returns
+    -------
+    values, weights : np.array
+    '''
+    values, weights = [], []
+    for this_type in economy.agents:
+        if getattr(this_type, 'SimMode', 'montecarlo') == 'histogram':
+            kDstn = np.sum(this_type.HistDstn, axis=1)
+            values.append(this_type.HistpLvl*this_type.HistGrid)
+            weights.append(kDstn/np.sum(kDstn))
+        else:
+            aLvl = np.asarray(this_type.aLvlNow, dtype=float)
+            values.append(aLvl)
+            weights.append(np.ones(len(aLvl))/len(aLvl))
+    return np.concatenate(values), np.concatenate(weights)/len(economy.agents)
@@ -183,6 +183,10 @@ from HARK.utilities import plotFuncs, plotFuncsDer, make_figs
 # Markov consumer type that allows aggregate shocks
 from HARK.ConsumptionSaving.ConsAggShockModel import AggShockMarkovConsumerType
 
+# KSDriver (in this directory) extends it with warm starts and a histogram simulation mode,
+# and adds a solver for the economy that reports its progress
+from KSDriver import KSConsumerType, KSMarkovEconomy, makeBetaTypes, warmStartEconomy, solveKrusellSmith, getWealthSample
+
 # %% {"code_folding": [0]}
 # Define a dictionary to make an 'instance' of our Krusell-Smith consumer.
 
@@ -249,7 +253,7 @@ KSAgentDictionary['MrkvArray'] = AggMrkvArray
 
 # %%
 # Create the Krusell-Smith agent as an instance of AggShockMarkovConsumerType 
-KSAgent = AggShockMarkovConsumerType(**KSAgentDictionary)
+KSAgent = KSConsumerType(**KSAgentDictionary)
 
 # %% [markdown]
 # Now we need to specify the income distribution. 
@@ -321,7 +325,7 @@ KSEconomyDictionary = {
 KSEconomyDictionary['CapShare']  = 0.36
 KSEconomyDictionary['MrkvArray'] = AggMrkvArray
 
-KSEconomy = CobbDouglasMarkovEconomy(agents = [KSAgent], **KSEconomyDictionary) # Combine production and consumption sides into an "Economy"
+KSEconomy = KSMarkovEconomy(agents = [KSAgent], **KSEconomyDictionary) # Combine production and consumption sides into an "Economy"
 
 # %% [markdown]
 # We have now populated the $\texttt{KSEconomy}$ with $\texttt{KSAgents}$ defined before. That is basically telling the agents to take the macro state from the $\texttt{KSEconomy}$. 
@@ -379,8 +383,9 @@ KSEconomy.tolerance = 0.01
 
 # Solve macro problem by finding a fixed point for beliefs
 
-KSEconomy.solve() # Solve the economy using the market method. 
+KSTelemetry = solveKrusellSmith(KSEconomy) # Solve the economy using the market method. 
 # i.e. guess the saving function, and iterate until a fixed point
+# KSTelemetry holds the time, regression r-sq and coefficient changes of each iteration
 
 # %% [markdown]
 # The last line above is the converged aggregate saving rule for good and bad times, respectively.
@@ -439,6 +444,9 @@ print("The mean of individual wealth is "+ str(sim_wealth.mean()) + ";\n the sta
 # Get some tools for plotting simulated vs actual wealth distributions
 from HARK.utilities import getLorenzShares, getPercentiles
 
+# WealthStats (in this directory, as in the cstwMPC-RHetero REMARK) sorts the wealth data once for all statistics
+from WealthStats import WealthDistribution
+
 # The cstwMPC model conveniently has data on the wealth distribution 
 # from the U.S. Survey of Consumer Finances
 from HARK.cstwMPC.SetupParamsCSTW import SCF_wealth, SCF_weights
@@ -447,8 +455,11 @@ from HARK.cstwMPC.SetupParamsCSTW import SCF_wealth, SCF_weights
 # Construct the Lorenz curves and plot them
 
 pctiles = np.linspace(0.001,0.999,15)
-SCF_Lorenz_points = getLorenzShares(SCF_wealth,weights=SCF_weights,percentiles=pctiles)
-sim_Lorenz_points = getLorenzShares(sim_wealth,percentiles=pctiles)
+SCF_wealth_dstn = WealthDistribution(SCF_wealth,weights=SCF_weights)
+sim_wealth_dstn = WealthDistribution(sim_wealth)
+SCF_Lorenz_points = SCF_wealth_dstn.lorenzShares(pctiles)
+sim_Lorenz_points = sim_wealth_dstn.lorenzShares(pctiles)
+print('Gini coefficient of wealth: SCF ' + str(SCF_wealth_dstn.gini()) + ', benchmark KS ' + str(sim_wealth_dstn.gini()))
 
 # Plot 
 plt.figure(figsize=(5,5))
@@ -468,6 +479,27 @@ plt.show()
 lorenz_distance = np.sqrt(np.sum((SCF_Lorenz_points - sim_Lorenz_points)**2))
 print("The Euclidean distance between simulated wealth distribution and the estimates from the SCF data is "+str(lorenz_distance) )
 
+# %% [markdown]
+# #### Non-stochastic Aggregation
+#
+# Aggregate capital above comes from simulating $\texttt{AgentCount}=10000$ households, so the estimated $\texttt{intercept}$ and $\texttt{slope}$ of the saving rule carry sampling noise. With $\texttt{SimMode='histogram'}$ each type is instead a distribution over $(k, \epsilon)$ on a fine grid of capital, pushed forward each period with the consumption function and lottery weights between grid points. Aggregate capital is then exact for the given history of aggregate shocks, and a shorter history suffices for the same precision.
+
+# %% {"code_folding": []}
+# Solve the benchmark economy with the histogram, starting from the simulated solution
+KSEconomyDictionary_hist = dict(KSEconomyDictionary, act_T=400)
+KSAgent_hist = makeBetaTypes(KSAgentDictionary, KSAgent.IncomeDstn[0], [KSAgentDictionary['DiscFac']],
+                             SimMode='histogram', HistInit='last')[0]
+KSEconomy_hist = KSMarkovEconomy(agents = [KSAgent_hist], **KSEconomyDictionary_hist)
+KSEconomy_hist.AggShkDstn = KSAggShkDstn
+KSAgent_hist.getEconomyData(KSEconomy_hist)
+KSEconomy_hist.makeAggShkHist()
+KSEconomy_hist.tolerance = 0.01
+warmStartEconomy(KSEconomy_hist, KSEconomy, KSAgent)
+KSTelemetry_hist = solveKrusellSmith(KSEconomy_hist)
+
+print('Saving rule intercepts (simulated, histogram): ' + str(KSEconomy.intercept_prev) + ', ' + str(KSEconomy_hist.intercept_prev))
+print('Saving rule slopes     (simulated, histogram): ' + str(KSEconomy.slope_prev) + ', ' + str(KSEconomy_hist.slope_prev))
+
 # %% [markdown]
 # #### Heterogeneous Time Preference Rates
 #
@@ -497,26 +529,29 @@ num_types = 3              # number of types we want;
 DiscFac_mean   = 0.9858    # center of beta distribution 
 DiscFac_spread = 0.0085    # spread of beta distribution
 DiscFac_dstn = approxUniform(num_types, DiscFac_mean-DiscFac_spread, DiscFac_mean+DiscFac_spread)[1]
-BaselineType = deepcopy(KSAgent)
 
-MyTypes = [] # initialize an empty list to hold our consumer types
-for nn in range(len(DiscFac_dstn)):
-    # Now create the types, and append them to the list MyTypes
-    NewType = deepcopy(BaselineType)
-    NewType.DiscFac = DiscFac_dstn[nn]
-    NewType.seed = nn # give each consumer type a different RNG seed
-    MyTypes.append(NewType)
+# Create one consumer type per discount factor, type nn gets RNG seed nn.
+# SimMode='histogram' would track each type's distribution of assets on a grid
+# instead of simulating AgentCount households (the plots below use the households)
+MyTypes = makeBetaTypes(KSAgentDictionary, KSAgent.IncomeDstn[0], DiscFac_dstn, SimMode='montecarlo')
 
 # %% {"code_folding": []}
 # Put all agents into the economy
-KSEconomy_sim = CobbDouglasMarkovEconomy(agents = MyTypes, **KSEconomyDictionary) 
+KSEconomy_sim = KSMarkovEconomy(agents = MyTypes, **KSEconomyDictionary) 
 KSEconomy_sim.AggShkDstn = KSAggShkDstn # Agg shocks are the same as defined earlier
 
 for ThisType in MyTypes:
     ThisType.getEconomyData(KSEconomy_sim) # Makes attributes of the economy, attributes of the agent
 
 KSEconomy_sim.makeAggShkHist() # Make a simulated prehistory of the economy
-KSEconomy_sim.solve()          # Solve macro problem by getting a fixed point dynamic rule
+
+# Start from the saving rule and consumption functions of the single type economy
+warmStartEconomy(KSEconomy_sim, KSEconomy, KSAgent)
+# The types are solved in parallel, one process per type, where processes are forked (Linux):
+# elsewhere the worker processes would run this whole script again, so the types are solved in turn
+from multiprocessing import get_start_method
+workers = num_types if get_start_method() == 'fork' else 1
+KSTelemetry_sim = solveKrusellSmith(KSEconomy_sim, workers=workers) # Solve macro problem by getting a fixed point dynamic rule
 
 # %% {"code_folding": []}
 # Get the level of end-of-period assets a for all types of consumers
@@ -527,10 +562,12 @@ print('Aggregate capital to income ratio is ' + str(np.mean(aLvl_all)))
 # %% {"code_folding": []}
 # Plot the distribution of wealth across all agent types
 sim_3beta_wealth = aLvl_all
+sim_3beta_wealth_dstn = WealthDistribution(*getWealthSample(KSEconomy_sim)) # also works with SimMode='histogram'
 pctiles = np.linspace(0.001,0.999,15)
-sim_Lorenz_points = getLorenzShares(sim_wealth,percentiles=pctiles)
-SCF_Lorenz_points = getLorenzShares(SCF_wealth,weights=SCF_weights,percentiles=pctiles)
-sim_3beta_Lorenz_points = getLorenzShares(sim_3beta_wealth,percentiles=pctiles)
+sim_Lorenz_points = sim_wealth_dstn.lorenzShares(pctiles)
+SCF_Lorenz_points = SCF_wealth_dstn.lorenzShares(pctiles)
+sim_3beta_Lorenz_points = sim_3beta_wealth_dstn.lorenzShares(pctiles)
+print('Gini coefficient of wealth with 3 types: ' + str(sim_3beta_wealth_dstn.gini()))
 
 ## Plot
 plt.figure(figsize=(5,5))
@@ -27,6 +27,9 @@ aXtraNestFac = 3              # Number of times to 'exponentially nest' when con
 CubicBool = False             # Whether to use cubic spline interpolation
 vFuncBool = False             # Whether to calculate the value function during solution
 do_agg_shocks = False         # Solve the FBS aggregate shocks version of the model
+workers = None                # Processes solving and simulating the types (None: one per processor, 1: serial)
+reuse_solutions = True        # Reuse and warm start from the solutions of earlier parameter values
+stream_stats = False          # Keep only the last period of each agent's data (statistics of the last period, K/Y of all)
 
 # Set simulation parameters
 Population = 1000             # Total number of simulated agents in the population
@@ -116,7 +119,10 @@ init_market = {'LorenzBool': False,
                'IncUnemp':IncUnemp,
                'cutoffs':[(0.99,1),(0.9,1),(0.8,1),(0.6,0.8),(0.4,0.6),(0.2,0.4),(0.0,0.2)],
                'LorenzPercentiles':percentiles_to_match,
-               'AggShockBool':do_agg_shocks
+               'AggShockBool':do_agg_shocks,
+               'workers':workers,
+               'reuse_solutions':reuse_solutions,
+               'stream_stats':stream_stats
                }
 
 def main():
@@ -0,0 +1,164 @@
+'''
+Solves and simulates the agent types of a market without aggregate shocks
+in a pool of processes.
+
+Without aggregate shocks the types do not interact: each one can be solved
+and simulated for all periods on its own, and the market only needs the
+cross section of every period afterwards to compute its statistics. Each
+worker returns, besides the type's solution, only the per-period data that
+those statistics need:
+    'KY'    : the type's capital and income (cohort weighted sums), from
+              which the capital to income ratio follows;
+    'Lorenz': in addition wealth and age of each agent;
+    'All'   : all variables reaped by the market.
+With stream=True the per-agent data is only kept for the last period, so
+that a type needs memory of order AgentCount whatever the number of
+periods; the capital and income of each period are still reduced on the
+fly. Each type's random number generator is reset from its own seed when it
+is simulated, so the draws, and the statistics, do not depend on which
+worker simulates which type or on the number of workers. The simulated
+state of the last period (STATE_VARS) is copied back into the types of the
+calling process, as after a serial simulation.
+'''
+from __future__ import division, print_function
+
+import numpy as np
+from copy import copy
+from multiprocessing import Pool, cpu_count
+
+# Variables kept for each level of statistics
+KEEP_VARS = {'KY': [],
+             'Lorenz': ['aLvlNow', 't_age'],
+             'All': ['aLvlNow', 'pLvlNow', 'MPCnow', 'TranShkNow', 'EmpNow', 't_age']}
+
+# Attributes of the types that are not sent to the workers
+DROP_VARS = ('solution', 'history')
+
+# Simulated state of the types that is copied back from the workers
+STATE_VARS = ('aLvlNow', 'aNrmNow', 'pLvlNow', 'mNrmNow', 'cNrmNow', 'MPCnow', 'TranShkNow',
+              'PermShkNow', 'EmpNow', 't_age', 't_cycle')
+
+
+def _SimulateType(task):
+    '''
+    Solves one type and simulates it for act_T periods.
+
+    Parameters
+    ----------
+    task : tuple
+        (index of the type, type, act_T, PopGroFac, keep, whether to solve
+        the type or to use its solution, stream)
+
+    Returns
+    -------
+    (index of the type, solution, dict with the per-period data: 'CapAgg'
+    and 'IncAgg' (act_T,) and the arrays (act_T x AgentCount, or
+    1 x AgentCount for the last period if stream) of KEEP_VARS[keep],
+    dict with the type's STATE_VARS in the last period)
+    '''
+    n, agent, act_T, PopGroFac, keep, solve, stream = task
+    if solve:
+        agent.solve()
+    agent.reset()
+
+    CapAgg = np.zeros(act_T)
+    IncAgg = np.zeros(act_T)
+    hist = {name: [] for name in KEEP_VARS[keep]}
+    for t in range(act_T):
+        agent.marketAction()
+        CohortWeight = PopGroFac**(-agent.t_age)
+        CapAgg[t] = np.sum(agent.aLvlNow*CohortWeight)
+        IncAgg[t] = np.sum(agent.pLvlNow*agent.TranShkNow*CohortWeight)
+        if not stream or t == act_T - 1:
+            for name in KEEP_VARS[keep]:
+                hist[name].append(np.copy(getattr(agent, name)))
+
+    reduced = {name: np.array(hist[name]) for name in KEEP_VARS[keep]}
+    reduced['CapAgg'] = CapAgg
+    reduced['IncAgg'] = IncAgg
+    state = {name: getattr(agent, name) for name in STATE_VARS if hasattr(agent, name)}
+    return n, agent.solution, reduced, state
+
+
+def simulateTypes(agents, act_T, PopGroFac, keep='KY', workers=None, solve=None, stream=False):
+    '''
+    Solves and simulates all types, in parallel when workers > 1. The
+    solutions and the simulated state of the last period are stored in the
+    types, in their order.
+
+    Parameters
+    ----------
+    agents : list of AgentType
+    act_T : int
+        number of periods to simulate
+    PopGroFac : float
+        population growth factor, for the cohort weights
+    keep : str
+        statistics the data is needed for, a key of KEEP_VARS
+    workers : int
+        number of processes; None uses the number of processors
+    solve : list of bool
+        whether to solve each type; types that are not solved are
+        simulated with the solution they have. All are solved if None.
+    stream : bool
+        keep the per-agent data of the last period only
+
+    Returns
+    -------
+    list with the per-period data of each type, see _SimulateType
+    '''
+    if keep not in KEEP_VARS:
+        raise ValueError('Unknown statistics level: ' + str(keep))
+    if workers is None:
+        workers = cpu_count()
+    workers = max(min(int(workers), len(agents)), 1)
+    if solve is None:
+        solve = [True]*len(agents)
+
+    tasks = []
+    for n, agent in enumerate(agents):
+        task_agent = agent
+        if workers > 1:
+            task_agent = copy(agent)
+            for name in DROP_VARS:
+                if solve[n] or name != 'solution':
+                    task_agent.__dict__.pop(name, None)
+        tasks.append((n, task_agent, act_T, PopGroFac, keep, solve[n], stream))
+
+    results = [None]*len(agents)
+    if workers == 1:
+        for task in tasks:
+            n, solution, reduced, state = _SimulateType(task)
+            results[n] = reduced
+        return results
+
+    pool = Pool(processes=workers)
+    try:
+        for n, solution, reduced, state in pool.imap_unordered(_SimulateType, tasks):
+            agents[n].solution = solution
+            for name, value in state.items():
+                setattr(agents[n], name, value)
+            results[n] = reduced
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def reapedVars(results, t, keep):
+    '''
+    The kept variables of the market's reaped variables in period t, one
+    array per type, from the data returned by simulateTypes (t=-1 for the
+    last period, the only one kept with stream=True). The capital to income
+    ratio is given by KYratio.
+    '''
+    return {name: [reduced[name][t] for reduced in results] for name in KEEP_VARS[keep]}
+
+
+def KYratio(results, t):
+    '''
+    Capital to income ratio of the economy in period t, from the data
+    returned by simulateTypes.
+    '''
+    return (np.sum([reduced['CapAgg'][t] for reduced in results])
+            / np.sum([reduced['IncAgg'][t] for reduced in results]))
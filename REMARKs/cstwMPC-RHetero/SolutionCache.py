@@ -0,0 +1,95 @@
+'''
+Reuse of infinite horizon solutions across the parameter searches.
+
+The golden search on the spread and the brentq search on the centre of the
+discount factor distribution solve the same agent types again and again,
+for discount factors that are often repeated (bracketing points) or very
+close to earlier ones. SolutionCache keeps the solution of each type by its
+parameters: a type whose parameters were solved before gets that solution
+back without solving, and otherwise can start its fixed point iteration
+from the solution of the same type at the nearest value of the searched
+parameter instead of from the terminal period.
+'''
+from __future__ import division, print_function
+
+import numpy as np
+
+# Parameters that determine the solution of a cstwMPCagent
+SOLUTION_PARAMS = ('DiscFac', 'Rsave', 'Rboro', 'CRRA', 'LivPrb', 'PermGroFac', 'PermShkStd',
+                   'TranShkStd', 'PermShkCount', 'TranShkCount', 'UnempPrb', 'IncUnemp', 'IndL',
+                   'BoroCnstArt', 'aXtraMin', 'aXtraMax', 'aXtraCount', 'aXtraNestFac', 'aXtraExtra',
+                   'CubicBool', 'vFuncBool', 'cycles', 'T_cycle')
+
+
+def _Value(value):
+    '''
+    Hashable version of a parameter value.
+    '''
+    if value is None or np.isscalar(value):
+        return value
+    return tuple(_Value(x) for x in np.ravel(np.asarray(value, dtype=object)))
+
+
+class SolutionCache(object):
+    '''
+    Solutions of agent types keyed by their parameters.
+
+    Parameters
+    ----------
+    params : sequence of str
+        parameters that determine a solution
+    max_per_family : int
+        number of solutions kept for the types that only differ in the
+        searched parameter; the oldest are dropped first
+    '''
+    def __init__(self, params=SOLUTION_PARAMS, max_per_family=50):
+        self.params = tuple(params)
+        self.max_per_family = max_per_family
+        self.families = {}
+        self.hits = 0
+        self.misses = 0
+
+    def keys(self, agent, warm_param):
+        '''
+        Key of the type's family (all parameters but warm_param) and its
+        value of warm_param.
+        '''
+        family = tuple((name, _Value(getattr(agent, name, None)))
+                       for name in self.params if name != warm_param)
+        return family, _Value(getattr(agent, warm_param, None))
+
+    def get(self, agent, warm_param='DiscFac'):
+        '''
+        Solution of a type with the same parameters, None if there is none.
+        '''
+        family, value = self.keys(agent, warm_param)
+        for cached_value, solution in self.families.get(family, []):
+            if cached_value == value:
+                self.hits += 1
+                return solution
+        self.misses += 1
+        return None
+
+    def nearest(self, agent, warm_param='DiscFac'):
+        '''
+        Solution of the type of the same family with the nearest value of
+        warm_param, None if there is none.
+        '''
+        family, value = self.keys(agent, warm_param)
+        entries = self.families.get(family, [])
+        if len(entries) == 0:
+            return None
+        try:
+            distances = [abs(float(cached_value) - float(value)) for cached_value, solution in entries]
+        except (TypeError, ValueError):
+            return entries[-1][1]
+        return entries[int(np.argmin(distances))][1]
+
+    def store(self, agent, warm_param='DiscFac'):
+        '''
+        Keeps the current solution of the type.
+        '''
+        family, value = self.keys(agent, warm_param)
+        entries = [entry for entry in self.families.get(family, []) if entry[0] != value]
+        entries.append((value, agent.solution))
+        self.families[family] = entries[-self.max_per_family:]
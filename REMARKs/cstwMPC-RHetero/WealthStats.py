@@ -0,0 +1,164 @@
+'''
+Statistics of a (weighted) wealth distribution that sort the data once.
+
+WealthDistribution sorts wealth and keeps the cumulative sums of the weights
+and of weighted wealth; Lorenz shares, weighted percentiles, the Gini
+coefficient and averages of another variable by wealth bracket are then
+interpolations or differences of those cumulative sums. The results equal
+those of HARK.utilities' getLorenzShares, getPercentiles and calcSubpopAvg.
+The data can be a sample of agents (equal or cohort weights) or the nodes
+of a histogram with their masses, and new data, e.g. a new simulated
+period, can be merged into a distribution without sorting it again.
+
+The cstwMPC-RHetero and KrusellSmith REMARKs ship identical copies of this
+module, so that each can be run from its own directory.
+'''
+from __future__ import division, print_function
+
+import numpy as np
+
+
+class WealthDistribution(object):
+    '''
+    A sorted, weighted sample of wealth (or of any other variable).
+
+    Parameters
+    ----------
+    values : np.array
+        wealth of each agent or histogram node
+    weights : np.array
+        weight of each value; equal weights if None
+    presorted : bool
+        whether values are already in increasing order
+    '''
+    def __init__(self, values, weights=None, presorted=False):
+        values = np.asarray(values, dtype=float).ravel()
+        weights = np.ones(values.size) if weights is None else np.asarray(weights, dtype=float).ravel()
+        if presorted:
+            self.order = np.arange(values.size)
+        else:
+            self.order = np.argsort(values, kind='stable')
+            values = values[self.order]
+            weights = weights[self.order]
+        self.values = values
+        self.weights = weights
+        self.updateCumulativeSums()
+
+    def updateCumulativeSums(self):
+        '''
+        Cumulative shares of the weights (cum_dist) and of weighted wealth
+        (cum_data) up to and including each sorted value.
+        '''
+        cum_weights = np.cumsum(self.weights)
+        cum_wealth = np.cumsum(self.values*self.weights)
+        self.total_weight = cum_weights[-1]
+        self.total_wealth = cum_wealth[-1]
+        self.cum_dist = cum_weights/self.total_weight
+        self.cum_data = cum_wealth/self.total_wealth
+
+    def add(self, values, weights=None):
+        '''
+        Merges more data into the distribution: only the new values are
+        sorted, then inserted into the sorted ones. The sort order of the
+        merged data (attribute order) is no longer meaningful afterwards.
+
+        Parameters
+        ----------
+        values : np.array
+        weights : np.array
+            equal weights (of one) if None
+        '''
+        values = np.asarray(values, dtype=float).ravel()
+        weights = np.ones(values.size) if weights is None else np.asarray(weights, dtype=float).ravel()
+        order = np.argsort(values, kind='stable')
+        position = np.searchsorted(self.values, values[order], side='right')
+        self.values = np.insert(self.values, position, values[order])
+        self.weights = np.insert(self.weights, position, weights[order])
+        self.order = None
+        self.updateCumulativeSums()
+
+    def lorenzShares(self, percentiles):
+        '''
+        Share of total wealth held by the poorest share p of the population,
+        for each p in percentiles.
+        '''
+        return np.interp(percentiles, self.cum_dist, self.cum_data)
+
+    def percentiles(self, percentiles):
+        '''
+        Weighted percentiles, nan for percentiles below the weight of the
+        smallest value (as getPercentiles).
+        '''
+        percentiles = np.asarray(percentiles, dtype=float)
+        out = np.interp(percentiles, self.cum_dist, self.values)
+        return np.where((percentiles < self.cum_dist[0]) | (percentiles > self.cum_dist[-1]),
+                        np.nan, out)
+
+    def gini(self):
+        '''
+        Gini coefficient, one minus twice the area under the Lorenz curve of
+        the (step) distribution.
+        '''
+        cum_data_prev = np.concatenate(([0.], self.cum_data[:-1]))
+        return 1. - np.sum(self.weights/self.total_weight*(self.cum_data + cum_data_prev))
+
+    def sorted(self, data):
+        '''
+        Data of the same agents in the order of sorted wealth.
+        '''
+        return np.asarray(data)[self.order]
+
+    def subpopAvg(self, data, cutoffs, presorted=False):
+        '''
+        Weighted average of data among the agents whose wealth is between
+        the percentiles in each pair of cutoffs (as calcSubpopAvg with wealth
+        as reference): the agents whose cumulative weight share is at least
+        the bottom and below the top cutoff, or up to the richest agent for a
+        top cutoff of 1 whatever the rounding of the cumulative shares.
+
+        Parameters
+        ----------
+        data : np.array
+            variable to average, e.g. MPCs, for the same agents as values
+        cutoffs : list of tuples
+            (bottom, top) percentiles of each bracket
+        presorted : bool
+            whether data is already in the order of sorted wealth
+
+        Returns
+        -------
+        np.array with one average per bracket
+        '''
+        data = np.asarray(data, dtype=float) if presorted else self.sorted(data).astype(float)
+        cum_data = np.concatenate(([0.], np.cumsum(data*self.weights)))
+        cum_weights = np.concatenate(([0.], np.cumsum(self.weights)))
+
+        bounds = np.asarray(cutoffs, dtype=float).reshape(-1, 2)
+        bot = np.clip(np.searchsorted(self.cum_dist, bounds[:, 0]), 0, self.values.size)
+        top = np.clip(np.searchsorted(self.cum_dist, bounds[:, 1]), 0, self.values.size)
+        top[bounds[:, 1] >= 1.] = self.values.size
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (cum_data[top] - cum_data[bot])/(cum_weights[top] - cum_weights[bot])
+
+    def bracketShares(self, cuts, these=None):
+        '''
+        Distribution over wealth brackets, e.g. quintiles, of the weight of
+        a subpopulation.
+
+        Parameters
+        ----------
+        cuts : np.array
+            upper bounds of all brackets but the top one; bracket q has the
+            values above cuts[q-1] and at most cuts[q]
+        these : np.array of bool
+            subpopulation in the order of sorted wealth, everyone if None
+
+        Returns
+        -------
+        np.array (len(cuts) + 1,)
+            share of the subpopulation's weight in each bracket
+        '''
+        bracket = np.searchsorted(cuts, self.values, side='left')
+        weights = self.weights if these is None else np.where(these, self.weights, 0.)
+        shares = np.bincount(bracket, weights, minlength=len(cuts) + 1)
+        return shares/np.sum(weights)
@@ -13,10 +13,13 @@ import numpy as np
 from copy import copy, deepcopy
 from time import time
 from HARK.utilities import approxMeanOneLognormal, combineIndepDstns, approxUniform, \
-                           getPercentiles, getLorenzShares, calcSubpopAvg, approxLognormal
+                           getLorenzShares, approxLognormal
 from HARK.simulation import drawDiscrete
 from HARK import Market
 import Calibration.SetupParams as Params
+from WealthStats import WealthDistribution
+from ParallelTypes import simulateTypes, reapedVars, KYratio
+from SolutionCache import SolutionCache
 import HARK.ConsumptionSaving.ConsIndShockModel as Model
 from scipy.optimize import brentq
 import matplotlib.pyplot as plt
@@ -64,6 +67,18 @@ class cstwMPCagent(Model.KinkedRconsumerType):
             self.aLvlNow = self.kInit*np.ones(self.AgentCount) # Start simulation near SS
             self.aNrmNow = self.aLvlNow/self.pLvlNow
 
+    def updateSolutionTerminal(self):
+        '''
+        Starts the infinite horizon solution from solution_warm, a solution of a
+        similar type, if there is one, and from the terminal period otherwise.
+        A lifecycle type (cycles > 0) always starts from the terminal period:
+        its backward induction cannot start from another type's first period.
+        '''
+        if self.cycles == 0 and getattr(self,'solution_warm',None) is not None:
+            self.solution_terminal = deepcopy(self.solution_warm)
+        else:
+            Model.KinkedRconsumerType.updateSolutionTerminal(self)
+
     def marketAction(self):
         if hasattr(self,'kGrid'):
             self.pLvl = self.pLvlNow/np.mean(self.pLvlNow)
@@ -117,19 +132,141 @@ class cstwMPCmarket(EstimationMarketClass):
         # Save the current file's directory location for writing output:
         self.my_file_path = os.path.dirname(os.path.abspath(__file__))
 
+        # Solutions of the types, reused across the parameter searches
+        self.solution_cache = SolutionCache()
+        self.warm_param = 'DiscFac'
+
         
     def solve(self):
         '''
         Solves the cstwMPCmarket.
         '''
+        self.streamed = False
         if self.AggShockBool:
             for agent in self.agents:
                 agent.getEconomyData(self)
             Market.solve(self)
+        elif self.workers is None or self.workers > 1 or self.stream_stats:
+            self.makeHistoryByType()
         else:
             self.solveAgents()
             self.makeHistory()
 
+    def reuseSolutions(self):
+        '''
+        Gives each type the cached solution for its parameters or, if there is
+        none, the cached solution of the same type at the nearest value of the
+        parameter being searched (self.warm_param) as starting point of its
+        solution, for infinite horizon types (cycles == 0) only. Only without
+        aggregate shocks and if self.reuse_solutions,
+        as the solutions depend on the aggregate saving rule otherwise.
+
+        Returns
+        -------
+        unsolved : [bool]
+            Whether each type still has to be solved.
+        '''
+        reuse = self.reuse_solutions and not self.AggShockBool
+        unsolved = []
+        for agent in self.agents:
+            solution = self.solution_cache.get(agent,self.warm_param) if reuse else None
+            agent.solution_warm = None
+            if solution is not None:
+                agent.solution = solution
+            elif reuse and agent.cycles == 0:
+                nearest = self.solution_cache.nearest(agent,self.warm_param)
+                if nearest is not None:
+                    agent.solution_warm = nearest[0]
+            agent.updateSolutionTerminal()
+            unsolved.append(solution is None)
+        return unsolved
+
+    def storeSolutions(self,unsolved):
+        '''
+        Adds the new solutions of the types to the cache.
+        '''
+        if self.reuse_solutions and not self.AggShockBool:
+            for agent, new in zip(self.agents,unsolved):
+                if new:
+                    self.solution_cache.store(agent,self.warm_param)
+
+    def solveAgents(self):
+        '''
+        Solves the types that have no cached solution, see reuseSolutions.
+        '''
+        unsolved = self.reuseSolutions()
+        for agent, new in zip(self.agents,unsolved):
+            if new:
+                agent.solve()
+        self.storeSolutions(unsolved)
+
+    def makeHistoryByType(self):
+        '''
+        Solves and simulates the agent types in a pool of self.workers processes
+        (see ParallelTypes), then calculates the statistics of each period from
+        the data returned for it, as makeHistory does. Only used without
+        aggregate shocks, when the types do not interact.
+
+        The types only return the data that the requested statistics need: the
+        capital to income ratio comes from their capital and income (KYratio),
+        the other statistics from calcDistributionStats. The types in self.agents
+        hold their simulated state of the last period afterwards, as after
+        makeHistory.
+
+        If self.stream_stats, the types only keep their agents' data of the last
+        period, besides their capital and income in every period: the capital to
+        income ratio still has a history over all periods, the other statistics
+        are calculated once from the last period's cross section.
+        '''
+        if self.ManyStatsBool:
+            keep = 'All'
+        elif self.LorenzBool:
+            keep = 'Lorenz'
+        else:
+            keep = 'KY'
+        unsolved = self.reuseSolutions()
+        results = simulateTypes(self.agents,self.act_T,self.PopGroFac,keep,self.workers,solve=unsolved,
+                                stream=self.stream_stats)
+        self.storeSolutions(unsolved)
+
+        self.MaggNow = 0.0 # These variables are tracked but not created in no-agg-shocks specifications
+        self.AaggNow = 0.0
+        self.streamed = self.stream_stats
+        if self.streamed:
+            self.KtoYnow = KYratio(results,-1)
+            self.calcDistributionStats(self.LorenzBool,self.ManyStatsBool,**reapedVars(results,-1,keep))
+            for var_name in self.track_vars:
+                setattr(self,var_name + '_hist',[getattr(self,var_name)])
+            self.KtoYnow_hist = [KYratio(results,t) for t in range(self.act_T)]
+            return
+
+        for var_name in self.track_vars:
+            setattr(self,var_name + '_hist',[])
+        for t in range(self.act_T):
+            self.KtoYnow = KYratio(results,t)
+            self.calcDistributionStats(self.LorenzBool,self.ManyStatsBool,**reapedVars(results,t,keep))
+            self.store()
+
+    def statsHistory(self,var_name):
+        '''
+        History of a tracked statistic without the first ignore_periods periods.
+        After a streamed history (see makeHistoryByType) the statistics other than
+        KtoYnow are of the last period only and returned as they are.
+
+        Parameters
+        ----------
+        var_name : string
+            Name of the statistic, one of self.track_vars.
+
+        Returns
+        -------
+        np.array with one row per period
+        '''
+        hist = np.array(getattr(self,var_name + '_hist'))
+        if getattr(self,'streamed',False) and var_name != 'KtoYnow':
+            return hist
+        return hist[self.ignore_periods:]
+
     def millRule(self,aLvlNow,pLvlNow,MPCnow,TranShkNow,EmpNow,t_age,LorenzBool,ManyStatsBool):
         '''
         The millRule for this class simply calls the method calcStats.
@@ -170,45 +307,57 @@ class cstwMPCmarket(EstimationMarketClass):
         -------
         None
         '''
-        # Combine inputs into single arrays
-        aLvl = np.hstack(aLvlNow)
-        pLvl = np.hstack(pLvlNow)
-        age  = np.hstack(t_age)
-        TranShk = np.hstack(TranShkNow)
-        Emp = np.hstack(EmpNow)
-
         # Calculate the capital to income ratio in the economy
-        CohortWeight = self.PopGroFac**(-age)
+        aLvl = np.hstack(aLvlNow)
+        CohortWeight = self.PopGroFac**(-np.hstack(t_age))
         CapAgg = np.sum(aLvl*CohortWeight)
-        IncAgg = np.sum(pLvl*TranShk*CohortWeight)
+        IncAgg = np.sum(np.hstack(pLvlNow)*np.hstack(TranShkNow)*CohortWeight)
         KtoYnow = CapAgg/IncAgg
         self.KtoYnow = KtoYnow
 
-        # Store Lorenz data if requested
+        self.calcDistributionStats(LorenzBool,ManyStatsBool,aLvlNow,pLvlNow,MPCnow,TranShkNow,EmpNow,t_age)
+
+    def calcDistributionStats(self,LorenzBool,ManyStatsBool,aLvlNow=None,pLvlNow=None,MPCnow=None,
+                              TranShkNow=None,EmpNow=None,t_age=None):
+        '''
+        Calculate the statistics of calcStats other than the capital to income ratio:
+        the Lorenz points and the "many statistics" of the current population.
+
+        Parameters
+        ----------
+        LorenzBool: bool
+            Indicator for whether the Lorenz target points should be calculated.
+        ManyStatsBool: bool
+            Indicator for whether a lot of statistics for tables should be calculated.
+        aLvlNow, pLvlNow, MPCnow, TranShkNow, EmpNow, t_age : [np.array]
+            As in calcStats. The Lorenz points only need aLvlNow and t_age, and
+            no data is needed if neither kind of statistics is requested.
+
+        Returns
+        -------
+        None
+        '''
+        # Store Lorenz data if requested; wealth is sorted once for all statistics
         self.LorenzLong = np.nan
+        if LorenzBool or ManyStatsBool:
+            wealth = WealthDistribution(np.hstack(aLvlNow),weights=self.PopGroFac**(-np.hstack(t_age)))
         if LorenzBool:
-            order = np.argsort(aLvl)
-            aLvl = aLvl[order]
-            CohortWeight = CohortWeight[order]
-            wealth_shares = getLorenzShares(aLvl,weights=CohortWeight,percentiles=self.LorenzPercentiles,presorted=True)
-            self.Lorenz = wealth_shares
+            self.Lorenz = wealth.lorenzShares(self.LorenzPercentiles)
             if ManyStatsBool:
-                self.LorenzLong = getLorenzShares(aLvl,weights=CohortWeight,percentiles=np.arange(0.01,1.0,0.01),presorted=True)
+                self.LorenzLong = wealth.lorenzShares(np.arange(0.01,1.0,0.01))
         else:
             self.Lorenz = np.nan # Store nothing if we don't want Lorenz data
 
         # Calculate a whole bunch of statistics if requested
         if ManyStatsBool:
-            # Reshape other inputs
-            MPC  = np.hstack(MPCnow)
-
-            # Sort other data items if aLvl and CohortWeight were sorted
-            if LorenzBool:
-                pLvl = pLvl[order]
-                MPC  = MPC[order]
-                TranShk = TranShk[order]
-                age = age[order]
-                Emp = Emp[order]
+            # Put all inputs in the order of sorted wealth
+            aLvl = wealth.values
+            CohortWeight = wealth.weights
+            pLvl = wealth.sorted(np.hstack(pLvlNow))
+            MPC  = wealth.sorted(np.hstack(MPCnow))
+            TranShk = wealth.sorted(np.hstack(TranShkNow))
+            age = wealth.sorted(np.hstack(t_age))
+            Emp = wealth.sorted(np.hstack(EmpNow))
             aNrm = aLvl/pLvl # Normalized assets (wealth ratio)
             IncLvl = TranShk*pLvl # Labor income this period
 
@@ -226,25 +375,13 @@ class cstwMPCmarket(EstimationMarketClass):
             self.MPCunemployed = np.sum(MPCannual[unemployed]*CohortWeight[unemployed])/np.sum(CohortWeight[unemployed])
             self.MPCemployed   = np.sum(MPCannual[employed]*CohortWeight[employed])/np.sum(CohortWeight[employed])
             self.MPCretired    = np.sum(MPCannual[retired]*CohortWeight[retired])/np.sum(CohortWeight[retired])
-            self.MPCbyWealthRatio = calcSubpopAvg(MPCannual,aNrm,self.cutoffs,CohortWeight)
-            self.MPCbyIncome      = calcSubpopAvg(MPCannual,IncLvl,self.cutoffs,CohortWeight)
+            self.MPCbyWealthRatio = WealthDistribution(aNrm,weights=CohortWeight).subpopAvg(MPCannual,self.cutoffs)
+            self.MPCbyIncome      = WealthDistribution(IncLvl,weights=CohortWeight).subpopAvg(MPCannual,self.cutoffs)
 
             # Calculate the wealth quintile distribution of "hand to mouth" consumers
-            quintile_cuts = getPercentiles(aLvl,weights=CohortWeight,percentiles=[0.2, 0.4, 0.6, 0.8])
-            wealth_quintiles = np.ones(aLvl.size,dtype=int)
-            wealth_quintiles[aLvl > quintile_cuts[0]] = 2
-            wealth_quintiles[aLvl > quintile_cuts[1]] = 3
-            wealth_quintiles[aLvl > quintile_cuts[2]] = 4
-            wealth_quintiles[aLvl > quintile_cuts[3]] = 5
-            MPC_cutoff = getPercentiles(MPCannual,weights=CohortWeight,percentiles=[2.0/3.0]) # Looking at consumers with MPCs in the top 1/3
-            these = MPCannual > MPC_cutoff
-            in_top_third_MPC = wealth_quintiles[these]
-            temp_weights = CohortWeight[these]
-            hand_to_mouth_total = np.sum(temp_weights)
-            hand_to_mouth_pct = []
-            for q in range(1,6):
-                hand_to_mouth_pct.append(np.sum(temp_weights[in_top_third_MPC == q])/hand_to_mouth_total)
-            self.HandToMouthPct = np.array(hand_to_mouth_pct)
+            quintile_cuts = wealth.percentiles([0.2, 0.4, 0.6, 0.8])
+            MPC_cutoff = WealthDistribution(MPCannual,weights=CohortWeight).percentiles([2.0/3.0]) # Looking at consumers with MPCs in the top 1/3
+            self.HandToMouthPct = wealth.bracketShares(quintile_cuts,these=MPCannual > MPC_cutoff)
 
         else: # If we don't want these stats, just put empty values in history
             self.MPCall = np.nan
@@ -287,6 +424,7 @@ class cstwMPCmarket(EstimationMarketClass):
 
         # Distribute the parameters to the various types, assigning consecutive types the same
         # value if there are more types than values
+        self.warm_param = param_name # Cached solutions are matched on the other parameters
         replication_factor = len(self.agents) // param_count 
             # Note: the double division is intenger division in Python 3 and 2.7, this makes it explicit
         j = 0
@@ -294,7 +432,7 @@ class cstwMPCmarket(EstimationMarketClass):
         while j < len(self.agents):
             for n in range(replication_factor):
                 self.agents[j](AgentCount = int(self.Population*param_dist[0][b]*self.TypeWeight[n]))
-                exec('self.agents[j](' + param_name + '= param_dist[1][b])')
+                self.agents[j](**{param_name: param_dist[1][b]})
                 j += 1
             b += 1
 
@@ -313,7 +451,7 @@ class cstwMPCmarket(EstimationMarketClass):
             Difference between simulated and target capital to income ratio.
         '''
         # Ignore the first X periods to allow economy to stabilize from initial conditions
-        KYratioSim = np.mean(np.array(self.KtoYnow_hist)[self.ignore_periods:])
+        KYratioSim = np.mean(self.statsHistory('KtoYnow'))
         diff = KYratioSim - self.KYratioTarget
         return diff
 
@@ -330,7 +468,7 @@ class cstwMPCmarket(EstimationMarketClass):
         dist : float
             Sum of squared distances between simulated and target Lorenz points (sqrt)
         '''
-        LorenzSim = np.mean(np.array(self.Lorenz_hist)[self.ignore_periods:,:],axis=0)
+        LorenzSim = np.mean(self.statsHistory('Lorenz'),axis=0)
         dist = np.sqrt(np.sum((100*(LorenzSim - self.LorenzTarget))**2))
         self.LorenzDistance = dist
         return dist
@@ -350,15 +488,15 @@ class cstwMPCmarket(EstimationMarketClass):
         None
         '''
         # Calculate MPC overall and by subpopulations
-        MPCall = np.mean(self.MPCall_hist[self.ignore_periods:])
-        MPCemployed = np.mean(self.MPCemployed_hist[self.ignore_periods:])
-        MPCunemployed = np.mean(self.MPCunemployed_hist[self.ignore_periods:])
-        MPCretired = np.mean(self.MPCretired_hist[self.ignore_periods:])
-        MPCbyIncome = np.mean(np.array(self.MPCbyIncome_hist)[self.ignore_periods:,:],axis=0)
-        MPCbyWealthRatio = np.mean(np.array(self.MPCbyWealthRatio_hist)[self.ignore_periods:,:],axis=0)
-        HandToMouthPct = np.mean(np.array(self.HandToMouthPct_hist)[self.ignore_periods:,:],axis=0)
-
-        LorenzSim = np.hstack((np.array(0.0),np.mean(np.array(self.LorenzLong_hist)[self.ignore_periods:,:],axis=0),np.array(1.0)))
+        MPCall = np.mean(self.statsHistory('MPCall'))
+        MPCemployed = np.mean(self.statsHistory('MPCemployed'))
+        MPCunemployed = np.mean(self.statsHistory('MPCunemployed'))
+        MPCretired = np.mean(self.statsHistory('MPCretired'))
+        MPCbyIncome = np.mean(self.statsHistory('MPCbyIncome'),axis=0)
+        MPCbyWealthRatio = np.mean(self.statsHistory('MPCbyWealthRatio'),axis=0)
+        HandToMouthPct = np.mean(self.statsHistory('HandToMouthPct'),axis=0)
+
+        LorenzSim = np.hstack((np.array(0.0),np.mean(self.statsHistory('LorenzLong'),axis=0),np.array(1.0)))
         LorenzAxis = np.arange(101,dtype=float)
         plt.plot(LorenzAxis,self.LorenzData,'-k',linewidth=1.5)
         plt.plot(LorenzAxis,LorenzSim,'--k',linewidth=1.5)
@@ -479,8 +617,7 @@ def findLorenzDistanceAtTargetKY(Economy,param_name,param_count,center_range,spr
     # Get the sum of squared Lorenz distances given the correct distribution of the parameter
     Economy(LorenzBool = True) # Make sure we actually calculate simulated Lorenz points
     Economy.distributeParams(param_name,param_count,optimal_center,spread,dist_type) # Distribute parameters
-    Economy.solveAgents()
-    Economy.makeHistory()
+    Economy.solve()
     dist = Economy.calcLorenzDistance()
     Economy(LorenzBool = False)
     print ('findLorenzDistanceAtTargetKY tried spread = ' + str(spread) + ' and got ' + str(dist))
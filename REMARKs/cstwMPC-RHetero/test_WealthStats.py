@@ -0,0 +1,62 @@
+'''
+Checks of WealthStats against brute force versions of the same statistics.
+Run with pytest or as a script.
+'''
+from __future__ import division, print_function
+
+import numpy as np
+from WealthStats import WealthDistribution
+
+# Brackets of cstwMPC, including the 0.0 and 1.0 cutoffs
+CUTOFFS = [(0.99, 1), (0.9, 1), (0.8, 1), (0.6, 0.8), (0.4, 0.6), (0.2, 0.4), (0.0, 0.2)]
+
+
+def makeSample(N=20000, seed=0):
+    RNG = np.random.RandomState(seed)
+    wealth = RNG.lognormal(mean=0.0, sigma=1.0, size=N)
+    weights = RNG.uniform(0.5, 1.5, size=N)
+    data = RNG.uniform(size=N)
+    return wealth, weights, data
+
+
+def bruteSubpopAvg(data, wealth, weights, cutoffs):
+    '''
+    Bracket averages by masking the agents on their cumulative weight share;
+    a top cutoff of 1 includes the richest agent.
+    '''
+    order = np.argsort(wealth, kind='stable')
+    cum_dist = np.cumsum(weights[order])/np.sum(weights)
+    out = []
+    for bot, top in cutoffs:
+        these = (cum_dist >= bot) & ((cum_dist < top) | (top >= 1))
+        out.append(np.sum(data[order][these]*weights[order][these])/np.sum(weights[order][these]))
+    return np.array(out)
+
+
+def test_subpopAvg():
+    wealth, weights, data = makeSample()
+    dstn = WealthDistribution(wealth, weights=weights)
+    for var in (data, wealth):
+        assert np.allclose(dstn.subpopAvg(var, CUTOFFS), bruteSubpopAvg(var, wealth, weights, CUTOFFS),
+                           rtol=1e-12, atol=0.)
+
+    # The bottom quintile of wealth by value, independently of cumulative shares
+    bottom = wealth <= np.percentile(wealth, 20)
+    avg = dstn.subpopAvg(wealth, [(0.0, 0.2)])[0]
+    assert abs(avg - np.mean(wealth[bottom])) < 0.02
+
+
+def test_lorenzShares():
+    wealth, weights, data = makeSample()
+    dstn = WealthDistribution(wealth, weights=weights)
+    order = np.argsort(wealth)
+    cum_dist = np.cumsum(weights[order])/np.sum(weights)
+    cum_data = np.cumsum(wealth[order]*weights[order])/np.sum(wealth*weights)
+    pctiles = np.array([0.2, 0.4, 0.6, 0.8])
+    assert np.allclose(dstn.lorenzShares(pctiles), np.interp(pctiles, cum_dist, cum_data), rtol=1e-12)
+
+
+if __name__ == '__main__':
+    test_subpopAvg()
+    test_lorenzShares()
+    print('WealthStats checks passed')